@@ -0,0 +1,302 @@
+"""
+Inter-rater agreement analytics.
+
+Keeps a case x reader rating matrix per question (q1_acceptability,
+q2_confidence) in NumPy arrays, together with per-case category counts, and
+computes from them in vectorized form:
+
+- Fleiss' kappa (generalized to a varying number of readers per case)
+- Krippendorff's alpha (nominal, ordinal or interval distances)
+- per-case mean and variance
+- per-reader bias: mean difference between a reader's rating and the mean
+  of the other readers of the same case
+
+The matrix is not rebuilt per request: every refresh pulls only the
+evaluations and tombstones recorded since the previous one through the same
+keyset as the delta export (exports.delta_rows), so submissions made on any
+worker show up within DELTA_SETTLE_SECONDS. Results are cached until the
+next change. Like the composite cache, the state is per process.
+
+Requires NumPy.
+"""
+from typing import Optional
+import threading
+
+from sqlalchemy.orm import Session
+
+import exports
+
+# Rating columns and their number of categories (values 1..K)
+QUESTIONS = {"q1_acceptability": 4, "q2_confidence": 5}
+LEVELS = ("nominal", "ordinal", "interval")
+REFRESH_BATCH_SIZE = exports.DELTA_MAX_LIMIT
+_INITIAL_CAPACITY = 64
+
+
+def available() -> bool:
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def fleiss_kappa(counts) -> Optional[float]:
+    """counts: cases x categories; cases with fewer than two ratings are left out"""
+    import numpy as np
+
+    n = counts.sum(axis=1)
+    counts, n = counts[n >= 2].astype(np.float64), n[n >= 2]
+    if not len(n):
+        return None
+    agreement = (counts * (counts - 1)).sum(axis=1) / (n * (n - 1))
+    proportions = counts.sum(axis=0) / n.sum()
+    expected = (proportions ** 2).sum()
+    if expected >= 1:
+        return None  # a single category was used: agreement is undefined
+    return float((agreement.mean() - expected) / (1 - expected))
+
+
+def _distances(totals, level: str):
+    """Squared distance between every pair of categories (metric delta^2 of Krippendorff)"""
+    import numpy as np
+
+    k = len(totals)
+    values = np.arange(1, k + 1, dtype=np.float64)
+    if level == "nominal":
+        return 1.0 - np.eye(k)
+    if level == "interval":
+        return (values[:, None] - values[None, :]) ** 2
+    # ordinal: ranks are the marginal totals between the two categories
+    cumulative = np.cumsum(totals)
+    low = np.minimum.outer(np.arange(k), np.arange(k))
+    high = np.maximum.outer(np.arange(k), np.arange(k))
+    between = cumulative[high] - cumulative[low] + totals[low]
+    return (between - (totals[:, None] + totals[None, :]) / 2) ** 2
+
+
+def krippendorff_alpha(counts, level: str = "ordinal") -> Optional[float]:
+    """counts: cases x categories; only cases with at least two ratings are pairable"""
+    import numpy as np
+
+    n_case = counts.sum(axis=1)
+    pairable = n_case >= 2
+    counts, n_case = counts[pairable].astype(np.float64), n_case[pairable]
+    if not len(n_case):
+        return None
+    weighted = counts / (n_case - 1)[:, None]
+    coincidences = weighted.T @ counts - np.diag(weighted.sum(axis=0))
+    totals = coincidences.sum(axis=1)
+    n = totals.sum()
+    distances = _distances(totals, level)
+    observed = (coincidences * distances).sum() / n
+    expected = (np.outer(totals, totals) * distances).sum() / (n * (n - 1))
+    if expected == 0:
+        return None
+    return float(1 - observed / expected)
+
+
+def case_moments(counts) -> tuple:
+    """Number of ratings, mean and sample variance per case (NaN where undefined)"""
+    import numpy as np
+
+    values = np.arange(1, counts.shape[1] + 1, dtype=np.float64)
+    n = counts.sum(axis=1).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = counts @ values / n
+        variance = (counts @ values ** 2 - n * mean ** 2) / (n - 1)
+    variance[n < 2] = np.nan
+    return n, mean, np.maximum(variance, 0)
+
+
+def reader_bias(ratings, counts) -> tuple:
+    """
+    ratings: cases x readers (0 = not rated). Number of ratings, mean rating
+    and mean deviation from the other readers of each case, per reader.
+    """
+    import numpy as np
+
+    rated = ratings > 0
+    values = ratings.astype(np.float64)
+    n_case = counts.sum(axis=1).astype(np.float64)
+    case_sum = counts @ np.arange(1, counts.shape[1] + 1, dtype=np.float64)
+    others = n_case[:, None] - 1
+    comparable = rated & (others > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        others_mean = (case_sum[:, None] - values) / others
+        deviation = np.where(comparable, values - others_mean, 0.0)
+        n = rated.sum(axis=0)
+        mean = np.where(rated, values, 0.0).sum(axis=0) / n
+        bias = deviation.sum(axis=0) / comparable.sum(axis=0)
+    return n, mean, bias
+
+
+def _number(value) -> Optional[float]:
+    """NaN (undefined) as None, ready for JSON"""
+    return None if value != value else round(float(value), 6)
+
+
+class AgreementCache:
+    """Rating matrices updated incrementally from the evaluation change feed, plus cached reports"""
+
+    def __init__(self):
+        import numpy as np
+
+        self._lock = threading.Lock()
+        self._position = (None, None)  # delta keyset positions (evaluations, tombstones)
+        self._cases: dict[str, int] = {}
+        self._case_labels: list[str] = []
+        self._readers: dict[str, int] = {}
+        self._reader_emails: list[str] = []
+        self._cells: dict[str, tuple] = {}  # evaluation id -> (case row, reader column)
+        self._ratings = np.zeros((len(QUESTIONS), _INITIAL_CAPACITY, _INITIAL_CAPACITY), dtype=np.int8)
+        self._counts = [np.zeros((_INITIAL_CAPACITY, k), dtype=np.int32) for k in QUESTIONS.values()]
+        self._version = 0
+        self._reports: dict[str, dict] = {}  # level -> report for self._version
+
+    def refresh(self, db: Session) -> None:
+        """
+        Apply the evaluations and tombstones recorded since the last refresh.
+        The lock is not held during queries (async sessions run them on the
+        event loop); a concurrent refresh that got there first wins.
+        """
+        while True:
+            with self._lock:
+                position = self._position
+            rows, tombstones, has_more, eval_pos, tomb_pos = exports.delta_rows(
+                db, *position, REFRESH_BATCH_SIZE
+            )
+            with self._lock:
+                if self._position != position:
+                    return
+                if rows or tombstones:
+                    for row in rows:
+                        self._add(row)
+                    for tombstone in tombstones:
+                        self._remove(tombstone.evaluation_id)
+                    self._version += 1
+                    self._reports.clear()
+                self._position = (eval_pos, tomb_pos)
+            if not has_more:
+                return
+
+    def _index(self, row) -> tuple:
+        case = self._cases.get(row.case_id)
+        if case is None:
+            case = self._cases[row.case_id] = len(self._case_labels)
+            self._case_labels.append(exports.case_display_id(row.case_id, row.case_metadata))
+        reader = self._readers.get(row.user_id)
+        if reader is None:
+            reader = self._readers[row.user_id] = len(self._reader_emails)
+            self._reader_emails.append(row.email)
+        self._grow(case + 1, reader + 1)
+        return case, reader
+
+    def _grow(self, cases: int, readers: int) -> None:
+        """Double the capacity of the arrays that are too small"""
+        import numpy as np
+
+        _, case_capacity, reader_capacity = self._ratings.shape
+        if cases <= case_capacity and readers <= reader_capacity:
+            return
+        while case_capacity < cases:
+            case_capacity *= 2
+        while reader_capacity < readers:
+            reader_capacity *= 2
+        ratings = np.zeros((len(QUESTIONS), case_capacity, reader_capacity), dtype=np.int8)
+        ratings[:, :self._ratings.shape[1], :self._ratings.shape[2]] = self._ratings
+        self._ratings = ratings
+        for q, counts in enumerate(self._counts):
+            grown = np.zeros((case_capacity, counts.shape[1]), dtype=np.int32)
+            grown[:len(counts)] = counts
+            self._counts[q] = grown
+
+    def _set(self, case: int, reader: int, values: tuple) -> None:
+        for q, (value, k) in enumerate(zip(values, QUESTIONS.values())):
+            previous = self._ratings[q, case, reader]
+            if previous:
+                self._counts[q][case, previous - 1] -= 1
+            if not 1 <= value <= k:
+                value = 0  # out of scale, not counted
+            self._ratings[q, case, reader] = value
+            if value:
+                self._counts[q][case, value - 1] += 1
+
+    def _add(self, row) -> None:
+        case, reader = self._index(row)
+        self._cells[row.id] = (case, reader)
+        self._set(case, reader, tuple(getattr(row, question) for question in QUESTIONS))
+
+    def _remove(self, evaluation_id: str) -> None:
+        # Evaluations deleted before they were ever loaded are simply unknown
+        cell = self._cells.pop(evaluation_id, None)
+        if cell is not None:
+            self._set(*cell, (0,) * len(QUESTIONS))
+
+    def report(self, level: str = "ordinal") -> dict:
+        with self._lock:
+            cached = self._reports.get(level)
+            if cached is not None:
+                return cached
+            version = self._version
+            evaluations = len(self._cells)
+            n_cases, n_readers = len(self._case_labels), len(self._reader_emails)
+            ratings = self._ratings[:, :n_cases, :n_readers].copy()
+            counts = [c[:n_cases].copy() for c in self._counts]
+            case_labels = list(self._case_labels)
+            reader_ids = list(self._readers)
+            reader_emails = list(self._reader_emails)
+
+        questions = {}
+        for q, question in enumerate(QUESTIONS):
+            n_case, mean, variance = case_moments(counts[q])
+            n_reader, reader_mean, bias = reader_bias(ratings[q], counts[q])
+            questions[question] = {
+                "fleiss_kappa": fleiss_kappa(counts[q]),
+                "krippendorff_alpha": krippendorff_alpha(counts[q], level),
+                "cases": [
+                    {
+                        "case_id": case_labels[i],
+                        "ratings": int(n_case[i]),
+                        "mean": _number(mean[i]),
+                        "variance": _number(variance[i]),
+                    }
+                    for i in sorted(n_case.nonzero()[0], key=case_labels.__getitem__)
+                ],
+                "readers": [
+                    {
+                        "user_id": reader_ids[i],
+                        "email": reader_emails[i],
+                        "ratings": int(n_reader[i]),
+                        "mean": _number(reader_mean[i]),
+                        "bias": _number(bias[i]),
+                    }
+                    for i in sorted(n_reader.nonzero()[0], key=reader_emails.__getitem__)
+                ],
+            }
+
+        first = next(iter(questions.values()))
+        report = {
+            "level": level,
+            "evaluations": evaluations,
+            "cases": len(first["cases"]),
+            "readers": len(first["readers"]),
+            "questions": questions,
+        }
+        with self._lock:
+            if self._version == version:
+                self._reports[level] = report
+        return report
+
+
+_cache: Optional[AgreementCache] = None
+_cache_lock = threading.Lock()
+
+
+def agreement_cache() -> AgreementCache:
+    """The process-wide cache, created on first use (NumPy is only needed then)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AgreementCache()
+        return _cache
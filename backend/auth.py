@@ -1,5 +1,11 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import asyncio
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
@@ -7,25 +13,74 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import os
 
-from database import get_db, User
+from database import get_db, run_db, User, UserRole
 
 # Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-super-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated-user cache: verified token -> user identity and role
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "1024"))  # 0 disables the cache
+# Shared version stamp: touching this file invalidates the cache in every worker process
+AUTH_CACHE_STAMP = os.getenv(
+    "AUTH_CACHE_STAMP",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".auth_cache_stamp")
+)
+
+# Password hashing: bcrypt cost and the bounded pool that runs login verifications
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+# Verifications allowed to wait or run at once per process; beyond that logins get a 503
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+LOGIN_RETRY_AFTER_SECONDS = 2
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_pending_verifications = 0  # only touched from the event loop
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password on the bounded bcrypt pool without blocking the event loop.
+    Returns (valid, new_hash); new_hash is set when the stored hash uses an
+    outdated cost and should be replaced. Sheds load with a 503 when the pool
+    already has PASSWORD_QUEUE_LIMIT verifications pending.
+    """
+    global _pending_verifications
+    if _pending_verifications >= PASSWORD_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, please retry",
+            headers={"Retry-After": str(LOGIN_RETRY_AFTER_SECONDS)},
+        )
+    _pending_verifications += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _password_executor, pwd_context.verify_and_update, plain_password, hashed_password
+        )
+    finally:
+        _pending_verifications -= 1
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password on the bcrypt pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, pwd_context.hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -36,10 +91,103 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(
+class AuthenticatedUser:
+    """Detached snapshot of the fields routes read from the current user"""
+    __slots__ = ("id", "email", "name", "role")
+
+    def __init__(self, id: str, email: str, name: Optional[str], role: UserRole):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.role = role
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthenticatedUser":
+        return cls(user.id, user.email, user.name, user.role)
+
+
+def _read_stamp() -> int:
+    try:
+        return os.stat(AUTH_CACHE_STAMP).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+class UserCache:
+    """Bounded LRU of token -> AuthenticatedUser with TTL and a cross-process version stamp"""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()
+        self._stamp = _read_stamp()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[AuthenticatedUser]:
+        if self.max_size <= 0:
+            return None
+        stamp = _read_stamp()
+        now = time.time()
+        with self._lock:
+            if stamp != self._stamp:
+                # Another worker (or this one) changed a user: drop everything
+                self._entries.clear()
+                self._stamp = stamp
+                return None
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if now >= expires_at:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: AuthenticatedUser, token_exp: Optional[float] = None) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._entries[token] = (user, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(AUTH_CACHE_MAX_SIZE, AUTH_CACHE_TTL_SECONDS)
+
+
+def invalidate_user_cache() -> None:
+    """Invalidate cached users in every worker; call after changing or deleting a user"""
+    previous = _read_stamp()
+    with open(AUTH_CACHE_STAMP, "w") as f:
+        f.write(str(time.time_ns()))
+    if _read_stamp() == previous:
+        # Coarse filesystem timestamps: force the stamp to change
+        os.utime(AUTH_CACHE_STAMP, ns=(previous + 1, previous + 1))
+    user_cache.clear()
+
+
+def _load_user(db: Session, user_id: str) -> Optional[AuthenticatedUser]:
+    user = db.query(User).filter(User.id == user_id).first()
+    return AuthenticatedUser.from_user(user) if user else None
+
+
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
-) -> User:
+) -> AuthenticatedUser:
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,16 +201,29 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    authenticated = await run_db(db, _load_user, user_id)
+    if authenticated is None:
         raise credentials_exception
-    return user
+
+    user_cache.put(token, authenticated, payload.get("exp"))
+    return authenticated
 
 
-def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_admin_user(current_user: AuthenticatedUser = Depends(get_current_user)) -> AuthenticatedUser:
     if current_user.role.value != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
     return current_user
+
+
+async def admin_from_token(token: str) -> Optional[AuthenticatedUser]:
+    """The admin a bearer token belongs to, or None; for middleware, which runs outside route dependencies"""
+    async with aclosing(get_db()) as sessions:
+        db = await anext(sessions)
+        try:
+            user = await get_current_user(token, db)
+        except HTTPException:
+            return None
+    return user if user.role == UserRole.ADMIN else None
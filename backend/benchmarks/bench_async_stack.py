@@ -0,0 +1,117 @@
+"""
+Benchmark: threadpool (DB_ASYNC=0) vs async (DB_ASYNC=1) database stack.
+
+Simulates N evaluators working at once against a single in-process worker:
+each one loads its session and then loops submit-and-next, while /health is
+probed in the background. Each stack runs in its own interpreter because the
+engines are built at import time. Reports throughput and latency percentiles.
+Usage: python benchmarks/bench_async_stack.py [evaluators] [submits_per_evaluator]
+"""
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from common import scratch_env, seed, percentile
+
+VARIANTS = {
+    "threadpool": {"DB_ASYNC": "0", "SQLITE_PROFILE": "production"},
+    "async": {"DB_ASYNC": "1", "SQLITE_PROFILE": "production"},
+    "async+group": {"DB_ASYNC": "1", "SQLITE_PROFILE": "production", "GROUP_COMMIT": "1"},
+}
+
+
+async def evaluator(client, token: str, submits: int, latencies: list) -> int:
+    headers = {"Authorization": f"Bearer {token}"}
+    start = time.perf_counter()
+    response = await client.get("/evaluations/session", headers=headers)
+    latencies.append((time.perf_counter() - start) * 1000)
+    case = response.json()["case"]
+    done = 0
+    while case and done < submits:
+        start = time.perf_counter()
+        response = await client.post(
+            "/evaluations/submit-and-next",
+            headers=headers,
+            json={"case_id": case["id"], "q1_acceptability": 3, "q2_confidence": 4, "duration_ms": 1000}
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 201:
+            raise RuntimeError(f"submit failed: {response.status_code} {response.text}")
+        case = response.json()["case"]
+        done += 1
+    return done
+
+
+async def probe_health(client, stop: asyncio.Event, samples: list) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health")
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def run_variant(n_evaluators: int, submits: int) -> dict:
+    import httpx
+    from sqlalchemy import select
+
+    from auth import create_access_token
+    from database import SessionLocal, User, UserRole
+    from main import app
+
+    # Tokens are minted directly: this measures the evaluation loop, not bcrypt
+    db = SessionLocal()
+    try:
+        tokens = [create_access_token({"sub": user_id}) for user_id in db.scalars(
+            select(User.id).where(User.role == UserRole.EVALUATOR)
+        )]
+    finally:
+        db.close()
+
+    latencies, health = [], []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe_health(client, stop, health))
+        start = time.perf_counter()
+        completed = await asyncio.gather(*(evaluator(client, token, submits, latencies) for token in tokens))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await prober
+
+    return {
+        "evaluators": len(tokens),
+        "submits": sum(completed),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "health_p99_ms": percentile(health, 99),
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--variant":
+        # Child run: one configuration per interpreter
+        variant, n_evaluators, submits = sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+        scratch_env(**VARIANTS[variant])
+        seed(n_cases=submits + 1, n_evaluators=n_evaluators)
+        print(json.dumps(asyncio.run(run_variant(n_evaluators, submits))))
+        return
+
+    n_evaluators = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    submits = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f"{n_evaluators} concurrent evaluators x {submits} submit-and-next each")
+    for variant in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, __file__, "--variant", variant, str(n_evaluators), str(submits)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"  {variant:12s} {result['requests_per_second']:8.1f} req/s   "
+              f"p50 {result['p50_ms']:8.1f} ms   p99 {result['p99_ms']:8.1f} ms   "
+              f"health p99 {result['health_p99_ms']:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: SQL statements per authenticated request with and without the user cache.
+
+Usage: python benchmarks/bench_auth_cache.py [requests]
+"""
+import sys
+import time
+
+from common import scratch_env, seed
+
+scratch_env()
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from database import engine
+from main import app
+import auth
+
+statements = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count(conn, cursor, statement, parameters, context, executemany):
+    global statements
+    statements += 1
+
+
+def run(client: TestClient, headers: dict, n: int) -> tuple:
+    global statements
+    statements = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get("/evaluations/progress", headers=headers).raise_for_status()
+    return statements / n, (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    emails = seed(n_cases=100, n_evaluators=1)
+    with TestClient(app) as client:
+        token = client.post("/auth/login", data={"username": emails[0], "password": "bench123"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        max_size = auth.user_cache.max_size
+        auth.user_cache.max_size = 0
+        uncached = run(client, headers, n)
+        auth.user_cache.max_size = max_size
+        cached = run(client, headers, n)
+
+    print(f"GET /evaluations/progress x{n}")
+    print(f"  without cache: {uncached[0]:.2f} statements/request, {uncached[1]:.2f} ms/request")
+    print(f"  with cache:    {cached[0]:.2f} statements/request, {cached[1]:.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
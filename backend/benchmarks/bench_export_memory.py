@@ -0,0 +1,124 @@
+"""
+Benchmark: stream /admin/export over many synthetic evaluations under an RSS ceiling.
+
+The ASGI app is driven directly so that nothing on the client side buffers
+the body; only the bytes are counted. Exits with status 1 when peak RSS
+grows by more than the ceiling during the export.
+Usage: python benchmarks/bench_export_memory.py [evaluations] [ceiling_mb] [format]
+"""
+import asyncio
+import resource
+import sys
+import time
+import uuid
+
+from common import scratch_env, seed
+
+scratch_env()
+
+from sqlalchemy import insert
+
+from database import SessionLocal, User, Case, Evaluation
+from main import app
+from auth import create_access_token
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed_evaluations(n: int, n_cases: int = 1000) -> str:
+    # One evaluation per (evaluator, case) pair, as uq_evaluations_user_case requires
+    emails = seed(n_cases=n_cases, n_evaluators=max(10, -(-n // n_cases)))
+    db = SessionLocal()
+    try:
+        user_ids = [u.id for u in db.query(User.id).filter(User.email.in_(emails))]
+        case_ids = [c.id for c in db.query(Case.id)]
+        batch = []
+        for i in range(n):
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_ids[i // len(case_ids)],
+                "case_id": case_ids[i % len(case_ids)],
+                "q1_acceptability": 1 + i % 4,
+                "q2_confidence": 1 + i % 5,
+                "comments": "synthetic" if i % 10 == 0 else None,
+                "duration_ms": 1000 + i % 60000,
+            })
+            if len(batch) == 10000:
+                db.execute(insert(Evaluation), batch)
+                batch = []
+        if batch:
+            db.execute(insert(Evaluation), batch)
+        db.commit()
+        admin_id = db.query(User.id).filter(User.email == "admin@bench.example.com").scalar()
+        return create_access_token({"sub": admin_id})
+    finally:
+        db.close()
+
+
+async def stream_export(token: str, fmt: str) -> tuple:
+    body_bytes = 0
+    first_byte = None
+    start = time.perf_counter()
+    status = None
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Behave like a client that stays connected until the body is complete
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal body_bytes, first_byte, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            if first_byte is None and message.get("body"):
+                first_byte = time.perf_counter() - start
+            body_bytes += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_done.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/admin/export",
+        "raw_path": b"/admin/export",
+        "query_string": f"format={fmt}".encode(),
+        "headers": [(b"authorization", f"Bearer {token}".encode()), (b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    return status, body_bytes, first_byte, time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ceiling_mb = float(sys.argv[2]) if len(sys.argv) > 2 else 64
+    fmt = sys.argv[3] if len(sys.argv) > 3 else "csv"
+
+    print(f"Seeding {n} evaluations...")
+    token = seed_evaluations(n)
+    baseline = peak_rss_mb()
+    status, size, first_byte, total = asyncio.run(stream_export(token, fmt))
+    growth = peak_rss_mb() - baseline
+
+    print(f"status {status}: {size / 1e6:.1f} MB {fmt} in {total:.1f} s, first byte after {(first_byte or 0) * 1000:.0f} ms")
+    print(f"peak RSS growth during export: {growth:.1f} MB (ceiling {ceiling_mb:.0f} MB)")
+    if status != 200 or growth > ceiling_mb:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
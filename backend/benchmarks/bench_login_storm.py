@@ -0,0 +1,60 @@
+"""
+Benchmark: a cohort logging in at once against a single in-process worker.
+
+Fires N concurrent logins while probing /health, and reports login and
+health latency percentiles plus how many logins were shed with a 503.
+Usage: python benchmarks/bench_login_storm.py [logins]
+"""
+import asyncio
+import sys
+import time
+
+from common import scratch_env, seed, percentile
+
+scratch_env()
+
+import httpx
+
+from main import app
+
+
+async def timed(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> tuple:
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    return response.status_code, (time.perf_counter() - start) * 1000
+
+
+async def probe_health(client: httpx.AsyncClient, stop: asyncio.Event, samples: list) -> None:
+    while not stop.is_set():
+        samples.append((await timed(client, "GET", "/health"))[1])
+        await asyncio.sleep(0.01)
+
+
+async def storm(n: int, emails: list[str]) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        stop = asyncio.Event()
+        health = []
+        prober = asyncio.create_task(probe_health(client, stop, health))
+        results = await asyncio.gather(*(
+            timed(client, "POST", "/auth/login", data={"username": emails[i % len(emails)], "password": "bench123"})
+            for i in range(n)
+        ))
+        stop.set()
+        await prober
+
+    ok = [ms for code, ms in results if code == 200]
+    shed = sum(1 for code, _ in results if code == 503)
+    print(f"{n} concurrent logins: {len(ok)} ok, {shed} shed with 503")
+    print(f"  login  p50 {percentile(ok, 50):8.1f} ms   p99 {percentile(ok, 99):8.1f} ms")
+    print(f"  health p50 {percentile(health, 50):8.1f} ms   p99 {percentile(health, 99):8.1f} ms")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    emails = seed(n_cases=10, n_evaluators=min(n, 50))
+    asyncio.run(storm(n, emails))
+
+
+if __name__ == "__main__":
+    main()
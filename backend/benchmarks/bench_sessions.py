@@ -0,0 +1,261 @@
+"""
+Benchmark: evaluator sessions end to end, with JSON results to compare commits.
+
+Seeds N cases and M evaluators into a scratch SQLite database, then runs M
+evaluators at once, each doing what the frontend does: log in, then loop
+next-case -> submit until it has submitted --submits cases (or runs out),
+optionally pausing --think-ms between cases. The app is driven in-process
+through httpx's ASGI transport, or with --uvicorn against a real uvicorn
+server (with --workers processes) started on the same scratch database.
+
+Reports per endpoint: requests, errors, throughput and p50/p95/p99 latency.
+The results, with the commit, configuration and machine they were measured
+on, are written as JSON (--output, by default benchmarks/results/), and
+--compare prints the change against an earlier result file.
+
+Examples (from the backend directory):
+    python benchmarks/bench_sessions.py --cases 500 --evaluators 50 --submits 20
+    python benchmarks/bench_sessions.py --env DB_ASYNC=1 --env GROUP_COMMIT=1 --compare results/before.json
+    python benchmarks/bench_sessions.py --uvicorn --workers 4
+"""
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from common import BACKEND_DIR, scratch_env, seed, percentile
+
+PASSWORD = "bench123"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Settings that change what is being measured; recorded with every result
+CONFIG_ENV = ("DB_ASYNC", "GROUP_COMMIT", "CASE_SCHEDULER", "SQLITE_PROFILE", "BCRYPT_ROUNDS", "METRICS")
+
+LOGIN = "POST /auth/login"
+NEXT_CASE = "GET /evaluations/next-case"
+SUBMIT = "POST /evaluations"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, dict[str, int]] = {}
+
+    async def request(self, client, endpoint: str, method: str, url: str, **kwargs):
+        """Send a request, retrying when the server sheds load with 503 + Retry-After"""
+        while True:
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            self.latencies.setdefault(endpoint, []).append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors = self.errors.setdefault(endpoint, {})
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+            if response.status_code == 503 and "retry-after" in response.headers:
+                await asyncio.sleep(float(response.headers["retry-after"]))
+                continue
+            return response
+
+
+async def evaluator(client, recorder: Recorder, email: str, submits: int, think_ms: float, rng: random.Random) -> int:
+    response = await recorder.request(
+        client, LOGIN, "POST", "/auth/login", data={"username": email, "password": PASSWORD}
+    )
+    if response.status_code != 200:
+        return 0
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    done = 0
+    while done < submits:
+        response = await recorder.request(client, NEXT_CASE, "GET", "/evaluations/next-case", headers=headers)
+        case = response.json() if response.status_code == 200 else None
+        if not case:
+            break
+        if think_ms:
+            await asyncio.sleep(rng.expovariate(1000 / think_ms))
+        response = await recorder.request(client, SUBMIT, "POST", "/evaluations", headers=headers, json={
+            "case_id": case["id"],
+            "q1_acceptability": rng.randint(1, 4),
+            "q2_confidence": rng.randint(1, 5),
+            "duration_ms": int(rng.lognormvariate(9.5, 0.8)),
+        })
+        if response.status_code != 201:
+            break
+        done += 1
+    return done
+
+
+async def run(base_url: str, emails: list[str], args) -> dict:
+    import httpx
+
+    if base_url:
+        transport = None
+        limits = httpx.Limits(max_connections=args.evaluators)
+    else:
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+        limits = httpx.Limits()
+        base_url = "http://bench"
+
+    recorder = Recorder()
+    rngs = [random.Random(f"{args.seed}:{i}") for i in range(len(emails))]
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=None) as client:
+        start = time.perf_counter()
+        completed = await asyncio.gather(*(
+            evaluator(client, recorder, email, args.submits, args.think_ms, rng)
+            for email, rng in zip(emails, rngs)
+        ))
+        elapsed = time.perf_counter() - start
+
+    endpoints = {}
+    for endpoint, samples in recorder.latencies.items():
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(endpoint, {}),
+            "requests_per_second": round(len(samples) / elapsed, 2),
+            "mean_ms": round(sum(samples) / len(samples), 2),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+            "max_ms": round(max(samples), 2),
+        }
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "submits": sum(completed),
+        "submits_per_second": round(sum(completed) / elapsed, 2),
+        "requests_per_second": round(sum(len(s) for s in recorder.latencies.values()) / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_uvicorn(workers: int) -> tuple:
+    """uvicorn on the scratch database (inherits the environment); returns (process, base URL)"""
+    import httpx
+
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return process, base_url
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("uvicorn did not become healthy within 60 s")
+
+
+def _git(*args: str):
+    try:
+        completed = subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        return completed.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(args) -> dict:
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mode": f"uvicorn x{args.workers}" if args.uvicorn else "in-process",
+        "parameters": {
+            "cases": args.cases, "evaluators": args.evaluators, "submits": args.submits,
+            "think_ms": args.think_ms, "seed": args.seed,
+        },
+        "config": {key: os.environ[key] for key in CONFIG_ENV if key in os.environ},
+    }
+
+
+def _change(new: float, old: float) -> str:
+    if not old:
+        return "   n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def print_report(result: dict, baseline=None) -> None:
+    print(f"{result['submits']} submits in {result['elapsed_seconds']:.1f} s "
+          f"({result['submits_per_second']:.1f} submits/s, {result['requests_per_second']:.1f} req/s)")
+    for endpoint, stats in result["endpoints"].items():
+        errors = sum(stats["errors"].values())
+        print(f"  {endpoint:28s} {stats['requests']:6d} req {stats['requests_per_second']:8.1f} req/s   "
+              f"p50 {stats['p50_ms']:7.1f}   p95 {stats['p95_ms']:7.1f}   p99 {stats['p99_ms']:7.1f} ms"
+              + (f"   {errors} errors {stats['errors']}" if errors else ""))
+        before = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if before:
+            changes = {key: _change(stats[key], before[key]) for key in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")}
+            print(f"  {'  vs baseline':28s} {'':10s} {changes['requests_per_second']:>14s}   "
+                  f"p50 {changes['p50_ms']}   p95 {changes['p95_ms']}   p99 {changes['p99_ms']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--evaluators", type=int, default=20)
+    parser.add_argument("--submits", type=int, default=20, help="cases each evaluator submits")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between next-case and submit")
+    parser.add_argument("--seed", type=int, default=0, help="seed for ratings, durations and think times")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="app setting for this run, e.g. DB_ASYNC=1 (repeatable)")
+    parser.add_argument("--uvicorn", action="store_true", help="run against a local uvicorn instead of in-process")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (with --uvicorn)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/sessions-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    settings = dict(item.split("=", 1) for item in args.env)
+    workdir = scratch_env(**settings)
+    emails = seed(args.cases, args.evaluators, PASSWORD)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["result"]
+
+    process = None
+    try:
+        base_url = None
+        if args.uvicorn:
+            process, base_url = start_uvicorn(args.workers)
+        result = asyncio.run(run(base_url, emails, args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {"benchmark": "sessions", **environment(args), "result": result}
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"sessions-{(report['commit'] or 'unknown')[:10]}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(result, baseline)
+    print(f"Results written to {output} (scratch database in {workdir})")
+
+
+if __name__ == "__main__":
+    main()
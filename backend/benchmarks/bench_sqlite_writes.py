@@ -0,0 +1,117 @@
+"""
+Benchmark: concurrent evaluation submits against SQLite, like 4 gunicorn workers.
+
+Runs the real submit path (routers.evaluations._submit, which hands writes
+to the group-commit writer when it is enabled) from several processes with
+several threads each, once per configuration:
+  default      rollback journal, stock engine
+  production   SQLITE_PROFILE=production (WAL, busy_timeout, pool sizing)
+  group-commit production profile plus GROUP_COMMIT=1
+and reports submits per second and "database is locked" errors.
+Usage: python benchmarks/bench_sqlite_writes.py [processes] [threads] [submits_per_thread]
+"""
+import asyncio
+import json
+import multiprocessing
+import subprocess
+import sys
+import threading
+import time
+
+from common import scratch_env, seed
+
+VARIANTS = {
+    "default": {},
+    "production": {"SQLITE_PROFILE": "production"},
+    "group-commit": {"SQLITE_PROFILE": "production", "GROUP_COMMIT": "1"},
+}
+
+
+def worker(user_ids: list, case_ids: list, submits: int, results) -> None:
+    """One 'gunicorn worker': a thread per evaluator, each submitting sequentially"""
+    from sqlalchemy.exc import OperationalError
+
+    from auth import AuthenticatedUser
+    from database import SessionLocal, UserRole
+    from routers.evaluations import _submit
+    from schemas import EvaluationCreate
+
+    ok = locked = 0
+    lock = threading.Lock()
+
+    async def evaluator(user_id: str) -> None:
+        nonlocal ok, locked
+        user = AuthenticatedUser(user_id, "", None, UserRole.EVALUATOR)
+        for case_id in case_ids[:submits]:
+            db = SessionLocal()
+            try:
+                await _submit(db, user, EvaluationCreate(case_id=case_id, q1_acceptability=3, q2_confidence=4))
+                with lock:
+                    ok += 1
+            except OperationalError as exc:
+                if "locked" not in str(exc):
+                    raise
+                with lock:
+                    locked += 1
+            finally:
+                db.close()
+
+    # One event loop per evaluator thread, awaiting the route's write path
+    threads = [threading.Thread(target=asyncio.run, args=(evaluator(user_id),)) for user_id in user_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((ok, locked))
+
+
+def run_variant(variant: str, processes: int, threads: int, submits: int) -> dict:
+    scratch_env(**VARIANTS[variant])
+    seed(n_cases=submits, n_evaluators=processes * threads)
+
+    from database import SessionLocal, User, Case, UserRole
+    db = SessionLocal()
+    user_ids = [u.id for u in db.query(User.id).filter(User.role == UserRole.EVALUATOR)]
+    case_ids = [c.id for c in db.query(Case.id)]
+    db.close()
+
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    start = time.perf_counter()
+    procs = [
+        ctx.Process(target=worker, args=(user_ids[i * threads:(i + 1) * threads], case_ids, submits, results))
+        for i in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    totals = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    ok = sum(t[0] for t in totals)
+    locked = sum(t[1] for t in totals)
+    return {"variant": variant, "submits": ok, "locked_errors": locked, "submits_per_second": ok / elapsed}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--variant":
+        # Child run: one configuration per interpreter, since the engine is built at import
+        variant, processes, threads, submits = sys.argv[2], *map(int, sys.argv[3:6])
+        print(json.dumps(run_variant(variant, processes, threads, submits)))
+        return
+
+    processes, threads, submits = (list(map(int, sys.argv[1:4])) + [4, 8, 50][len(sys.argv) - 1:])[:3]
+    print(f"{processes} processes x {threads} threads x {submits} submits")
+    for variant in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, __file__, "--variant", variant, str(processes), str(threads), str(submits)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"  {variant:13s} {result['submits_per_second']:8.1f} submits/s   "
+              f"{result['locked_errors']:5d} locked errors   ({result['submits']} ok)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+EXPLAIN QUERY PLAN check for the hot request paths.
+
+Runs the real code behind next-case (both schedulers), session prefetch,
+submit, batch submit, progress, the admin evaluators page, the full and the
+delta export against a seeded SQLite database, captures every statement they
+issue and asks SQLite for its plan.
+A full table scan of a large table (a plan line "SCAN <table>" without an
+index) is reported and makes the script exit with status 1, so a missing or
+unusable index shows up before it shows up in latency.
+
+Run from the backend directory:
+    python benchmarks/check_query_plans.py
+"""
+from contextlib import contextmanager
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import scratch_env, seed  # noqa: E402
+
+# Tables that grow with cases x evaluators; small tables (users, counters by name) may be scanned
+LARGE_TABLES = {"evaluations", "case_queue", "case_coverage", "cases", "evaluation_tombstones",
+                "evaluation_idempotency_keys", "duration_buckets"}
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?! USING)")
+SKIP = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "SAVEPOINT", "RELEASE")
+
+
+class StatementLog:
+    def __init__(self):
+        self.current = None
+        self.statements = {}  # (path, sql) -> parameters of the first execution
+
+    def listener(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current is None or statement.lstrip().upper().startswith(SKIP):
+            return
+        if executemany:
+            parameters = parameters[0]
+        self.statements.setdefault((self.current, statement), parameters)
+
+    @contextmanager
+    def path(self, name: str):
+        self.current = name
+        try:
+            yield
+        finally:
+            self.current = None
+
+
+def exercise(log: StatementLog) -> None:
+    from fastapi import HTTPException
+    from database import SessionLocal, User, UserRole
+    from schemas import BatchEvaluationItem, EvaluationCreate
+    from routers import admin, evaluations
+    import case_queue
+    import exports
+
+    db = SessionLocal()
+    users = db.query(User).filter(User.role == UserRole.EVALUATOR).limit(2).all()
+    db.close()
+    user, other = users
+
+    def unit(fn, *args):
+        session = SessionLocal()
+        try:
+            return fn(session, *args)
+        finally:
+            session.close()
+
+    with log.path("next-case (random)"):
+        case = unit(case_queue._queue_head, user.id)
+    with log.path("next-case (coverage)"):
+        unit(case_queue._next_case_by_coverage, other.id)
+    with log.path("session prefetch"):
+        unit(evaluations._session, user, 3)
+    with log.path("progress"):
+        unit(evaluations._progress, user)
+    with log.path("submit"):
+        unit(evaluations._create_evaluation, user, EvaluationCreate(
+            case_id=case.id, q1_acceptability=3, q2_confidence=4, duration_ms=1000
+        ))
+    with log.path("submit (duplicate)"):
+        try:
+            unit(evaluations._create_evaluation, user, EvaluationCreate(
+                case_id=case.id, q1_acceptability=3, q2_confidence=4
+            ))
+        except HTTPException:
+            pass
+    with log.path("batch submit"):
+        upcoming = unit(case_queue.upcoming_cases, other.id, 3)
+        unit(evaluations._submit_batch, other, [
+            BatchEvaluationItem(idempotency_key=f"k{i}", case_id=c.id, q1_acceptability=2, q2_confidence=3)
+            for i, c in enumerate(upcoming)
+        ])
+    with log.path("evaluators page"):
+        unit(admin._evaluators_page, None, "progress", "desc", 10, None)
+        unit(admin._evaluators_page, "eval", "name", "asc", 10, None)
+    with log.path("full export"):
+        list(exports.iter_record_batches(batch_size=1))
+    with log.path("delta export"):
+        exports.DELTA_SETTLE_SECONDS = -60  # include the evaluations just submitted
+        first = unit(exports.delta_page, exports.decode_delta_cursor(None), 1)
+        unit(exports.delta_page, exports.decode_delta_cursor(first["next_cursor"]), 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--evaluators", type=int, default=20)
+    args = parser.parse_args()
+
+    scratch_env()
+    seed(args.cases, args.evaluators)
+
+    from sqlalchemy import event
+    from database import engine
+
+    log = StatementLog()
+    event.listen(engine, "before_cursor_execute", log.listener)
+    exercise(log)
+    event.remove(engine, "before_cursor_execute", log.listener)
+
+    # Fresh statistics, as a long-running database would have after ANALYZE
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+    problems = 0
+    with engine.connect() as conn:
+        for (path, statement), parameters in log.statements.items():
+            plan = [row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            scans = [line for line in plan if (m := FULL_SCAN.match(line)) and m.group(1) in LARGE_TABLES]
+            problems += bool(scans)
+            print(f"[{'FULL SCAN' if scans else 'ok'}] {path}: {' '.join(statement.split())[:160]}")
+            for line in plan:
+                print(f"      {line}")
+
+    print(f"\n{len(log.statements)} statements checked, {problems} with full scans of large tables")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Each benchmark runs against a throwaway SQLite database, so scratch_env()
+must be called before anything imports database.py (the engine is created
+from DATABASE_URL at import time).
+Run the scripts from the backend directory, e.g. python benchmarks/bench_auth_cache.py
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def scratch_env(**env) -> str:
+    """Point the app at a fresh SQLite file in a temp directory and return that directory"""
+    workdir = tempfile.mkdtemp(prefix="retina-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["AUTH_CACHE_STAMP"] = os.path.join(workdir, ".auth_cache_stamp")
+    os.environ["METRICS_DIR"] = os.path.join(workdir, ".metrics")
+    os.environ["PROFILE_DIR"] = os.path.join(workdir, ".profiles")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return workdir
+
+
+def seed(n_cases: int, n_evaluators: int, password: str = "bench123") -> list[str]:
+    """Create cases, evaluators (with queues) and an admin; returns the evaluator emails"""
+    from database import SessionLocal, init_db, User, Case, UserRole
+    from auth import get_password_hash
+    import case_queue
+    import counters
+
+    init_db()
+    db = SessionLocal()
+    try:
+        # bcrypt is slow on purpose: hash once and share it across the synthetic accounts
+        password_hash = get_password_hash(password)
+        emails = [f"evaluator{i}@bench.example.com" for i in range(n_evaluators)]
+        db.add(User(email="admin@bench.example.com", name="Admin", password_hash=password_hash, role=UserRole.ADMIN))
+        db.add_all([User(email=email, name=email, password_hash=password_hash) for email in emails])
+        cases = [
+            Case(
+                image_s3_key=f"original_imgs/case_{i:06d}.png",
+                mask_s3_key=f"overlay_imgs/case_{i:06d}_overlay.png",
+                case_metadata={"filename": f"case_{i:06d}.png"}
+            )
+            for i in range(n_cases)
+        ]
+        db.add_all(cases)
+        db.flush()
+        case_queue.add_cases(db, [case.id for case in cases])
+        db.commit()
+        counters.rebuild(db)
+        return emails
+    finally:
+        db.close()
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
@@ -0,0 +1,287 @@
+"""
+Per-evaluator case queue and scheduling.
+
+Every user has one row per case they still have to evaluate, keyed by a
+random position. Serving the next case is an index range scan on
+(user_id, position) instead of NOT IN + ORDER BY random() over all cases.
+Positions are independent random integers, so cases added later are spread
+uniformly through the remaining queue without reshuffling it.
+
+Two schedulers are available (CASE_SCHEDULER):
+- "random": serve the head of the queue.
+- "coverage": serve the least-rated eligible case first until every case has
+  COVERAGE_TARGET ratings, then fall back to queue order. case_coverage keeps
+  the rating counts up to date on submit, and a short lease per case keeps two
+  evaluators from being handed the same under-covered case. Leases are taken
+  with a conditional UPDATE, so they hold across gunicorn workers. Only
+  cases with a free lease are served; when every pending case is leased to
+  someone else, AllCasesLeased tells the caller to retry later.
+
+Queues are only built for evaluators; admins never evaluate.
+"""
+from datetime import datetime, timedelta
+import os
+import random
+from typing import Iterable, Optional
+
+from sqlalchemy import insert, or_, case as sql_case, func
+from sqlalchemy.orm import Session
+
+from database import begin_write, User, UserRole, Case, Evaluation, CaseQueueEntry, CaseCoverage
+
+SCHEDULER = os.getenv("CASE_SCHEDULER", "random")  # "random" | "coverage"
+COVERAGE_TARGET = int(os.getenv("COVERAGE_TARGET", "3"))
+LEASE_SECONDS = int(os.getenv("CASE_LEASE_SECONDS", "900"))
+LEASE_ATTEMPTS = 5
+# Upper bound for the retry delay suggested while every pending case is leased
+LEASED_RETRY_SECONDS = int(os.getenv("CASE_LEASED_RETRY_SECONDS", "15"))
+BATCH_SIZE = 1000
+
+_rng = random.SystemRandom()
+
+
+class AllCasesLeased(Exception):
+    """The user still has pending cases, but all of them are leased to other evaluators"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"All pending cases are leased, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _random_position() -> int:
+    # 62 bits keeps the value inside a signed BIGINT on every backend
+    return _rng.getrandbits(62)
+
+
+def _insert_batches(db: Session, model, rows: Iterable[dict]) -> int:
+    inserted = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.execute(insert(model), batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(model), batch)
+        inserted += len(batch)
+    return inserted
+
+
+def _insert_entries(db: Session, pairs: Iterable[tuple]) -> int:
+    """Bulk insert (user_id, case_id) pairs with fresh random positions"""
+    return _insert_batches(db, CaseQueueEntry, (
+        {"user_id": user_id, "case_id": case_id, "position": _random_position()}
+        for user_id, case_id in pairs
+    ))
+
+
+def add_cases(db: Session, case_ids: list[str]) -> int:
+    """Register newly created cases: coverage rows plus every evaluator's queue (caller commits)"""
+    if not case_ids:
+        return 0
+    _insert_batches(db, CaseCoverage, ({"case_id": case_id, "ratings": 0} for case_id in case_ids))
+    user_ids = [row.id for row in db.query(User.id).filter(User.role == UserRole.EVALUATOR)]
+    return _insert_entries(db, ((u, c) for u in user_ids for c in case_ids))
+
+
+def add_users(db: Session, user_ids: list[str]) -> int:
+    """Queue every case for newly created users, reading the case ids once (caller commits)"""
+    if not user_ids:
+        return 0
+    case_ids = [row.id for row in db.query(Case.id)]
+    return _insert_entries(db, ((u, c) for u in user_ids for c in case_ids))
+
+
+def build_queue_for_user(db: Session, user_id: str) -> int:
+    """Queue every case the evaluator has neither evaluated nor already queued; no-op for admins (caller commits)"""
+    role = db.query(User.role).filter(User.id == user_id).scalar()
+    if role != UserRole.EVALUATOR:
+        return 0
+    evaluated = db.query(Evaluation.case_id).filter(Evaluation.user_id == user_id)
+    queued = db.query(CaseQueueEntry.case_id).filter(CaseQueueEntry.user_id == user_id)
+    case_ids = db.query(Case.id).filter(~Case.id.in_(evaluated), ~Case.id.in_(queued))
+    return _insert_entries(db, ((user_id, row.id) for row in case_ids))
+
+
+def backfill(db: Session) -> int:
+    """
+    Build missing queues and coverage rows, e.g. for databases created before
+    they existed, and drop queue rows left over for admins
+    """
+    admins = db.query(User.id).filter(User.role != UserRole.EVALUATOR)
+    db.query(CaseQueueEntry).filter(CaseQueueEntry.user_id.in_(admins)).delete(synchronize_session=False)
+    has_queue = db.query(CaseQueueEntry.user_id).distinct()
+    user_ids = [row.id for row in db.query(User.id).filter(
+        User.role == UserRole.EVALUATOR,
+        ~User.id.in_(has_queue)
+    )]
+    inserted = sum(build_queue_for_user(db, user_id) for user_id in user_ids)
+
+    has_coverage = db.query(CaseCoverage.case_id)
+    missing = [row.id for row in db.query(Case.id).filter(~Case.id.in_(has_coverage))]
+    if missing:
+        counts = dict(db.query(Evaluation.case_id, func.count(Evaluation.id)).filter(
+            Evaluation.case_id.in_(missing)
+        ).group_by(Evaluation.case_id).all())
+        _insert_batches(db, CaseCoverage, (
+            {"case_id": case_id, "ratings": counts.get(case_id, 0)} for case_id in missing
+        ))
+    db.commit()
+    return inserted
+
+
+def _queue_head(db: Session, user_id: str) -> Optional[Case]:
+    return db.query(Case).join(
+        CaseQueueEntry, CaseQueueEntry.case_id == Case.id
+    ).filter(
+        CaseQueueEntry.user_id == user_id
+    ).order_by(CaseQueueEntry.position).first()
+
+
+def _lease_available(user_id: str, now: datetime):
+    return or_(
+        CaseCoverage.lease_user_id.is_(None),
+        CaseCoverage.lease_user_id == user_id,
+        CaseCoverage.lease_expires_at < now
+    )
+
+
+def _coverage_rank():
+    # Under-covered cases by rating count, then everything at or above target alike
+    return sql_case((CaseCoverage.ratings < COVERAGE_TARGET, CaseCoverage.ratings), else_=COVERAGE_TARGET)
+
+
+def _next_case_by_coverage(db: Session, user_id: str) -> Optional[Case]:
+    now = datetime.utcnow()
+    available = _lease_available(user_id, now)
+    begin_write(db)
+    candidates = db.query(CaseQueueEntry.case_id).join(
+        CaseCoverage, CaseCoverage.case_id == CaseQueueEntry.case_id
+    ).filter(
+        CaseQueueEntry.user_id == user_id,
+        available
+    ).order_by(
+        # A case already leased to this user comes back first (e.g. page reload)
+        sql_case((CaseCoverage.lease_user_id == user_id, 0), else_=1),
+        _coverage_rank(),
+        CaseQueueEntry.position
+    ).limit(LEASE_ATTEMPTS).all()
+
+    for (case_id,) in candidates:
+        # Conditional UPDATE: only one worker can win a contested lease
+        claimed = db.query(CaseCoverage).filter(
+            CaseCoverage.case_id == case_id,
+            available
+        ).update({
+            CaseCoverage.lease_user_id: user_id,
+            CaseCoverage.lease_expires_at: now + timedelta(seconds=LEASE_SECONDS)
+        }, synchronize_session=False)
+        if claimed:
+            release_leases(db, user_id, keep_case_id=case_id)
+            db.commit()
+            return db.get(Case, case_id)
+        db.rollback()
+        begin_write(db)
+
+    # Nothing claimable: done only if the queue is empty, otherwise wait for a lease to free up
+    pending = db.query(CaseQueueEntry.case_id).filter(CaseQueueEntry.user_id == user_id).first()
+    if pending is None:
+        db.rollback()
+        return None
+    expires = db.query(func.min(CaseCoverage.lease_expires_at)).join(
+        CaseQueueEntry, CaseQueueEntry.case_id == CaseCoverage.case_id
+    ).filter(
+        CaseQueueEntry.user_id == user_id,
+        CaseCoverage.lease_user_id != user_id
+    ).scalar()
+    db.rollback()
+    # Leases are usually released early on submit, so poll well before they expire
+    retry_after = LEASED_RETRY_SECONDS
+    if expires is not None:
+        retry_after = min(retry_after, int((expires - now).total_seconds()) + 1)
+    raise AllCasesLeased(max(retry_after, 1))
+
+
+def next_case(db: Session, user_id: str) -> Optional[Case]:
+    """
+    Next case for the user according to CASE_SCHEDULER, or None when everything
+    has been evaluated. The coverage scheduler raises AllCasesLeased when the
+    remaining cases are all leased to other evaluators.
+    """
+    if SCHEDULER == "coverage":
+        return _next_case_by_coverage(db, user_id)
+    return _queue_head(db, user_id)
+
+
+def upcoming_cases(db: Session, user_id: str, limit: int, exclude_case_id: Optional[str] = None) -> list[Case]:
+    """Cases most likely to be served after the current one, for client-side prefetching"""
+    query = db.query(Case).join(
+        CaseQueueEntry, CaseQueueEntry.case_id == Case.id
+    ).filter(CaseQueueEntry.user_id == user_id)
+    if exclude_case_id is not None:
+        query = query.filter(CaseQueueEntry.case_id != exclude_case_id)
+
+    if SCHEDULER == "coverage":
+        query = query.join(
+            CaseCoverage, CaseCoverage.case_id == CaseQueueEntry.case_id
+        ).filter(
+            _lease_available(user_id, datetime.utcnow())
+        ).order_by(_coverage_rank(), CaseQueueEntry.position)
+    else:
+        query = query.order_by(CaseQueueEntry.position)
+    return query.limit(limit).all()
+
+
+def consume(db: Session, user_id: str, case_id: str) -> None:
+    """Drop a case from the user's queue (caller commits)"""
+    db.query(CaseQueueEntry).filter(
+        CaseQueueEntry.user_id == user_id,
+        CaseQueueEntry.case_id == case_id
+    ).delete(synchronize_session=False)
+
+
+def record_rating(db: Session, user_id: str, case_id: str) -> None:
+    """Account for a submitted evaluation: consume the queue entry, bump coverage, release the lease (caller commits)"""
+    consume(db, user_id, case_id)
+    db.query(CaseCoverage).filter(CaseCoverage.case_id == case_id).update({
+        CaseCoverage.ratings: CaseCoverage.ratings + 1
+    }, synchronize_session=False)
+    release_leases(db, user_id)
+
+
+def record_ratings(db: Session, user_id: str, case_ids: list[str]) -> None:
+    """record_rating for several distinct cases of one user, in set-based statements (caller commits)"""
+    if not case_ids:
+        return
+    db.query(CaseQueueEntry).filter(
+        CaseQueueEntry.user_id == user_id,
+        CaseQueueEntry.case_id.in_(case_ids)
+    ).delete(synchronize_session=False)
+    db.query(CaseCoverage).filter(CaseCoverage.case_id.in_(case_ids)).update({
+        CaseCoverage.ratings: CaseCoverage.ratings + 1
+    }, synchronize_session=False)
+    release_leases(db, user_id)
+
+
+def release_leases(db: Session, user_id: str, keep_case_id: Optional[str] = None) -> None:
+    """Release every lease held by the user, optionally except one case (caller commits)"""
+    query = db.query(CaseCoverage).filter(CaseCoverage.lease_user_id == user_id)
+    if keep_case_id is not None:
+        query = query.filter(CaseCoverage.case_id != keep_case_id)
+    query.update({
+        CaseCoverage.lease_user_id: None,
+        CaseCoverage.lease_expires_at: None
+    }, synchronize_session=False)
+
+
+def remove_user(db: Session, user_id: str) -> None:
+    """Drop a user's queue, leases and ratings; call before deleting their evaluations (caller commits)"""
+    evaluated = db.query(Evaluation.case_id).filter(Evaluation.user_id == user_id)
+    db.query(CaseCoverage).filter(CaseCoverage.case_id.in_(evaluated)).update({
+        CaseCoverage.ratings: CaseCoverage.ratings - 1
+    }, synchronize_session=False)
+    release_leases(db, user_id)
+    db.query(CaseQueueEntry).filter(
+        CaseQueueEntry.user_id == user_id
+    ).delete(synchronize_session=False)
@@ -0,0 +1,180 @@
+"""
+Watch mode: register new image/overlay pairs while the API keeps running.
+
+The watcher polls the mtimes of database/original_imgs and
+database/overlay_imgs (a directory's mtime changes whenever a file is added,
+removed or renamed in it) and only rescans when one of them moved. New pairs
+are matched with the same _overlay naming rule as populate_db.py, verified,
+and stored through the same filename/content-hash upsert (a renamed pair
+keeps its case, a copy of an existing image is skipped); cases whose files
+did not change are never touched. Derivatives are rendered on one process
+pool kept for the watcher's lifetime.
+
+An original without its overlay (or the reverse) is held until the
+counterpart arrives, and pairs whose files were modified within the last
+WATCH_SETTLE_SECONDS are held too, so half-copied images are not ingested.
+
+Run standalone with `python case_watcher.py`, or set WATCH_IMAGES=1 to run it
+as a background task of the API (one worker per host takes WATCH_LOCK_FILE).
+"""
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+import asyncio
+import fcntl
+import os
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, init_db
+import derivatives
+import ingest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGINAL_DIR = os.path.join(BASE_DIR, "database", "original_imgs")
+OVERLAY_DIR = os.path.join(BASE_DIR, "database", "overlay_imgs")
+
+WATCH_IMAGES = os.getenv("WATCH_IMAGES", "0") == "1"
+WATCH_INTERVAL_SECONDS = float(os.getenv("WATCH_INTERVAL_SECONDS", "5"))
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "2"))
+WATCH_LOCK_FILE = os.getenv(
+    "WATCH_LOCK_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".case_watcher.lock")
+)
+
+
+class CaseWatcher:
+    def __init__(self, original_dir: str = ORIGINAL_DIR, overlay_dir: str = OVERLAY_DIR,
+                 session_factory=SessionLocal, log: Callable[[str], None] = print):
+        self.original_dir = original_dir
+        self.overlay_dir = overlay_dir
+        self.session_factory = session_factory
+        self.log = log
+        self._dir_mtimes: Optional[tuple] = None
+        self._held: set = set()
+        self._settling = False
+        # filename -> file signature of pairs that failed verification or are copies of an existing
+        # case; retried once they change
+        self._skipped: dict = {}
+        self._pool = None  # derivatives.process_pool(), started on first use
+
+    def _changed(self) -> bool:
+        mtimes = (os.stat(self.original_dir).st_mtime_ns, os.stat(self.overlay_dir).st_mtime_ns)
+        if mtimes == self._dir_mtimes and not self._settling:
+            return False
+        self._dir_mtimes = mtimes
+        return True
+
+    def _hold(self, held: set) -> None:
+        for name in sorted(held - self._held):
+            self.log(f"Holding {name} until its counterpart arrives")
+        self._held = held
+
+    def poll(self) -> int:
+        """Scan if anything changed and insert the new complete pairs; returns how many were added"""
+        if not self._changed():
+            return 0
+        try:
+            return self._register_new_pairs()
+        except Exception:
+            self._dir_mtimes = None  # rescan on the next poll
+            raise
+
+    def _register_new_pairs(self) -> int:
+        pairs, unpaired, orphan_overlays = ingest.scan_pairs(self.original_dir, self.overlay_dir)
+        self._hold(set(unpaired) | set(orphan_overlays))
+
+        db = self.session_factory()
+        try:
+            known = ingest.known_filenames(db)
+            db.commit()  # hashing and rendering below run outside any transaction
+            now = time.time()
+            ready, self._settling = [], False
+            for filename, (stat, overlay_stat) in pairs.items():
+                if filename in known:
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns, overlay_stat.st_size, overlay_stat.st_mtime_ns)
+                if self._skipped.get(filename) == signature:
+                    continue
+                if now - max(stat.st_mtime, overlay_stat.st_mtime) < WATCH_SETTLE_SECONDS:
+                    self._settling = True  # rescan on the next poll even if no directory changes
+                    continue
+                ready.append(filename)
+            if not ready:
+                return 0
+
+            verified, invalid = ingest.verify_pairs(self.original_dir, self.overlay_dir, ready, log=self.log)
+            self._skip(pairs, invalid)
+            if not verified:
+                return 0
+            if self._pool is None and derivatives.enabled():
+                self._pool = derivatives.process_pool()
+            try:
+                derivatives.attach(self.original_dir, self.overlay_dir, ingest.overlay_filename, verified,
+                                   log=self.log, executor=self._pool)
+            except BrokenProcessPool:
+                self._pool = None  # a worker died: start a fresh pool on the next poll
+                raise
+
+            outcomes, _ = ingest.upsert_cases(db, pairs, verified, log=self.log)
+        finally:
+            db.close()
+
+        self._skip(pairs, [filename for filename, outcome in outcomes.items() if outcome == "duplicate"])
+        added = sum(1 for outcome in outcomes.values() if outcome == "added")
+        renamed = sum(1 for outcome in outcomes.values() if outcome == "renamed")
+        if added:
+            self.log(f"Registered {added} new cases")
+        if renamed:
+            self.log(f"Matched {renamed} renamed pairs to their existing cases")
+        return added
+
+    def _skip(self, pairs: dict, filenames: list[str]) -> None:
+        for filename in filenames:
+            stat, overlay_stat = pairs[filename]
+            self._skipped[filename] = (stat.st_size, stat.st_mtime_ns, overlay_stat.st_size, overlay_stat.st_mtime_ns)
+
+
+def acquire_lock() -> Optional[int]:
+    """Non-blocking exclusive lock so only one process per host watches; None when already taken"""
+    fd = os.open(WATCH_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+async def run_forever(watcher: CaseWatcher, interval: float = WATCH_INTERVAL_SECONDS) -> None:
+    """Background task for the API: poll on the threadpool so requests keep flowing"""
+    while True:
+        try:
+            await run_in_threadpool(watcher.poll)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            watcher.log(f"Case watcher error: {e}")
+        await asyncio.sleep(interval)
+
+
+def main():
+    init_db()
+    if acquire_lock() is None:
+        print(f"Another case watcher is already running ({WATCH_LOCK_FILE})")
+        return
+    watcher = CaseWatcher()
+    print(f"Watching {ORIGINAL_DIR} and {OVERLAY_DIR} every {WATCH_INTERVAL_SECONDS:g}s (Ctrl+C to stop)")
+    try:
+        while True:
+            try:
+                watcher.poll()
+            except Exception as e:
+                print(f"Case watcher error: {e}")
+            time.sleep(WATCH_INTERVAL_SECONDS)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
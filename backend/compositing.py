@@ -0,0 +1,220 @@
+"""
+Server-side image + mask compositing.
+
+The viewer normally downloads the image and the mask and blends them in the
+browser, which doubles the bytes per case. The composite endpoint blends
+them once on the server (Pillow's 8-bit alpha compositing, the same result
+as drawing the mask over the image with CSS opacity) and returns a single
+image. Renders run on a dedicated pool of COMPOSITE_RENDER_WORKERS threads,
+so a burst of cache misses queues instead of decoding every full-resolution
+fundus image at once.
+
+Opacity is quantized to COMPOSITE_OPACITY_STEP so that the few values the
+UI actually uses share cache entries. Results are cached in two bounded
+LRU tiers: encoded bytes in memory (COMPOSITE_MEMORY_CACHE_MB) and files on
+disk under database/composites/ (COMPOSITE_DISK_CACHE_MB). Hit and miss
+counters are per process.
+
+Requires Pillow.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import asyncio
+import io
+import os
+import threading
+
+COMPOSITE_OPACITY_STEP = float(os.getenv("COMPOSITE_OPACITY_STEP", "0.1"))
+COMPOSITE_MEMORY_CACHE_MB = int(os.getenv("COMPOSITE_MEMORY_CACHE_MB", "64"))
+COMPOSITE_DISK_CACHE_MB = int(os.getenv("COMPOSITE_DISK_CACHE_MB", "1024"))
+COMPOSITE_RENDER_WORKERS = int(os.getenv("COMPOSITE_RENDER_WORKERS", "2"))
+COMPOSITE_QUALITY = 85
+COMPOSITES_DIR = "composites"  # relative to the static 'database' directory
+
+PIL_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "database"))
+
+
+_render_executor = ThreadPoolExecutor(max_workers=COMPOSITE_RENDER_WORKERS, thread_name_prefix="composite")
+
+
+def available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def quantize_opacity(opacity: float) -> int:
+    """Opacity in [0, 1] snapped to the nearest step, as an integer percentage"""
+    steps = round(min(max(opacity, 0.0), 1.0) / COMPOSITE_OPACITY_STEP)
+    return min(100, round(steps * COMPOSITE_OPACITY_STEP * 100))
+
+
+def blend(image, mask, opacity: float):
+    """
+    Alpha-blend mask over image (both PIL images) at the given opacity.
+    The mask's own alpha channel, if any, is honoured per pixel. Everything
+    stays in 8-bit images (no full-resolution float copies).
+    """
+    from PIL import Image
+
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.LANCZOS)
+    overlay = mask.convert("RGBA")
+    alpha = overlay.getchannel("A").point([round(value * opacity) for value in range(256)])
+    return Image.composite(overlay.convert("RGB"), image.convert("RGB"), alpha)
+
+
+def render(image_path: str, mask_path: str, opacity_percent: int, width: Optional[int], fmt: str) -> bytes:
+    from PIL import Image
+
+    with Image.open(image_path) as image, Image.open(mask_path) as mask:
+        if width and width < image.width:
+            size = (width, round(image.height * width / image.width))
+            image = image.convert("RGB").resize(size, Image.LANCZOS, reducing_gap=2.0)
+            mask = mask.convert("RGBA").resize(size, Image.LANCZOS, reducing_gap=2.0)
+        composite = blend(image, mask, opacity_percent / 100)
+    buffer = io.BytesIO()
+    composite.save(buffer, PIL_FORMATS[fmt], quality=COMPOSITE_QUALITY)
+    return buffer.getvalue()
+
+
+async def render_async(image_path: str, mask_path: str, opacity_percent: int, width: Optional[int], fmt: str) -> bytes:
+    """render on the bounded composite pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_executor, render, image_path, mask_path, opacity_percent, width, fmt)
+
+
+class CompositeCache:
+    """Size-bounded LRU of encoded composites in memory, backed by a size-bounded LRU directory on disk"""
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._memory_used = 0
+        self._disk_used: Optional[int] = None  # measured lazily on the first disk write
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return data
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mtime doubles as the disk tier's recency
+        except OSError:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["disk_hits"] += 1
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._remember(key, data)
+        if self.disk_bytes <= 0:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = self._measure_disk()
+            else:
+                self._disk_used += len(data)
+            over = self._disk_used > self.disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._memory_used -= len(previous)
+            self._entries[key] = data
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._memory_used -= len(evicted)
+                self.stats["memory_evictions"] += 1
+
+    def _files(self) -> list:
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return files
+
+    def _measure_disk(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def _evict_disk(self) -> None:
+        """Drop least recently used files until the directory is back to 90% of its budget"""
+        files = sorted(self._files())
+        used = sum(size for _, size, _ in files)
+        target = self.disk_bytes * 0.9
+        evicted = 0
+        for _, size, path in files:
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            used -= size
+            evicted += 1
+        with self._lock:
+            self._disk_used = used
+            self.stats["disk_evictions"] += evicted
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "hit_ratio": hits / lookups if lookups else None,
+                "memory_entries": len(self._entries),
+                "memory_bytes": self._memory_used,
+                "disk_bytes": self._disk_used,
+            }
+
+
+composite_cache = CompositeCache(
+    os.path.join(STATIC_DIR, COMPOSITES_DIR),
+    COMPOSITE_MEMORY_CACHE_MB * 1024 * 1024,
+    COMPOSITE_DISK_CACHE_MB * 1024 * 1024
+)
+
+
+def cache_key(content_key: str, opacity_percent: int, width: Optional[int], fmt: str) -> str:
+    return f"{content_key}_o{opacity_percent}_w{width or 'full'}.{fmt}"
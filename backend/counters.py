@@ -0,0 +1,85 @@
+"""
+Materialized counters for /admin/stats and /evaluations/progress.
+
+Each counter is a row updated in the same transaction as the write that
+changes it, so both endpoints read a couple of primary-key rows instead of
+running COUNT(*) over whole tables.
+
+Rebuild from scratch with: python counters.py
+"""
+from typing import Dict
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, init_db, Counter, Case, User, Evaluation, UserRole
+
+TOTAL_CASES = "total_cases"
+TOTAL_EVALUATORS = "total_evaluators"
+TOTAL_EVALUATIONS = "total_evaluations"
+COMPLETED_PREFIX = "completed:"
+
+
+def completed_key(user_id: str) -> str:
+    # Also accepts a user id column, giving a SQL expression to join counters on
+    return COMPLETED_PREFIX + user_id
+
+
+def increment(db: Session, name: str, delta: int = 1) -> None:
+    """Atomically add delta to a counter, creating it if needed (caller commits)"""
+    updated = db.query(Counter).filter(Counter.name == name).update(
+        {Counter.value: Counter.value + delta}, synchronize_session=False
+    )
+    if not updated:
+        db.add(Counter(name=name, value=delta))
+        db.flush()
+
+
+def create(db: Session, names: list[str], value: int = 0) -> None:
+    """Bulk insert counters that do not exist yet, e.g. for newly created users (caller commits)"""
+    if names:
+        db.execute(insert(Counter), [{"name": name, "value": value} for name in names])
+
+
+def remove(db: Session, name: str) -> None:
+    db.query(Counter).filter(Counter.name == name).delete(synchronize_session=False)
+
+
+def get_many(db: Session, *names: str) -> Dict[str, int]:
+    """Current values of the given counters in one query; missing counters read as 0"""
+    values = dict(db.query(Counter.name, Counter.value).filter(Counter.name.in_(names)).all())
+    return {name: values.get(name, 0) for name in names}
+
+
+def rebuild(db: Session) -> None:
+    """Recompute every counter from the source tables"""
+    db.query(Counter).delete(synchronize_session=False)
+    rows = [
+        Counter(name=TOTAL_CASES, value=db.query(func.count(Case.id)).scalar()),
+        Counter(name=TOTAL_EVALUATORS, value=db.query(func.count(User.id)).filter(
+            User.role == UserRole.EVALUATOR
+        ).scalar()),
+        Counter(name=TOTAL_EVALUATIONS, value=db.query(func.count(Evaluation.id)).scalar()),
+    ]
+    completed = dict(db.query(Evaluation.user_id, func.count(Evaluation.id)).group_by(Evaluation.user_id).all())
+    for (user_id,) in db.query(User.id):
+        rows.append(Counter(name=completed_key(user_id), value=completed.get(user_id, 0)))
+    db.add_all(rows)
+    db.commit()
+
+
+def ensure(db: Session) -> None:
+    """Build the counters once for databases that predate them"""
+    if db.query(Counter).filter(Counter.name == TOTAL_CASES).first() is None:
+        rebuild(db)
+
+
+if __name__ == "__main__":
+    init_db()
+    db = SessionLocal()
+    try:
+        print("Rebuilding counters...")
+        rebuild(db)
+        print(get_many(db, TOTAL_CASES, TOTAL_EVALUATORS, TOTAL_EVALUATIONS))
+    finally:
+        db.close()
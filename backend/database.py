@@ -1,17 +1,92 @@
-from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime, ForeignKey, Enum, JSON
+from sqlalchemy import create_engine, event, literal_column, Column, String, Integer, BigInteger, Text, DateTime, ForeignKey, Enum, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
+from starlette.concurrency import run_in_threadpool
+from typing import Callable
+import asyncio
 import enum
 import uuid
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./evaluation.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+# SQLite tuning. "production" switches every connection to WAL so readers no
+# longer block the writer, waits on locks instead of failing immediately and
+# sizes the pool for gunicorn's threadpool.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default")  # "default" | "production"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable enough under WAL
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
+# Async stack: DB_ASYNC=1 serves routes from an AsyncSession (aiosqlite for
+# SQLite, any async driver via ASYNC_DATABASE_URL) instead of the threadpool
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+_scheme, _, _location = DATABASE_URL.partition(":")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", f"{ASYNC_DRIVERS.get(_scheme, _scheme)}:{_location}")
+
+is_sqlite = "sqlite" in DATABASE_URL
+use_sqlite_production = is_sqlite and SQLITE_PROFILE == "production"
+
+engine_kwargs = {}
+connect_args = {"check_same_thread": False} if is_sqlite else {}
+if use_sqlite_production:
+    connect_args["timeout"] = SQLITE_BUSY_TIMEOUT_MS / 1000
+    engine_kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **engine_kwargs)
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")  # negative = KiB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _sqlite_manual_begin(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself (see _sqlite_begin) instead of the driver
+    dbapi_connection.isolation_level = None
+
+
+def _sqlite_begin(conn):
+    conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+
+def _configure_sqlite(sync_engine):
+    event.listen(sync_engine, "connect", _sqlite_manual_begin)
+    event.listen(sync_engine, "begin", _sqlite_begin)
+    if use_sqlite_production:
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+
+
+if is_sqlite:
+    _configure_sqlite(engine)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_connect_args = {}
+    if use_sqlite_production:
+        async_connect_args["timeout"] = SQLITE_BUSY_TIMEOUT_MS / 1000
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=async_connect_args, **engine_kwargs)
+    if is_sqlite:
+        _configure_sqlite(async_engine.sync_engine)
+    # expire_on_commit=False: results are read after the session work returns
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# SQLite has a single writer: on the async stack, writers queue here on the event
+# loop instead of hundreds of them spinning in SQLite's busy handler
+_sqlite_write_lock = asyncio.Lock()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -65,9 +140,106 @@ class Evaluation(Base):
     user = relationship("User", back_populates="evaluations")
     case = relationship("Case", back_populates="evaluations")
 
+    # Existing databases get these through migrations.py
+    __table_args__ = (
+        # One evaluation per reader and case, enforced by the database; also serves per-user lookups
+        Index("uq_evaluations_user_case", "user_id", "case_id", unique=True),
+        Index("ix_evaluations_case_id", "case_id"),
+        Index("ix_evaluations_submitted_at_id", "submitted_at", "id"),  # delta export keyset
+    )
+
+
+def sqlite_timestamp_key(column):
+    """
+    Comparable form of a timestamp column on SQLite. Timestamps are stored as
+    text in two shapes (CURRENT_TIMESTAMP defaults without fraction, ORM writes
+    with microseconds) that do not compare correctly as strings. The format is
+    rendered literally so the expression matches the *_key indexes below.
+    """
+    return func.strftime(literal_column("'%Y-%m-%d %H:%M:%f'"), column)
+
+
+# Delta export keysets on SQLite, which compares the normalized expression above
+Index(
+    "ix_evaluations_submitted_key", sqlite_timestamp_key(Evaluation.submitted_at), Evaluation.id
+).ddl_if(dialect="sqlite")
+
+
+class Counter(Base):
+    """Materialized counts kept in step with writes (see counters.py)"""
+    __tablename__ = "counters"
+
+    name = Column(String(64), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class DurationBucket(Base):
+    """One bucket of a reading-time quantile sketch (see durations.py)"""
+    __tablename__ = "duration_buckets"
+
+    scope = Column(String(64), primary_key=True)  # "all", "user:<id>" or "case:<id>"
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class EvaluationTombstone(Base):
+    """Marks an evaluation deleted along with its evaluator, for delta export consumers"""
+    __tablename__ = "evaluation_tombstones"
+
+    evaluation_id = Column(String(36), primary_key=True)
+    user_id = Column(String(36), nullable=False)
+    case_id = Column(String(36), nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+
+Index(
+    "ix_evaluation_tombstones_deleted_key",
+    sqlite_timestamp_key(EvaluationTombstone.deleted_at), EvaluationTombstone.evaluation_id
+).ddl_if(dialect="sqlite")
+
+
+class EvaluationIdempotencyKey(Base):
+    """Client-chosen key of a batch-submitted evaluation, so a retried batch is not applied twice"""
+    __tablename__ = "evaluation_idempotency_keys"
+
+    user_id = Column(String(36), ForeignKey("users.id"), primary_key=True)
+    idempotency_key = Column(String(64), primary_key=True)
+    case_id = Column(String(36), nullable=False)
+    evaluation_id = Column(String(36), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CaseQueueEntry(Base):
+    """Pre-shuffled per-evaluator assignment queue (see case_queue.py)"""
+    __tablename__ = "case_queue"
+
+    user_id = Column(String(36), ForeignKey("users.id"), primary_key=True)
+    case_id = Column(String(36), ForeignKey("cases.id"), primary_key=True)
+    position = Column(BigInteger, nullable=False)  # random sort key
+
+    __table_args__ = (
+        Index("ix_case_queue_user_position", "user_id", "position"),
+    )
+
+
+class CaseCoverage(Base):
+    """Ratings per case plus a short lease, used by the coverage scheduler (see case_queue.py)"""
+    __tablename__ = "case_coverage"
+
+    case_id = Column(String(36), ForeignKey("cases.id"), primary_key=True)
+    ratings = Column(Integer, nullable=False, default=0, index=True)
+    lease_user_id = Column(String(36), index=True)
+    lease_expires_at = Column(DateTime)  # naive UTC
+
+
+# Dependency for FastAPI: an AsyncSession with DB_ASYNC=1, a plain Session otherwise.
+# Routes hand their (sync) ORM code to run_db, which works with either.
+async def get_db():
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as session:
+            yield session
+        return
 
-# Dependency for FastAPI
-def get_db():
     db = SessionLocal()
     try:
         yield db
@@ -75,6 +247,49 @@ def get_db():
         db.close()
 
 
-# Create all tables
+def _unit_of_work(db, fn: Callable, *args, **kwargs):
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        # Hand the connection back right away: an async route keeps its
+        # session across awaits, and must not pin a pooled connection meanwhile
+        db.close()
+
+
+def begin_write(db) -> None:
+    """
+    Start db's next transaction as a write transaction; call it first in a unit
+    of work that writes. On SQLite this is BEGIN IMMEDIATE: a transaction that
+    reads first and writes later fails with "database is locked" instead of
+    waiting when another writer commits in between. No-op on other backends.
+    """
+    if is_sqlite:
+        db.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+
+
+async def run_db(db, fn: Callable, *args, **kwargs):
+    """
+    Run fn(session, *args, **kwargs) as one unit of work without blocking the
+    event loop. Async sessions run it through AsyncSession.run_sync, so every
+    query awaits the async driver; sync sessions run it on the threadpool.
+    fn commits its own writes; the session is closed afterwards, so return
+    plain values (schemas, dicts) or objects whose attributes are loaded.
+    """
+    if DB_ASYNC:
+        return await db.run_sync(_unit_of_work, fn, *args, **kwargs)
+    return await run_in_threadpool(_unit_of_work, db, fn, *args, **kwargs)
+
+
+async def run_db_write(db, fn: Callable, *args, **kwargs):
+    """run_db for units of work that write (fn still calls begin_write itself)"""
+    if DB_ASYNC and is_sqlite:
+        async with _sqlite_write_lock:
+            return await run_db(db, fn, *args, **kwargs)
+    return await run_db(db, fn, *args, **kwargs)
+
+
+# Create missing tables, then bring existing ones up to date
 def init_db():
     Base.metadata.create_all(bind=engine)
+    import migrations
+    migrations.upgrade(engine)
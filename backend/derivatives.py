@@ -0,0 +1,162 @@
+"""
+Downscaled WebP (and optionally AVIF) derivatives of case images and masks.
+
+Full-size fundus images are several MB each. At ingest, every image and
+overlay is rendered at the DERIVATIVE_WIDTHS narrower than the source, in
+each of DERIVATIVE_FORMATS, on a process pool. Files are stored under
+database/derivatives/ and named after the source's content hash, so
+re-ingesting, renaming or duplicating a file reuses what is already on
+disk. The generated keys are kept in case_metadata["variants"] and exposed
+by CaseOut.variants, so the client can build a srcset and fetch the size it
+needs.
+
+Requires Pillow; without it ingestion proceeds and cases simply have no
+variants.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from typing import Callable, Optional
+import multiprocessing
+import os
+
+DERIVATIVE_WIDTHS = sorted(int(w) for w in os.getenv("DERIVATIVE_WIDTHS", "640,1280,1920").split(",") if w.strip())
+DERIVATIVE_FORMATS = [f.strip() for f in os.getenv("DERIVATIVE_FORMATS", "webp").split(",") if f.strip()]  # webp, avif
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", str(os.cpu_count() or 1)))
+DERIVATIVES_DIR = "derivatives"  # relative to the static 'database' directory
+
+PIL_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+
+# Which metadata field holds the source width of each image kind
+KINDS = {"image": "width", "mask": "overlay_width"}
+
+
+def supported_formats() -> list[str]:
+    """Requested formats that this Pillow build can encode (empty without Pillow)"""
+    try:
+        from PIL import features
+    except ImportError:
+        return []
+    return [f for f in DERIVATIVE_FORMATS if f in PIL_FORMATS and features.check(f)]
+
+
+def enabled() -> bool:
+    return bool(DERIVATIVE_WIDTHS) and bool(supported_formats())
+
+
+def planned_widths(source_width: Optional[int]) -> list[int]:
+    """Configured widths below the source width (derivatives never upscale)"""
+    return [w for w in DERIVATIVE_WIDTHS if source_width and w < source_width]
+
+
+def _lossless(fmt: str, lossless: bool) -> bool:
+    return lossless and fmt == "webp"
+
+
+def derivative_key(sha256: str, width: int, fmt: str, lossless: bool = False) -> str:
+    suffix = "_lossless" if _lossless(fmt, lossless) else ""
+    return f"{DERIVATIVES_DIR}/{sha256[:2]}/{sha256}_{width}{suffix}.{fmt}"
+
+
+def missing(metadata: dict) -> bool:
+    """Whether a case lacks any derivative the current configuration calls for"""
+    if not enabled():
+        return False
+    variants = metadata.get("variants") or {}
+    for kind, width_field in KINDS.items():
+        for fmt in supported_formats():
+            have = variants.get(kind, {}).get(fmt, {})
+            if any(str(w) not in have for w in planned_widths(metadata.get(width_field))):
+                return True
+    return False
+
+
+def render(static_dir: str, source_path: str, sha256: str, widths: list[int],
+           formats: list[str], lossless: bool) -> dict:
+    """
+    Render one source at the given widths and formats, skipping files already
+    on disk. Runs in a worker process; returns {format: {width: key}}.
+    """
+    from PIL import Image
+
+    result = {fmt: {} for fmt in formats}
+    image = None
+    for width in widths:
+        pending = []
+        for fmt in formats:
+            key = derivative_key(sha256, width, fmt, lossless)
+            result[fmt][str(width)] = key
+            path = os.path.join(static_dir, key)
+            if not os.path.exists(path):
+                pending.append((fmt, path))
+        if not pending:
+            continue
+
+        if image is None:
+            image = Image.open(source_path)
+            image.load()
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt, path in pending:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            options = {"lossless": True} if _lossless(fmt, lossless) else {"quality": DERIVATIVE_QUALITY}
+            resized.save(tmp, PIL_FORMATS[fmt], **options)
+            os.replace(tmp, path)  # atomic: readers never see a partial file
+    return result
+
+
+def process_pool(workers: int = DERIVATIVE_WORKERS) -> ProcessPoolExecutor:
+    """
+    Pool for render(). Spawned rather than forked: the API uses it from a
+    process with running threads and held locks. Workers start on first use.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def attach(original_dir: str, overlay_dir: str, overlay_name: Callable[[str], str], verified: dict,
+           workers: int = DERIVATIVE_WORKERS, log: Callable[[str], None] = print,
+           executor: Optional[Executor] = None) -> None:
+    """
+    Generate the derivatives of verified pairs on a process pool and record
+    them in each pair's metadata under "variants". Failures are logged and
+    leave that pair without variants. Long-running callers pass their own
+    executor (see process_pool) instead of starting a pool per call.
+    """
+    if not verified or not DERIVATIVE_WIDTHS:
+        return
+    formats = supported_formats()
+    if not formats:
+        log("Warning: Pillow with WebP/AVIF support is not installed; skipping image derivatives")
+        return
+
+    static_dir = os.path.dirname(original_dir)
+    jobs = []
+    for filename, metadata in verified.items():
+        sources = {
+            "image": (os.path.join(original_dir, filename), metadata["sha256"], False),
+            # Masks are flat colours on black: lossless WebP keeps edges clean and stays small
+            "mask": (os.path.join(overlay_dir, overlay_name(filename)), metadata["overlay_sha256"], True),
+        }
+        for kind, (path, sha256, lossless) in sources.items():
+            widths = planned_widths(metadata.get(KINDS[kind]))
+            if widths:
+                jobs.append((filename, kind, (static_dir, path, sha256, widths, formats, lossless)))
+    if not jobs:
+        return
+
+    pool = nullcontext(executor) if executor is not None else process_pool(workers)
+    with pool as pool_executor:
+        futures = [(filename, kind, pool_executor.submit(render, *args)) for filename, kind, args in jobs]
+        for filename, kind, future in futures:
+            try:
+                variants = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool) and executor is not None:
+                    raise  # the caller's pool is unusable from now on; it has to start a new one
+                log(f"Warning: Could not render {kind} derivatives for {filename}: {e}")
+                continue
+            verified[filename].setdefault("variants", {})[kind] = variants
@@ -0,0 +1,194 @@
+"""
+Reading-time quantile sketches for /admin/reading-times.
+
+Every scope (all evaluations, one evaluator, one case) keeps a DDSketch of
+duration_ms: logarithmic buckets whose bounds grow by a factor GAMMA, so any
+quantile read from them is within RELATIVE_ACCURACY of the true value. Each
+non-empty bucket is a (scope, bucket, count) row bumped in the same
+transaction as the evaluation, like counters.py, so a percentile query reads
+at most a few hundred rows of its scope no matter how many evaluations
+exist. Sketches of the same accuracy merge by adding bucket counts.
+
+Rebuild from scratch with: python durations.py
+"""
+from collections import Counter as Tally
+from typing import Iterable, Optional
+import math
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, begin_write, init_db, DurationBucket, Evaluation
+
+# Changing the accuracy changes every bucket index: rebuild afterwards
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+GLOBAL_SCOPE = "all"
+
+
+def user_scope(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def case_scope(case_id: str) -> str:
+    return f"case:{case_id}"
+
+
+def bucket_index(duration_ms: int) -> int:
+    """Bucket covering (GAMMA^(i-1), GAMMA^i]; everything under 1 ms shares bucket 0"""
+    return max(0, math.ceil(math.log(max(duration_ms, 1)) / _LOG_GAMMA))
+
+
+def bucket_value(index: int) -> float:
+    """Representative value of a bucket, within RELATIVE_ACCURACY of anything in it"""
+    if index <= 0:
+        return 1.0
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class Sketch:
+    """Bucket counts of one scope, or of several merged"""
+
+    def __init__(self, buckets: Optional[dict] = None):
+        self.buckets = Tally(buckets or {})
+
+    def merge(self, other: "Sketch") -> "Sketch":
+        self.buckets.update(other.buckets)
+        return self
+
+    @property
+    def count(self) -> int:
+        return sum(count for count in self.buckets.values() if count > 0)
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += max(self.buckets[index], 0)
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.buckets))
+
+    def summary(self) -> dict:
+        summary = {"count": self.count}
+        for name, q in QUANTILES.items():
+            value = self.quantile(q)
+            summary[name] = None if value is None else round(value)
+        return summary
+
+
+def _deltas(rows: Iterable[tuple], sign: int = 1) -> Tally:
+    """(user_id, case_id, duration_ms) rows -> {(scope, bucket): delta}; rows without a duration are skipped"""
+    deltas = Tally()
+    for user_id, case_id, duration_ms in rows:
+        if duration_ms is None:
+            continue
+        index = bucket_index(duration_ms)
+        for scope in (GLOBAL_SCOPE, user_scope(user_id), case_scope(case_id)):
+            deltas[scope, index] += sign
+    return deltas
+
+
+def _apply(db: Session, deltas: dict) -> None:
+    """Atomically add each delta to its bucket row, creating it if needed (caller commits)"""
+    for (scope, index), delta in deltas.items():
+        updated = db.query(DurationBucket).filter(
+            DurationBucket.scope == scope, DurationBucket.bucket == index
+        ).update({DurationBucket.count: DurationBucket.count + delta}, synchronize_session=False)
+        if not updated:
+            db.add(DurationBucket(scope=scope, bucket=index, count=delta))
+            db.flush()
+
+
+def record(db: Session, user_id: str, case_id: str, duration_ms: Optional[int]) -> None:
+    """Add a submitted evaluation's reading time to its sketches (caller commits)"""
+    _apply(db, _deltas([(user_id, case_id, duration_ms)]))
+
+
+def record_many(db: Session, rows: list[tuple]) -> None:
+    """record for several (user_id, case_id, duration_ms) rows, one statement per touched bucket"""
+    _apply(db, _deltas(rows))
+
+
+def remove_user(db: Session, user_id: str) -> None:
+    """Take a user's evaluations out of the global and case sketches and drop theirs (before deleting them)"""
+    rows = db.query(Evaluation.user_id, Evaluation.case_id, Evaluation.duration_ms).filter(
+        Evaluation.user_id == user_id
+    ).all()
+    scope = user_scope(user_id)
+    _apply(db, {key: delta for key, delta in _deltas(rows, sign=-1).items() if key[0] != scope})
+    db.query(DurationBucket).filter(
+        (DurationBucket.scope == scope) | (DurationBucket.count <= 0)
+    ).delete(synchronize_session=False)
+
+
+def load(db: Session, scope: str) -> Sketch:
+    """The sketch of one scope: a primary-key range read"""
+    return Sketch(dict(db.query(DurationBucket.bucket, DurationBucket.count).filter(
+        DurationBucket.scope == scope
+    ).all()))
+
+
+def load_many(db: Session, scopes: list[str]) -> dict[str, Sketch]:
+    """Sketches of several scopes in one query, e.g. the evaluators on one admin page"""
+    sketches = {scope: Sketch() for scope in scopes}
+    if scopes:
+        rows = db.query(DurationBucket.scope, DurationBucket.bucket, DurationBucket.count).filter(
+            DurationBucket.scope.in_(scopes)
+        )
+        for scope, index, count in rows:
+            sketches[scope].buckets[index] = count
+    return sketches
+
+
+def load_prefix(db: Session, prefix: str) -> dict[str, Sketch]:
+    """Sketches of every scope starting with prefix ("user:" or "case:"), by id"""
+    sketches: dict[str, Sketch] = {}
+    rows = db.query(DurationBucket.scope, DurationBucket.bucket, DurationBucket.count).filter(
+        DurationBucket.scope.startswith(prefix, autoescape=True)
+    ).order_by(DurationBucket.scope)
+    for scope, index, count in rows:
+        sketches.setdefault(scope[len(prefix):], Sketch()).buckets[index] = count
+    return sketches
+
+
+def rebuild(db: Session) -> None:
+    """Recompute every sketch from the evaluations table"""
+    begin_write(db)
+    db.execute(delete(DurationBucket))
+    rows = db.execute(select(Evaluation.user_id, Evaluation.case_id, Evaluation.duration_ms).where(
+        Evaluation.duration_ms.isnot(None)
+    ))
+    deltas = _deltas(rows)
+    if deltas:
+        db.execute(insert(DurationBucket), [
+            {"scope": scope, "bucket": index, "count": count} for (scope, index), count in deltas.items()
+        ])
+    db.commit()
+
+
+def ensure(db: Session) -> None:
+    """Build the sketches once for databases that predate them"""
+    if db.query(DurationBucket.scope).first() is not None:
+        return
+    pending = db.query(Evaluation.id).filter(Evaluation.duration_ms.isnot(None)).first() is not None
+    db.commit()  # end the read so rebuild starts a write transaction
+    if pending:
+        rebuild(db)
+
+
+if __name__ == "__main__":
+    init_db()
+    db = SessionLocal()
+    try:
+        print("Rebuilding reading-time sketches...")
+        rebuild(db)
+        print({GLOBAL_SCOPE: load(db, GLOBAL_SCOPE).summary()})
+    finally:
+        db.close()
@@ -0,0 +1,172 @@
+"""
+Bulk evaluator import for onboarding a whole reading study at once.
+
+The upload is a CSV with an email,name,password header or JSONL with one
+{"email", "name", "password"} object per line. Every row is validated before
+anything is written: schema errors, emails repeated within the file and
+emails already registered (one IN query over the whole set) are reported per
+row. Passwords of the accepted rows are then hashed on a process pool, so
+bcrypt runs on every core instead of one request thread, and all users,
+their case queues and counters are inserted in a single transaction.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import csv
+import io
+import json
+import multiprocessing
+import os
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from database import begin_write, generate_uuid, User, UserRole
+from schemas import UserCreate
+import case_queue
+import counters
+
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "5000"))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+EMAIL_BATCH_SIZE = 500
+
+FIELDS = ("email", "name", "password")
+
+
+class ImportFileError(ValueError):
+    """The upload as a whole cannot be read (bad encoding, header or JSON)"""
+
+
+def _hash(password: str) -> str:
+    # Imported in the worker process
+    from auth import get_password_hash
+    return get_password_hash(password)
+
+
+def parse(content: bytes, fmt: str) -> list[tuple[int, dict]]:
+    """(line number, raw fields) of every non-empty row"""
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ImportFileError("File must be UTF-8 encoded")
+
+    rows = []
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [field for field in ("email", "password") if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ImportFileError(f"Missing CSV column(s): {', '.join(missing)}")
+        for row in reader:
+            if any((value or "").strip() for value in row.values() if isinstance(value, str)):
+                rows.append((reader.line_num, {field: row.get(field) for field in FIELDS}))
+    else:
+        for line_num, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ImportFileError(f"Line {line_num} is not valid JSON")
+            if not isinstance(row, dict):
+                raise ImportFileError(f"Line {line_num} is not a JSON object")
+            rows.append((line_num, {field: row.get(field) for field in FIELDS}))
+
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise ImportFileError(f"Too many rows ({len(rows)}); the limit is {IMPORT_MAX_ROWS}")
+    return rows
+
+
+def validate(rows: list[tuple[int, dict]]) -> tuple[list[dict], list[tuple[dict, UserCreate]]]:
+    """
+    Per-row report entries, plus (report entry, user) for the rows that passed
+    schema and in-file duplicate checks; those entries stay "pending".
+    """
+    report, accepted = [], []
+    first_line = {}
+    for line_num, fields in rows:
+        email = fields.get("email")
+        # JSONL values may be any JSON type; the report only carries strings
+        entry = {"row": line_num, "email": None if email is None else str(email), "status": "pending"}
+        report.append(entry)
+        if fields.get("name") == "":
+            fields["name"] = None
+        try:
+            user = UserCreate.model_validate(fields)
+        except ValidationError as e:
+            error = e.errors()[0]
+            entry["status"] = "invalid"
+            entry["error"] = f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            continue
+        if not user.password:
+            entry["status"] = "invalid"
+            entry["error"] = "password: must not be empty"
+            continue
+        entry["email"] = user.email
+        if user.email in first_line:
+            entry["status"] = "duplicate"
+            entry["error"] = f"Email repeated from row {first_line[user.email]}"
+            continue
+        first_line[user.email] = line_num
+        accepted.append((entry, user))
+    return report, accepted
+
+
+def existing_emails(db: Session, emails: list[str]) -> set[str]:
+    """Which of the given emails are already registered, in a few IN queries"""
+    found = set()
+    for start in range(0, len(emails), EMAIL_BATCH_SIZE):
+        batch = emails[start:start + EMAIL_BATCH_SIZE]
+        found.update(row.email for row in db.query(User.email).filter(User.email.in_(batch)))
+    return found
+
+
+def mark_existing(accepted: list[tuple[dict, UserCreate]], existing: set[str]) -> list[tuple[dict, UserCreate]]:
+    """Flag rows whose email is registered; returns the rows still to create"""
+    remaining = []
+    for entry, user in accepted:
+        if user.email in existing:
+            entry["status"] = "exists"
+            entry["error"] = "Email already registered"
+        else:
+            remaining.append((entry, user))
+    return remaining
+
+
+def hash_passwords(passwords: list[str], workers: int = IMPORT_HASH_WORKERS) -> list[str]:
+    """bcrypt every password on a process pool (spawned, so no server threads or locks are forked)"""
+    if not passwords:
+        return []
+    workers = max(1, min(workers, len(passwords)))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return list(executor.map(_hash, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def insert_evaluators(db: Session, users: list[UserCreate], password_hashes: list[str]) -> Optional[dict]:
+    """
+    Insert the users with their queues and counters in one transaction.
+    Returns {email: id}, or None when an email was registered since validation
+    (nothing is written then).
+    """
+    begin_write(db)
+    if existing_emails(db, [user.email for user in users]):
+        db.rollback()
+        return None
+
+    ids = {user.email: generate_uuid() for user in users}
+    for start in range(0, len(users), case_queue.BATCH_SIZE):
+        db.execute(insert(User), [
+            {
+                "id": ids[user.email],
+                "email": user.email,
+                "name": user.name,
+                "password_hash": password_hash,
+                "role": UserRole.EVALUATOR,
+            }
+            for user, password_hash in zip(users[start:start + case_queue.BATCH_SIZE],
+                                           password_hashes[start:start + case_queue.BATCH_SIZE])
+        ])
+    case_queue.add_users(db, list(ids.values()))
+    counters.increment(db, counters.TOTAL_EVALUATORS, len(users))
+    counters.create(db, [counters.completed_key(user_id) for user_id in ids.values()])
+    db.commit()
+    return ids
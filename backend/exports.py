@@ -0,0 +1,293 @@
+"""
+Streaming evaluation export.
+
+Rows are read in keyset batches (by evaluation id) and encoded as they
+arrive, so memory stays flat no matter how many evaluations exist and the
+first bytes go out right away. Each batch is its own short read
+transaction: a slow client never holds a read lock that would block
+submissions (rollback journal) or checkpoints (WAL) for the whole
+download. The export is therefore not a single snapshot; evaluations
+submitted while it runs may or may not be included.
+
+The delta export pages through evaluations and tombstones after an opaque
+cursor, so downstream mirrors only pull what changed since their last run.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional
+import base64
+import csv
+import io
+import json
+import os
+import zlib
+
+from sqlalchemy import and_, or_
+
+from database import SessionLocal, sqlite_timestamp_key, User, Case, Evaluation, EvaluationTombstone
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = [
+    "evaluation_id",
+    "user_id",
+    "user_email",
+    "user_name",
+    "case_id",
+    "q1_acceptability",
+    "q2_confidence",
+    "comments",
+    "duration_ms",
+    "submitted_at"
+]
+
+EXPORT_FORMATS = {
+    # format: (media type, file extension)
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def case_display_id(case_id: str, case_metadata: Optional[dict]) -> str:
+    """Filename without extension when known, case UUID otherwise"""
+    if case_metadata and "filename" in case_metadata:
+        return os.path.splitext(case_metadata["filename"])[0]
+    return case_id
+
+
+def export_query(db):
+    """Flat column query behind every export format"""
+    return db.query(
+        Evaluation.id,
+        Evaluation.user_id,
+        User.email,
+        User.name,
+        Evaluation.case_id,
+        Case.case_metadata,
+        Evaluation.q1_acceptability,
+        Evaluation.q2_confidence,
+        Evaluation.comments,
+        Evaluation.duration_ms,
+        Evaluation.submitted_at
+    ).join(User, User.id == Evaluation.user_id).join(Case, Case.id == Evaluation.case_id)
+
+
+def export_record(row) -> dict:
+    return {
+        "evaluation_id": row.id,
+        "user_id": row.user_id,
+        "user_email": row.email,
+        "user_name": row.name,
+        "case_id": case_display_id(row.case_id, row.case_metadata),
+        "q1_acceptability": row.q1_acceptability,
+        "q2_confidence": row.q2_confidence,
+        "comments": row.comments,
+        "duration_ms": row.duration_ms,
+        "submitted_at": row.submitted_at.isoformat() if row.submitted_at else None,
+    }
+
+
+def iter_record_batches(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[list[dict]]:
+    """
+    Yield export records in batches from a dedicated session, one short read
+    transaction per batch (keyset on evaluation id).
+    The session is owned by the generator because a StreamingResponse keeps
+    iterating after the request's dependencies have been torn down.
+    """
+    db = SessionLocal()
+    try:
+        last_id = None
+        while True:
+            query = export_query(db)
+            if last_id is not None:
+                query = query.filter(Evaluation.id > last_id)
+            rows = query.order_by(Evaluation.id).limit(batch_size).all()
+            db.commit()  # end the read before the batch is sent at the client's pace
+            if not rows:
+                break
+            last_id = rows[-1].id
+            yield [export_record(row) for row in rows]
+            if len(rows) < batch_size:
+                break
+    finally:
+        db.close()
+
+
+def encode_csv(batches: Iterable[list[dict]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for record in batch:
+            writer.writerow(["" if record[col] is None else record[col] for col in EXPORT_COLUMNS])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Header-only export when there are no evaluations
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def encode_jsonl(batches: Iterable[list[dict]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch).encode("utf-8")
+
+
+def encode_parquet(batches: Iterable[list[dict]]) -> Iterator[bytes]:
+    """One Parquet row group per batch, flushed to the client as soon as it is written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("evaluation_id", pa.string()),
+        ("user_id", pa.string()),
+        ("user_email", pa.string()),
+        ("user_name", pa.string()),
+        ("case_id", pa.string()),
+        ("q1_acceptability", pa.int32()),
+        ("q2_confidence", pa.int32()),
+        ("comments", pa.string()),
+        ("duration_ms", pa.int64()),
+        ("submitted_at", pa.string()),
+    ])
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema)
+    for batch in batches:
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def gzip_stream(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "jsonl": encode_jsonl,
+    "parquet": encode_parquet,
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# === Delta export ===
+# Rows newer than DELTA_SETTLE_SECONDS are held back: submitted_at has
+# one-second resolution on SQLite, and a row committed late within the same
+# second as the cursor would otherwise be skipped for good.
+DELTA_SETTLE_SECONDS = 2
+DELTA_MAX_LIMIT = 10000
+
+
+def encode_delta_cursor(evaluations: Optional[tuple], tombstones: Optional[tuple]) -> str:
+    payload = {
+        "e": [evaluations[0].isoformat(), evaluations[1]] if evaluations else None,
+        "t": [tombstones[0].isoformat(), tombstones[1]] if tombstones else None,
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_delta_cursor(cursor: Optional[str]) -> tuple:
+    """(submitted_at, id) and (deleted_at, evaluation_id) positions; raises ValueError on garbage"""
+    if not cursor:
+        return None, None
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(payload, dict):
+        raise ValueError("Delta cursor is not an object")
+
+    def position(value):
+        if value is None:
+            return None
+        timestamp, key = value
+        return datetime.fromisoformat(timestamp), str(key)
+
+    return position(payload.get("e")), position(payload.get("t"))
+
+
+def _timestamp_key(db, column):
+    """Comparable form of a timestamp column (normalized on SQLite, see sqlite_timestamp_key)"""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite_timestamp_key(column), _sqlite_timestamp
+    return column, lambda value: value
+
+
+def _sqlite_timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S.") + f"{value.microsecond // 1000:03d}"
+
+
+def _after(db, timestamp_col, key_col, position, settled: datetime):
+    """Rows strictly after (timestamp, key) and no newer than the settle horizon"""
+    key, to_key = _timestamp_key(db, timestamp_col)
+    condition = key <= to_key(settled)
+    if position is not None:
+        timestamp, last_key = position
+        condition = and_(condition, or_(
+            key > to_key(timestamp),
+            and_(key == to_key(timestamp), key_col > last_key)
+        ))
+    return condition, key
+
+
+def delta_rows(db, eval_pos: Optional[tuple], tomb_pos: Optional[tuple], limit: int) -> tuple:
+    """
+    Up to limit export_query rows and tombstones after the given positions,
+    in (timestamp, id) order: (rows, tombstones, has_more, eval_pos, tomb_pos)
+    with the positions advanced past what was returned.
+    """
+    settled = datetime.utcnow() - timedelta(seconds=DELTA_SETTLE_SECONDS)
+
+    condition, order_key = _after(db, Evaluation.submitted_at, Evaluation.id, eval_pos, settled)
+    rows = export_query(db).filter(condition).order_by(
+        order_key, Evaluation.id
+    ).limit(limit + 1).all()
+
+    condition, order_key = _after(
+        db, EvaluationTombstone.deleted_at, EvaluationTombstone.evaluation_id, tomb_pos, settled
+    )
+    tombstones = db.query(EvaluationTombstone).filter(condition).order_by(
+        order_key, EvaluationTombstone.evaluation_id
+    ).limit(limit + 1).all()
+
+    has_more = len(rows) > limit or len(tombstones) > limit
+    rows, tombstones = rows[:limit], tombstones[:limit]
+    if rows:
+        eval_pos = (rows[-1].submitted_at, rows[-1].id)
+    if tombstones:
+        tomb_pos = (tombstones[-1].deleted_at, tombstones[-1].evaluation_id)
+    return rows, tombstones, has_more, eval_pos, tomb_pos
+
+
+def delta_page(db, positions: tuple, limit: int) -> dict:
+    """
+    Evaluations and tombstones after the decoded cursor (decode_delta_cursor),
+    in (timestamp, id) order, plus the next cursor
+    """
+    rows, tombstones, has_more, eval_pos, tomb_pos = delta_rows(db, *positions, limit)
+    return {
+        "evaluations": [export_record(row) for row in rows],
+        "tombstones": [
+            {
+                "evaluation_id": t.evaluation_id,
+                "user_id": t.user_id,
+                "case_id": t.case_id,
+                "deleted_at": t.deleted_at.isoformat(),
+            }
+            for t in tombstones
+        ],
+        "next_cursor": encode_delta_cursor(eval_pos, tomb_pos),
+        "has_more": has_more,
+    }
@@ -0,0 +1,113 @@
+"""
+Write-behind group commit for evaluation inserts.
+
+With GROUP_COMMIT=1, request threads hand their write to a single writer
+thread per process instead of committing themselves. The writer collects
+everything that arrives within GROUP_COMMIT_WINDOW_MS (up to
+GROUP_COMMIT_MAX_BATCH items) and commits it in one transaction, so SQLite
+takes the write lock and syncs the WAL once per batch instead of once per
+submit. Each item runs inside its own SAVEPOINT: an item that fails (unknown
+case, invalid scores, a duplicate from a double click) is rolled back and
+fails alone while the rest of the batch commits. Requests that stopped
+waiting (timed out or cancelled) before their item ran are skipped.
+"""
+from concurrent.futures import Future
+from typing import Callable, Optional
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, begin_write
+
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = int(os.getenv("GROUP_COMMIT_WINDOW_MS", "5"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
+# How long a request waits for its batch before giving up
+GROUP_COMMIT_TIMEOUT_SECONDS = 30
+
+
+class GroupCommitter:
+    def __init__(self, session_factory=SessionLocal, window_ms: int = GROUP_COMMIT_WINDOW_MS,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, write: Callable[[Session], object]) -> Future:
+        """
+        Queue write(db) for the next batch. write must stage its changes
+        without committing; the future resolves to its return value once the
+        batch is committed, or to the exception it raised.
+        """
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((write, future))
+        return future
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = [(write, future) for write, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._commit_batch(batch)
+            except Exception as exc:  # the writer must outlive any batch
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def _commit_batch(self, batch: list) -> None:
+        """Run each write in a savepoint and commit the ones that succeeded in one transaction"""
+        db = self.session_factory()
+        results = []
+        try:
+            begin_write(db)
+            for write, future in batch:
+                try:
+                    with db.begin_nested():
+                        value = write(db)
+                except Exception as exc:
+                    future.set_exception(exc)
+                    continue
+                results.append((future, value))
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            for future, _ in results:
+                future.set_exception(exc)
+            return
+        finally:
+            db.close()
+
+        for future, value in results:
+            future.set_result(value)
+
+
+group_committer = GroupCommitter()
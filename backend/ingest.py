@@ -0,0 +1,322 @@
+"""
+Incremental case ingestion from database/original_imgs and database/overlay_imgs.
+
+An original image image.jpg is paired with overlay_imgs/image_overlay.jpg.
+Both folders are listed once with os.scandir and pairs are matched against a
+set of overlay names, instead of one stat per expected overlay.
+
+Ingestion upserts instead of wiping: cases are matched by filename, and a
+file that disappeared under one name and reappeared under another (same
+content hash) keeps its case and therefore its evaluations; a copy of an
+image that is still present under its first name is skipped as a
+duplicate. upsert_cases does this matching for populate_db.py and the case
+watcher alike. Pairs whose
+size and mtime match what was recorded last time are skipped without being
+read. Everything else goes through a parallel verification stage that reads
+both files, hashes them and parses the image headers, recording width,
+height and byte size in case_metadata, then renders the downscaled
+derivatives (see derivatives.py).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+import hashlib
+import os
+import struct
+import uuid
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from database import Case, begin_write
+import case_queue
+import counters
+import derivatives
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+OVERLAY_SUFFIX = "_overlay"
+# hashlib and file reads release the GIL, so threads are enough here
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(32, (os.cpu_count() or 1) * 4))))
+INGEST_BATCH_SIZE = 1000
+
+
+def overlay_filename(filename: str) -> str:
+    """image.jpg -> image_overlay.jpg"""
+    name, ext = os.path.splitext(filename)
+    return f"{name}{OVERLAY_SUFFIX}{ext}"
+
+
+def is_image(filename: str) -> bool:
+    return not filename.startswith('.') and filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _scan(directory: str) -> dict:
+    """filename -> stat result for every image file in a directory, in one pass"""
+    with os.scandir(directory) as entries:
+        return {
+            entry.name: entry.stat()
+            for entry in entries
+            if is_image(entry.name) and entry.is_file()
+        }
+
+
+def scan_pairs(original_dir: str, overlay_dir: str) -> tuple[dict, list[str], list[str]]:
+    """
+    ({filename: (original stat, overlay stat)}, [originals without an overlay],
+    [overlays without an original]). Stats come from the directory listing, so
+    no per-file lookups are needed.
+    """
+    originals = _scan(original_dir)
+    overlays = _scan(overlay_dir)
+    pairs = {}
+    unpaired = []
+    for filename, stat in originals.items():
+        overlay = overlays.pop(overlay_filename(filename), None)
+        if overlay is None:
+            unpaired.append(filename)
+        else:
+            pairs[filename] = (stat, overlay)
+    return pairs, unpaired, list(overlays)
+
+
+# === Image headers ===
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_size(data: bytes) -> Optional[tuple[int, int]]:
+    if data[:8] != b"\x89PNG\r\n\x1a\n" or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", data[16:24])
+
+
+def _jpeg_size(data: bytes) -> Optional[tuple[int, int]]:
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # standalone markers
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", data[offset + 2:offset + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def _tiff_size(data: bytes) -> Optional[tuple[int, int]]:
+    order = {b"II": "<", b"MM": ">"}.get(data[:2])
+    if order is None or struct.unpack(order + "H", data[2:4])[0] != 42:
+        return None
+    (ifd,) = struct.unpack(order + "I", data[4:8])
+    (count,) = struct.unpack(order + "H", data[ifd:ifd + 2])
+    size = {}
+    for i in range(count):
+        entry = ifd + 2 + i * 12
+        tag, kind = struct.unpack(order + "HH", data[entry:entry + 4])
+        if tag in (256, 257):  # ImageWidth, ImageLength
+            fmt = "H" if kind == 3 else "I"
+            size[tag] = struct.unpack(order + fmt, data[entry + 8:entry + 8 + struct.calcsize(fmt)])[0]
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
+
+
+def image_size(data: bytes) -> Optional[tuple[int, int]]:
+    """(width, height) from a PNG, JPEG or TIFF header, or None if it cannot be parsed"""
+    try:
+        return _png_size(data) or _jpeg_size(data) or _tiff_size(data)
+    except struct.error:
+        return None
+
+
+def _read(path: str) -> tuple:
+    with open(path, "rb") as f:
+        return os.fstat(f.fileno()), f.read()
+
+
+def inspect_pair(original_path: str, overlay_path: str) -> dict:
+    """
+    Read both files, hash the original and parse both headers.
+    Raises ValueError when either image is not readable.
+    """
+    stat, original = _read(original_path)
+    overlay_stat, overlay = _read(overlay_path)
+
+    size = image_size(original)
+    if size is None:
+        raise ValueError("unreadable image header")
+    overlay_size = image_size(overlay)
+    if overlay_size is None:
+        raise ValueError("unreadable overlay header")
+
+    return {
+        "width": size[0],
+        "height": size[1],
+        "bytes": len(original),
+        "overlay_width": overlay_size[0],
+        "overlay_height": overlay_size[1],
+        "overlay_bytes": len(overlay),
+        "sha256": hashlib.sha256(original).hexdigest(),
+        "overlay_sha256": hashlib.sha256(overlay).hexdigest(),
+        "mtime_ns": stat.st_mtime_ns,
+        "overlay_mtime_ns": overlay_stat.st_mtime_ns,
+    }
+
+
+def _unchanged(metadata: dict, stat, overlay_stat) -> bool:
+    return (
+        metadata.get("bytes") == stat.st_size
+        and metadata.get("mtime_ns") == stat.st_mtime_ns
+        and metadata.get("overlay_bytes") == overlay_stat.st_size
+        and metadata.get("overlay_mtime_ns") == overlay_stat.st_mtime_ns
+    )
+
+
+def _execute_batches(db: Session, statement, rows: list[dict]) -> None:
+    for start in range(0, len(rows), INGEST_BATCH_SIZE):
+        db.execute(statement, rows[start:start + INGEST_BATCH_SIZE])
+
+
+def verify_pairs(original_dir: str, overlay_dir: str, filenames: list[str],
+                 workers: int = INGEST_WORKERS, log: Callable[[str], None] = print) -> tuple[dict, list[str]]:
+    """Inspect pairs in parallel: ({filename: metadata}, [unreadable filenames])"""
+    def inspect(filename: str):
+        try:
+            return filename, inspect_pair(
+                os.path.join(original_dir, filename),
+                os.path.join(overlay_dir, overlay_filename(filename))
+            )
+        except (OSError, ValueError) as e:
+            return filename, e
+
+    verified, invalid = {}, []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for filename, result in executor.map(inspect, filenames):
+            if isinstance(result, Exception):
+                log(f"Warning: Skipping {filename}: {result}")
+                invalid.append(filename)
+                continue
+            if (result["overlay_width"], result["overlay_height"]) != (result["width"], result["height"]):
+                log(f"Warning: Overlay size differs from image for {filename}")
+            verified[filename] = result
+    return verified, invalid
+
+
+def _case_keys(filename: str) -> dict:
+    # Paths relative to the 'database' directory, which is served as /static
+    return {
+        "image_s3_key": f"original_imgs/{filename}",
+        "mask_s3_key": f"overlay_imgs/{overlay_filename(filename)}",
+    }
+
+
+def insert_cases(db: Session, verified: dict) -> list[str]:
+    """Bulk insert verified pairs as new cases and queue them for every user (caller commits)"""
+    rows = [
+        {"id": str(uuid.uuid4()), **_case_keys(filename), "case_metadata": {"filename": filename, **metadata}}
+        for filename, metadata in verified.items()
+    ]
+    _execute_batches(db, insert(Case), rows)
+    case_ids = [row["id"] for row in rows]
+    case_queue.add_cases(db, case_ids)
+    return case_ids
+
+
+def known_filenames(db: Session) -> dict:
+    """filename -> (case id, metadata) for every case ingested from disk"""
+    known = {}
+    for case_id, metadata in db.query(Case.id, Case.case_metadata):
+        if metadata and "filename" in metadata:
+            known[metadata["filename"]] = (case_id, metadata)
+    return known
+
+
+def upsert_cases(db: Session, present: Iterable[str], verified: dict,
+                 log: Callable[[str], None] = print) -> tuple[dict, dict]:
+    """
+    Store verified pairs in one write transaction, matched against the cases
+    in the database (read inside it, so concurrent ingests do not collide):
+    by filename first, then by content hash. A case with the same content
+    whose file is gone from disk is that case renamed; one whose file is
+    still present is the same image copied under another name, which is
+    skipped so its ratings are not split across two cases. The rest are
+    inserted as new cases. Commits; returns ({filename: "added", "updated",
+    "renamed" or "duplicate"}, known_filenames before the upsert).
+    """
+    present = set(present)
+    begin_write(db)
+    known = known_filenames(db)
+    by_hash = {
+        metadata["sha256"]: (filename, case_id, metadata)
+        for filename, (case_id, metadata) in known.items() if "sha256" in metadata
+    }
+
+    outcomes, new, updates = {}, {}, []
+    for filename, result in verified.items():
+        match, outcome = known.get(filename), "updated"
+        if match is None:
+            same = by_hash.get(result["sha256"])
+            if same is not None and same[0] in present:
+                log(f"Warning: Skipping {filename}: same content as {same[0]}")
+                outcomes[filename] = "duplicate"
+                continue
+            if same is not None:
+                match, outcome = same[1:], "renamed"
+        if match is None:
+            new[filename] = result
+            outcome = "added"
+        else:
+            case_id, metadata = match
+            # Variants belong to the previous content; result carries fresh ones when enabled
+            kept = {key: value for key, value in metadata.items() if key != "variants"}
+            updates.append({"id": case_id, **_case_keys(filename), "case_metadata": {**kept, "filename": filename, **result}})
+        outcomes[filename] = outcome
+        by_hash[result["sha256"]] = (filename, *(match or (None, None)))  # later copies are duplicates
+
+    insert_cases(db, new)
+    _execute_batches(db, update(Case), updates)
+    counters.increment(db, counters.TOTAL_CASES, len(new))
+    db.commit()
+    return outcomes, known
+
+
+def ingest(db: Session, original_dir: str, overlay_dir: str,
+           workers: int = INGEST_WORKERS, log: Callable[[str], None] = print) -> dict:
+    """
+    Upsert every image pair found on disk and queue new cases for every user.
+    Commits; returns counts per outcome.
+    """
+    pairs, unpaired, _ = scan_pairs(original_dir, overlay_dir)
+    for filename in unpaired:
+        log(f"Warning: No overlay found for {filename} (expected {overlay_filename(filename)})")
+
+    by_filename = known_filenames(db)
+    db.commit()  # hashing and rendering below run outside any transaction
+    to_inspect = [
+        filename for filename, (stat, overlay_stat) in pairs.items()
+        if filename not in by_filename
+        or not _unchanged(by_filename[filename][1], stat, overlay_stat)
+        or derivatives.missing(by_filename[filename][1])
+    ]
+    report = {"unchanged": len(pairs) - len(to_inspect), "added": 0, "updated": 0, "renamed": 0,
+              "duplicate": 0, "unpaired": len(unpaired)}
+
+    verified, invalid = verify_pairs(original_dir, overlay_dir, to_inspect, workers, log)
+    report["invalid"] = len(invalid)
+    derivatives.attach(original_dir, overlay_dir, overlay_filename, verified, log=log)
+
+    outcomes, known = upsert_cases(db, pairs, verified, log)
+    for outcome in outcomes.values():
+        report[outcome] += 1
+
+    # Cases whose files are gone are kept (with their evaluations), just reported
+    report["missing"] = sum(1 for filename in known if filename not in pairs) - report["renamed"]
+    return report
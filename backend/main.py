@@ -1,10 +1,17 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+import asyncio
 import os
 
-from database import init_db
-from routers import auth, evaluations, admin
+from database import init_db, SessionLocal, engine, async_engine
+from static_files import ContentHashStaticFiles
+import case_queue
+import case_watcher
+import counters
+import durations
+import metrics
+import profiling
+from routers import auth, evaluations, admin, tiles, composites
 
 app = FastAPI(
     title="Ophthalmology Evaluation Platform API",
@@ -25,6 +32,7 @@ if cors_origins_env and cors_origins_env != "*":
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", profiling.PROFILE_ID_HEADER],
     )
 else:
     # Allow all origins using regex (for production on AWS with unknown IP)
@@ -34,24 +42,58 @@ else:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", profiling.PROFILE_ID_HEADER],
     )
 
+# Admins profile a single request with the X-Profile: 1 header (see profiling.py)
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# Request latency, status and per-request SQL metrics (outermost, so CORS is timed too)
+if metrics.METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    if async_engine is not None:
+        metrics.instrument_engine(async_engine.sync_engine)
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(evaluations.router)
 app.include_router(admin.router)
+app.include_router(tiles.router)
+app.include_router(composites.router)
 
 # Serve static files (for local development - images)
 # Serve static files (the 'database' directory containing original_imgs and overlay_imgs)
 # We go up one level from 'backend' to root, then into 'database'
 static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "database"))
 if os.path.exists(static_dir):
-    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    # Strong content-hash ETags, 304s and Range requests; fingerprinted URLs are immutable
+    app.mount("/static", ContentHashStaticFiles(directory=static_dir), name="static")
 
 
 @app.on_event("startup")
 def startup_event():
     init_db()
+    # Databases created before the case queue, counters and reading-time sketches existed need them built once
+    db = SessionLocal()
+    try:
+        case_queue.backfill(db)
+        counters.ensure(db)
+        durations.ensure(db)
+    finally:
+        db.close()
+
+    # Optional: register new image pairs dropped into database/ without a restart
+    if case_watcher.WATCH_IMAGES and os.path.isdir(case_watcher.ORIGINAL_DIR) and os.path.isdir(case_watcher.OVERLAY_DIR):
+        if case_watcher.acquire_lock() is not None:
+            app.state.case_watcher = asyncio.create_task(case_watcher.run_forever(case_watcher.CaseWatcher()))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    task = getattr(app.state, "case_watcher", None)
+    if task is not None:
+        task.cancel()
 
 
 @app.get("/")
@@ -62,3 +104,10 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
+
+
+if metrics.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        """Prometheus text exposition, summed over all workers"""
+        return Response(metrics.collect(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,312 @@
+"""
+Request and SQL instrumentation, exported as Prometheus text on /metrics.
+
+MetricsMiddleware times every request and records, per route template
+(never the raw path, so ids do not explode the label set):
+
+- http_requests_total{method, route, status}
+- http_request_duration_seconds{method, route}: latency histogram
+- http_request_db_statements{method, route}: statements issued per request
+- http_request_db_seconds{method, route}: time spent in the database per request
+
+Engine event hooks (instrument_engine) time every statement, add it to the
+current request through a context variable (which follows the request onto
+the threadpool and into async sessions) and record
+db_statement_duration_seconds{operation}. Responses also carry a
+Server-Timing header with the database and total time, so a slow request
+shows in the browser's network panel whether it went to the database.
+
+Each gunicorn worker keeps its metrics in memory and writes them to
+METRICS_DIR/<pid>.json every METRICS_FLUSH_SECONDS (tmp file + rename). The
+worker answering /metrics sums the files of all live workers; files of
+workers that exited are removed, which Prometheus sees as a counter reset.
+"""
+from contextvars import ContextVar
+from typing import Optional
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests by route and status", None),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency", LATENCY_BUCKETS),
+    "http_request_db_statements": ("histogram", "SQL statements issued per HTTP request", STATEMENT_BUCKETS),
+    "http_request_db_seconds": ("histogram", "Time spent in SQL statements per HTTP request", LATENCY_BUCKETS),
+    "db_statement_duration_seconds": ("histogram", "SQL statement latency by operation", LATENCY_BUCKETS),
+}
+
+OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK"}
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Registry:
+    """Counters and histograms of this process; label sets are sorted (key, value) tuples"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict[tuple, list] = {}  # (name, labels) -> [value] or [bucket counts..., +Inf, sum]
+
+    def inc(self, name: str, labels: dict, value: float = 1) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._values.setdefault(key, [0])
+            entry[0] += value
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(buckets) + 2)
+            entry[index] += 1
+            entry[-1] += value
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [
+                [name, [list(pair) for pair in labels], list(entry)]
+                for (name, labels), entry in self._values.items()
+            ]
+
+
+registry = Registry()
+
+
+# === Collection across workers ===
+
+def _worker_file(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush() -> None:
+    """Write this process's metrics for the worker that answers /metrics"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _worker_file(os.getpid())
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, path)
+
+
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_forever() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def _ensure_flusher() -> None:
+    """One flush thread per process (checked by pid: threads do not survive a fork)"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+            _flusher_pid = os.getpid()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _load_workers() -> list:
+    snapshots = []
+    for name in os.listdir(METRICS_DIR):
+        pid = name[:-len(".json")]
+        if not (name.endswith(".json") and pid.isdigit()):
+            continue
+        pid = int(pid)
+        if pid != os.getpid() and not _alive(pid):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # being replaced right now; it is picked up on the next scrape
+    return snapshots
+
+
+def _merge(snapshots: list) -> dict:
+    merged: dict[tuple, list] = {}
+    for snapshot in snapshots:
+        for name, labels, entry in snapshot:
+            if name not in METRICS:
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = merged.get(key)
+            if total is None:
+                merged[key] = list(entry)
+            else:
+                for i, value in enumerate(entry):
+                    total[i] += value
+    return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra: tuple = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged: dict) -> str:
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, entry) for (metric, labels), entry in merged.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, entry in series:
+            if kind == "counter":
+                lines.append(f"{name}{_labels(labels)} {_number(entry[0])}")
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), entry[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(entry[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def collect() -> str:
+    """Prometheus text exposition of every live worker's metrics"""
+    flush()
+    return render(_merge(_load_workers()))
+
+
+# === SQL statements ===
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    words = statement.split(None, 1)
+    operation = words[0].upper() if words else ""
+    registry.observe(
+        "db_statement_duration_seconds", {"operation": operation if operation in OPERATIONS else "OTHER"}, elapsed
+    )
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+
+
+def _handle_error(context):
+    started = context.connection.info.get("metrics_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine) -> None:
+    """Time every statement run through engine (pass async_engine.sync_engine for async engines)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# === Requests ===
+
+def _route(scope) -> str:
+    """Route template of the request (/admin/evaluators/{user_id}), or the mount point for mounted apps"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    mounted = scope.get("root_path", "")[len(scope.get("app_root_path", "")):]
+    return mounted or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500  # unless a response starts
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total_ms = (time.perf_counter() - started) * 1000
+                timing = (
+                    f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} statements", '
+                    f"total;dur={total_ms:.1f}"
+                )
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            labels = {"method": scope["method"], "route": _route(scope)}
+            registry.inc("http_requests_total", {**labels, "status": str(status)})
+            registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            registry.observe("http_request_db_statements", labels, stats.statements)
+            registry.observe("http_request_db_seconds", labels, stats.db_seconds)
+            _ensure_flusher()
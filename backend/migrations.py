@@ -0,0 +1,147 @@
+"""
+Versioned schema migrations.
+
+create_all only creates missing tables and never touches existing ones, so
+databases created by older versions keep their old indexes and constraints.
+Each migration below upgrades such a database in place and is recorded in
+schema_migrations, so it runs exactly once. Migrations are written to be
+no-ops on tables create_all just built from the current models (CREATE INDEX
+IF NOT EXISTS, same index names), so fresh and upgraded databases end up
+identical.
+
+init_db() applies pending migrations on every start; workers starting
+together serialize on a write lock (BEGIN IMMEDIATE on SQLite, an advisory
+lock on PostgreSQL). Run by hand with: python migrations.py
+"""
+from collections import Counter as Tally
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import func
+
+import counters
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+_ADVISORY_LOCK_KEY = 0x52455449  # any constant shared by all workers
+
+
+def _add_query_indexes(conn: Connection) -> None:
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_evaluations_case_id ON evaluations (case_id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_evaluations_submitted_at_id ON evaluations (submitted_at, id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_case_coverage_lease_user_id ON case_coverage (lease_user_id)"
+    ))
+    if conn.dialect.name == "sqlite":
+        # Must match database.sqlite_timestamp_key exactly for the planner to use it
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_evaluations_submitted_key "
+            "ON evaluations (strftime('%Y-%m-%d %H:%M:%f', submitted_at), id)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_evaluation_tombstones_deleted_key "
+            "ON evaluation_tombstones (strftime('%Y-%m-%d %H:%M:%f', deleted_at), evaluation_id)"
+        ))
+
+
+def _remove_duplicate_evaluations(conn: Connection) -> int:
+    """
+    Keep the first evaluation of every (user, case) pair submitted twice
+    before uniqueness was enforced; the others become tombstones and the
+    counters, coverage and idempotency keys that included them are adjusted.
+    """
+    pairs = conn.execute(text(
+        "SELECT user_id, case_id FROM evaluations GROUP BY user_id, case_id HAVING COUNT(*) > 1"
+    )).all()
+    removed_per_user, removed_per_case = Tally(), Tally()
+    for user_id, case_id in pairs:
+        ids = [row.id for row in conn.execute(text(
+            "SELECT id FROM evaluations WHERE user_id = :user_id AND case_id = :case_id ORDER BY submitted_at, id"
+        ), {"user_id": user_id, "case_id": case_id})]
+        kept, duplicates = ids[0], ids[1:]
+        for evaluation_id in duplicates:
+            params = {"id": evaluation_id, "kept": kept, "user_id": user_id, "case_id": case_id}
+            conn.execute(text(
+                "INSERT INTO evaluation_tombstones (evaluation_id, user_id, case_id) VALUES (:id, :user_id, :case_id)"
+            ), params)
+            conn.execute(text(
+                "UPDATE evaluation_idempotency_keys SET evaluation_id = :kept WHERE evaluation_id = :id"
+            ), params)
+            conn.execute(text("DELETE FROM evaluations WHERE id = :id"), params)
+        removed_per_user[user_id] += len(duplicates)
+        removed_per_case[case_id] += len(duplicates)
+
+    decrement = text("UPDATE counters SET value = value - :n WHERE name = :name")
+    for user_id, n in removed_per_user.items():
+        conn.execute(decrement, {"n": n, "name": counters.completed_key(user_id)})
+    conn.execute(decrement, {"n": sum(removed_per_user.values()), "name": counters.TOTAL_EVALUATIONS})
+    for case_id, n in removed_per_case.items():
+        conn.execute(text(
+            "UPDATE case_coverage SET ratings = ratings - :n WHERE case_id = :case_id"
+        ), {"n": n, "case_id": case_id})
+    return sum(removed_per_user.values())
+
+
+def _enforce_unique_evaluations(conn: Connection) -> None:
+    removed = _remove_duplicate_evaluations(conn)
+    if removed:
+        print(f"Removed {removed} duplicate evaluations (kept the first of each user and case)")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_evaluations_user_case ON evaluations (user_id, case_id)"
+    ))
+
+
+# (version, description, upgrade) in order; never edit or reorder applied entries, append new ones
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Indexes for evaluations by case, delta export keyset and coverage leases", _add_query_indexes),
+    (2, "Unique evaluation per user and case", _enforce_unique_evaluations),
+]
+
+
+def _lock(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    return {row.version for row in conn.execute(schema_migrations.select())}
+
+
+def upgrade(engine: Engine) -> list[int]:
+    """Apply pending migrations, each in its own transaction; returns the versions applied"""
+    _metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.connect().execution_options(sqlite_begin="IMMEDIATE") as conn:
+            with conn.begin():
+                _lock(conn)
+                # Re-read under the lock: another worker may have just applied it
+                if version in applied_versions(conn):
+                    continue
+                migrate(conn)
+                conn.execute(schema_migrations.insert().values(version=version, description=description))
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    versions = upgrade(engine)
+    if versions:
+        print(f"Applied migrations: {', '.join(str(v) for v in versions)}")
+    else:
+        print("Database is up to date")
@@ -2,8 +2,11 @@
 import os
 import sys
 from sqlalchemy.orm import Session
-from database import SessionLocal, init_db, Case, engine, User, UserRole
+from database import SessionLocal, init_db, User, UserRole
 from auth import get_password_hash
+import case_queue
+import counters
+import ingest
 
 def populate_database():
     print("Initializing database...")
@@ -22,77 +25,35 @@ def populate_database():
             print(f"Error: Directories not found at {original_dir} or {overlay_dir}")
             return
 
-        print("Clearing existing cases...")
-        # Clear existing cases
-        db.query(Case).delete()
-        db.commit()
-        
-        print("Clearing existing users...")
-        # Clear existing users to ensure fresh password hashes
-        db.query(User).delete()
-        db.commit()
-        
-        cases_created = 0
-        
-        print("Creating admin user...")
-        # Create Admin User
-        admin = User(
-            email="admin@example.com",
-            name="Administrador",
-            password_hash=get_password_hash("admin123"),
-            role=UserRole.ADMIN
-        )
-        db.add(admin)
-
-        print("Creating sample evaluator...")
-        # Create Sample Evaluator
-        evaluator = User(
-            email="evaluador@example.com",
-            name="Dr. Juan Pérez",
-            password_hash=get_password_hash("eval123"),
-            role=UserRole.EVALUATOR
-        )
-        db.add(evaluator)
+        # Counters are kept up to date incrementally from here on (built once for older databases)
+        counters.ensure(db)
 
+        # Default accounts are created once; existing users and their progress are kept
+        for email, name, password, role in (
+            ("admin@example.com", "Administrador", "admin123", UserRole.ADMIN),
+            ("evaluador@example.com", "Dr. Juan Pérez", "eval123", UserRole.EVALUATOR),
+        ):
+            if db.query(User).filter(User.email == email).first():
+                continue
+            print(f"Creating user {email}...")
+            user = User(email=email, name=name, password_hash=get_password_hash(password), role=role)
+            db.add(user)
+            db.flush()
+            if role == UserRole.EVALUATOR:
+                case_queue.build_queue_for_user(db, user.id)
+                counters.increment(db, counters.TOTAL_EVALUATORS)
+            counters.increment(db, counters.completed_key(user.id), 0)
         db.commit()
 
         print("Scanning for image pairs...")
-        
-        # Iterate through original images
-        for filename in os.listdir(original_dir):
-            if filename.startswith('.'):
-                continue
-                
-            if not filename.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff')):
-                continue
-            
-            # Construct expected overlay filename
-            # Assumption: overlay filename matches original but in overlay folder
-            # The user requirement said: "images can be matched by using the same file name as found in 'original' with the _overlay added in the 'overlay' folder."
-            # Example: image.jpg -> image_overlay.jpg
-            
-            name, ext = os.path.splitext(filename)
-            overlay_filename = f"{name}_overlay{ext}"
-            
-            original_path = os.path.join(original_dir, filename)
-            overlay_path = os.path.join(overlay_dir, overlay_filename)
-            
-            if os.path.exists(overlay_path):
-                # Paths relative to the 'database' directory which is mounted as static
-                # API will serve them as /static/original_imgs/file.jpg
-                
-                new_case = Case(
-                    image_s3_key=f"original_imgs/{filename}",
-                    mask_s3_key=f"overlay_imgs/{overlay_filename}",
-                    case_metadata={"filename": filename}
-                )
-                db.add(new_case)
-                cases_created += 1
-            else:
-                print(f"Warning: No overlay found for {filename} (expected {overlay_filename})")
-        
-        db.commit()
-        print(f"Successfully created {cases_created} cases.")
+        # Paths are stored relative to the 'database' directory, which is mounted as static
+        # API will serve them as /static/original_imgs/file.jpg
+        report = ingest.ingest(db, original_dir, overlay_dir)
+        print(
+            f"Cases: {report['added']} added, {report['updated']} updated, {report['renamed']} renamed, "
+            f"{report['unchanged']} unchanged, {report['duplicate']} duplicate, {report['invalid']} invalid, "
+            f"{report['unpaired']} without overlay, {report['missing']} missing on disk."
+        )
         
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -0,0 +1,225 @@
+"""
+Opt-in profiling of single requests in production.
+
+An admin adds the header "X-Profile: 1" (or ?profile=1) to any request; for
+anyone else the flag is ignored. While that request runs, a sampler thread
+records the stacks of the event loop thread and of the threadpool workers
+every PROFILE_INTERVAL_MS, skipping threads that are idle (waiting on the
+selector or on their work queue). A sampling profiler is used rather than
+cProfile because a request's work is spread over the event loop and worker
+threads, and cProfile only sees the thread that enabled it. Requests that
+run concurrently on the same worker can show up in the samples too.
+
+The result is written to PROFILE_DIR as collapsed stacks (one
+"frame;frame;frame count" line per distinct stack, the input format of
+flamegraph.pl and speedscope) next to a JSON file describing the request.
+The response carries the profile id in X-Profile-Id; admins list and
+download profiles under /admin/profiles. Only the newest
+PROFILE_MAX_ARTIFACTS profiles younger than PROFILE_MAX_AGE_HOURS are kept.
+"""
+from collections import Counter as Tally
+from datetime import datetime, timezone
+from typing import Optional
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, QueryParams
+
+from auth import admin_from_token
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_ARTIFACTS = int(os.getenv("PROFILE_MAX_ARTIFACTS", "50"))
+PROFILE_MAX_AGE_HOURS = float(os.getenv("PROFILE_MAX_AGE_HOURS", "72"))
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{12}-[0-9a-f]{8}$")
+
+# A thread whose innermost frame is in one of these is waiting, not working
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+_WORKER_THREAD_PREFIX = "AnyIO worker thread"
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Collects collapsed stacks of the event loop thread and the threadpool workers"""
+
+    def __init__(self, loop_thread_id: int, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = Tally()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _roots(self) -> dict:
+        """Thread id -> stack root label of the threads worth sampling"""
+        roots = {self.loop_thread_id: "event-loop"}
+        for thread in threading.enumerate():
+            if thread.name.startswith(_WORKER_THREAD_PREFIX):
+                roots[thread.ident] = "threadpool"
+        return roots
+
+    def _sample(self) -> None:
+        self.samples += 1
+        roots = self._roots()
+        for thread_id, frame in sys._current_frames().items():
+            root = roots.get(thread_id)
+            if root is None or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(root)
+            self.stacks[";".join(reversed(labels))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _paths(profile_id: str) -> tuple:
+    base = os.path.join(PROFILE_DIR, profile_id)
+    return f"{base}.collapsed", f"{base}.json"
+
+
+def new_profile_id() -> str:
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"  # sorts by creation time
+
+
+def store(profile_id: str, sampler: Sampler, info: dict) -> None:
+    """Write the artifact and its description (tmp + rename), then apply retention"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    collapsed_path, info_path = _paths(profile_id)
+    info = {**info, "id": profile_id, "samples": sampler.samples, "interval_ms": sampler.interval * 1000}
+    for path, content in ((collapsed_path, sampler.collapsed()), (info_path, json.dumps(info))):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    prune()
+
+
+def prune(max_artifacts: int = PROFILE_MAX_ARTIFACTS, max_age_hours: float = PROFILE_MAX_AGE_HOURS) -> int:
+    """Delete profiles beyond the newest max_artifacts or older than max_age_hours; returns how many"""
+    ids = sorted(
+        (name[:-len(".json")] for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True
+    )
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for index, profile_id in enumerate(ids):
+        collapsed_path, info_path = _paths(profile_id)
+        try:
+            expired = index >= max_artifacts or os.path.getmtime(info_path) < cutoff
+        except OSError:
+            continue
+        if expired:
+            for path in (info_path, collapsed_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            removed += 1
+    return removed
+
+
+def list_profiles() -> list[dict]:
+    """Descriptions of the stored profiles, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def artifact_path(profile_id: str) -> Optional[str]:
+    """Collapsed stacks file of a profile, or None for unknown (or malformed) ids"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    collapsed_path, _ = _paths(profile_id)
+    return collapsed_path if os.path.exists(collapsed_path) else None
+
+
+def _requested(scope) -> bool:
+    if Headers(scope=scope).get(PROFILE_HEADER) == "1":
+        return True
+    query_string = scope.get("query_string", b"")
+    return b"profile=" in query_string and QueryParams(query_string).get("profile") == "1"
+
+
+def _bearer_token(scope) -> Optional[str]:
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it when they come from an admin"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope):
+            return await self.app(scope, receive, send)
+        token = _bearer_token(scope)
+        admin = await admin_from_token(token) if token else None
+        if admin is None:
+            return await self.app(scope, receive, send)
+
+        profile_id = new_profile_id()
+        sampler = Sampler(threading.get_ident())
+        started = time.perf_counter()
+        status = 500  # unless a response starts
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []), (PROFILE_ID_HEADER.lower().encode(), profile_id.encode())
+                ]
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop()
+            await run_in_threadpool(store, profile_id, sampler, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                "admin": admin.email,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+
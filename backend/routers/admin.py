@@ -1,29 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-import csv
-import io
-import os
+from sqlalchemy import func, or_, and_, insert, select
+from typing import Literal, Optional
+import base64
+import json
 
-from database import get_db, User, Case, Evaluation, UserRole
-from schemas import UserCreate, UserWithProgress, StatsOut, CaseCreate, UserUpdate, UserOut
-from auth import get_admin_user, get_password_hash
+from database import (
+    get_db, run_db, run_db_write, begin_write,
+    User, Case, Evaluation, UserRole, Counter, EvaluationTombstone, EvaluationIdempotencyKey
+)
+from schemas import UserCreate, UserWithProgress, StatsOut, CaseCreate, UserUpdate, UserOut, EvaluatorImportOut
+from auth import get_admin_user, get_password_hash_async, invalidate_user_cache
+import agreement
+import case_queue
+import compositing
+import counters
+import durations
+import evaluator_import
+import exports
+import profiling
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
-@router.get("/stats", response_model=StatsOut)
-def get_stats(
-    admin: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
-):
-    """Get platform statistics"""
-    total_cases = db.query(func.count(Case.id)).scalar()
-    total_evaluators = db.query(func.count(User.id)).filter(
-        User.role == UserRole.EVALUATOR
-    ).scalar()
-    completed_evaluations = db.query(func.count(Evaluation.id)).scalar()
+def _stats(db: Session) -> StatsOut:
+    values = counters.get_many(
+        db, counters.TOTAL_CASES, counters.TOTAL_EVALUATORS, counters.TOTAL_EVALUATIONS
+    )
+    total_cases = values[counters.TOTAL_CASES]
+    total_evaluators = values[counters.TOTAL_EVALUATORS]
+    completed_evaluations = values[counters.TOTAL_EVALUATIONS]
     
     # Pending = (total_cases * total_evaluators) - completed_evaluations
     pending = (total_cases * total_evaluators) - completed_evaluations
@@ -36,39 +44,138 @@ def get_stats(
     )
 
 
-@router.get("/evaluators", response_model=list[UserWithProgress])
-def get_evaluators(
+@router.get("/stats", response_model=StatsOut)
+async def get_stats(
     admin: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Get all evaluators with their progress"""
-    evaluators = db.query(User).filter(User.role == UserRole.EVALUATOR).all()
-    total_cases = db.query(func.count(Case.id)).scalar()
-    
-    result = []
-    for evaluator in evaluators:
-        completed = db.query(func.count(Evaluation.id)).filter(
-            Evaluation.user_id == evaluator.id
-        ).scalar()
-        result.append(UserWithProgress(
-            id=evaluator.id,
-            email=evaluator.email,
-            name=evaluator.name,
-            role=evaluator.role.value,
-            completed=completed,
-            total=total_cases
+    """Get platform statistics"""
+    return await run_db(db, _stats)
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> list:
+    """[last sort value, last id] as written by _encode_cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not (
+        isinstance(values, list) and len(values) == 2
+        and isinstance(values[0], (str, int)) and not isinstance(values[0], bool)
+        and isinstance(values[1], str)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def _evaluator_progress_query(db: Session):
+    """Evaluators with their completed count, read from the completed:<user_id> counters"""
+    completed = func.coalesce(Counter.value, 0)
+    query = db.query(
+        User.id,
+        User.email,
+        User.name,
+        User.role,
+        completed.label("completed")
+    ).outerjoin(
+        Counter, Counter.name == counters.completed_key(User.id)
+    ).filter(User.role == UserRole.EVALUATOR)
+    return query, completed
+
+
+def _page_activity(db: Session, user_ids: list[str]) -> tuple:
+    """Last activity and median duration (from the duration sketches) of the evaluators on one page"""
+    if not user_ids:
+        return {}, {}
+    last_activity = dict(db.query(
+        Evaluation.user_id, func.max(Evaluation.submitted_at)
+    ).filter(Evaluation.user_id.in_(user_ids)).group_by(Evaluation.user_id).all())
+    sketches = durations.load_many(db, [durations.user_scope(user_id) for user_id in user_ids])
+    medians = {user_id: sketches[durations.user_scope(user_id)].quantile(0.5) for user_id in user_ids}
+    return last_activity, medians
+
+
+def _evaluators_page(db: Session, search: Optional[str], sort: str, order: str,
+                     limit: int, cursor: Optional[str]) -> tuple:
+    """One page of evaluators with progress, plus the cursor of the next page (None on the last one)"""
+    query, completed = _evaluator_progress_query(db)
+    total_cases = counters.get_many(db, counters.TOTAL_CASES)[counters.TOTAL_CASES]
+
+    if search:
+        # Escape LIKE wildcards so a search for "a_b" matches that text literally
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = f"%{escaped}%"
+        query = query.filter(or_(
+            User.email.ilike(pattern, escape="\\"), User.name.ilike(pattern, escape="\\")
         ))
-    
-    return result
 
+    sort_key = {
+        "name": func.coalesce(User.name, ""),
+        "email": User.email,
+        "progress": completed,
+    }[sort]
 
-@router.post("/evaluators", response_model=UserWithProgress, status_code=status.HTTP_201_CREATED)
-def create_evaluator(
-    user_data: UserCreate,
+    # Keyset pagination on (sort key, id) so deep pages cost the same as the first one
+    if cursor:
+        last_value, last_id = _decode_cursor(cursor)
+        if order == "asc":
+            query = query.filter(or_(sort_key > last_value, and_(sort_key == last_value, User.id > last_id)))
+        else:
+            query = query.filter(or_(sort_key < last_value, and_(sort_key == last_value, User.id < last_id)))
+
+    if order == "asc":
+        query = query.order_by(sort_key.asc(), User.id.asc())
+    else:
+        query = query.order_by(sort_key.desc(), User.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        last_value = {"name": last.name or "", "email": last.email, "progress": last.completed}[sort]
+        next_cursor = _encode_cursor([last_value, last.id])
+
+    last_activity, medians = _page_activity(db, [row.id for row in rows])
+    return [
+        UserWithProgress(
+            id=row.id,
+            email=row.email,
+            name=row.name,
+            role=row.role.value,
+            completed=row.completed,
+            total=total_cases,
+            lastActivity=last_activity.get(row.id),
+            medianDurationMs=medians[row.id]
+        )
+        for row in rows
+    ], next_cursor
+
+
+@router.get("/evaluators", response_model=list[UserWithProgress])
+async def get_evaluators(
+    response: Response,
+    search: Optional[str] = Query(None, description="Case-insensitive match on email or name"),
+    sort: Literal["name", "email", "progress"] = "name",
+    order: Literal["asc", "desc"] = "asc",
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page"),
     admin: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Create a new evaluator account"""
+    """Get evaluators with their progress, one keyset page at a time (next page cursor in X-Next-Cursor)"""
+    evaluators, next_cursor = await run_db(db, _evaluators_page, search, sort, order, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return evaluators
+
+
+def _create_evaluator(db: Session, user_data: UserCreate, password_hash: str) -> UserWithProgress:
+    begin_write(db)
     # Check if email exists
     existing = db.query(User).filter(User.email == user_data.email).first()
     if existing:
@@ -77,14 +184,18 @@ def create_evaluator(
     new_user = User(
         email=user_data.email,
         name=user_data.name,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=password_hash,
         role=UserRole.EVALUATOR
     )
     db.add(new_user)
+    db.flush()
+    case_queue.build_queue_for_user(db, new_user.id)
+    counters.increment(db, counters.TOTAL_EVALUATORS)
+    counters.increment(db, counters.completed_key(new_user.id), 0)
     db.commit()
     db.refresh(new_user)
     
-    total_cases = db.query(func.count(Case.id)).scalar()
+    total_cases = counters.get_many(db, counters.TOTAL_CASES)[counters.TOTAL_CASES]
     
     return UserWithProgress(
         id=new_user.id,
@@ -96,13 +207,69 @@ def create_evaluator(
     )
 
 
-@router.delete("/evaluators/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_evaluator(
-    user_id: str,
+@router.post("/evaluators", response_model=UserWithProgress, status_code=status.HTTP_201_CREATED)
+async def create_evaluator(
+    user_data: UserCreate,
     admin: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Delete an evaluator and their progress"""
+    """Create a new evaluator account"""
+    password_hash = await get_password_hash_async(user_data.password)
+    return await run_db_write(db, _create_evaluator, user_data, password_hash)
+
+
+def _import_report(report: list[dict], status_code: int, response: Response) -> EvaluatorImportOut:
+    response.status_code = status_code
+    created = sum(1 for entry in report if entry["status"] == "created")
+    rejected = sum(1 for entry in report if entry["status"] not in ("created", "valid"))
+    return EvaluatorImportOut(created=created, rejected=rejected, rows=report)
+
+
+@router.post("/evaluators/import", response_model=EvaluatorImportOut, status_code=status.HTTP_201_CREATED)
+async def import_evaluators(
+    response: Response,
+    file: UploadFile = File(..., description="CSV with email,name,password columns, or JSONL"),
+    format: Optional[Literal["csv", "jsonl"]] = Query(None, description="Defaults to the file extension"),
+    skip_invalid: bool = Query(False, description="Create the valid rows even when others are rejected"),
+    admin: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create many evaluator accounts from one upload, in a single transaction.
+    Every row is validated first; unless skip_invalid is set, any rejected row
+    means nothing is created (422). The response reports the outcome per row.
+    """
+    if format is None:
+        format = "jsonl" if (file.filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv"
+    content = await file.read()
+    try:
+        rows = await run_in_threadpool(evaluator_import.parse, content, format)
+    except evaluator_import.ImportFileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rows:
+        raise HTTPException(status_code=400, detail="The file has no rows")
+
+    report, accepted = await run_in_threadpool(evaluator_import.validate, rows)
+    existing = await run_db(db, evaluator_import.existing_emails, [user.email for _, user in accepted])
+    accepted = evaluator_import.mark_existing(accepted, existing)
+    for entry, _ in accepted:
+        entry["status"] = "valid"
+    if not accepted or (len(accepted) < len(report) and not skip_invalid):
+        return _import_report(report, status.HTTP_422_UNPROCESSABLE_ENTITY, response)
+
+    users = [user for _, user in accepted]
+    password_hashes = await run_in_threadpool(evaluator_import.hash_passwords, [user.password for user in users])
+    ids = await run_db_write(db, evaluator_import.insert_evaluators, users, password_hashes)
+    if ids is None:
+        raise HTTPException(status_code=409, detail="Some emails were registered during the import, please retry")
+    for entry, user in accepted:
+        entry["status"] = "created"
+        entry["id"] = ids[user.email]
+    return _import_report(report, status.HTTP_201_CREATED, response)
+
+
+def _delete_evaluator(db: Session, user_id: str) -> None:
+    begin_write(db)
     # Check if user exists
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -112,23 +279,40 @@ def delete_evaluator(
     if user.role == UserRole.ADMIN:
         raise HTTPException(status_code=400, detail="Cannot delete admin accounts")
     
-    # Delete associated evaluations first
+    # Delete queued cases, leases and coverage, then the evaluations themselves,
+    # leaving tombstones so delta export consumers see the deletions
+    case_queue.remove_user(db, user_id)
+    completed = counters.get_many(db, counters.completed_key(user_id))[counters.completed_key(user_id)]
+    counters.increment(db, counters.TOTAL_EVALUATIONS, -completed)
+    counters.increment(db, counters.TOTAL_EVALUATORS, -1)
+    counters.remove(db, counters.completed_key(user_id))
+    durations.remove_user(db, user_id)
+    db.execute(insert(EvaluationTombstone).from_select(
+        ["evaluation_id", "user_id", "case_id"],
+        select(Evaluation.id, Evaluation.user_id, Evaluation.case_id).where(Evaluation.user_id == user_id)
+    ))
     db.query(Evaluation).filter(Evaluation.user_id == user_id).delete()
+    db.query(EvaluationIdempotencyKey).filter(EvaluationIdempotencyKey.user_id == user_id).delete()
     
     # Delete the user
     db.delete(user)
     db.commit()
-    return None
 
 
-@router.put("/evaluators/{user_id}", response_model=UserOut)
-def update_evaluator(
+@router.delete("/evaluators/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_evaluator(
     user_id: str,
-    user_update: UserUpdate,
     admin: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Update an evaluator's details"""
+    """Delete an evaluator and their progress"""
+    await run_db_write(db, _delete_evaluator, user_id)
+    invalidate_user_cache()
+    return None
+
+
+def _update_evaluator(db: Session, user_id: str, user_update: UserUpdate) -> UserOut:
+    begin_write(db)
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -149,77 +333,174 @@ def update_evaluator(
     
     db.commit()
     db.refresh(user)
-    return user
+    return UserOut.model_validate(user)
 
 
-@router.post("/cases", status_code=status.HTTP_201_CREATED)
-def create_case(
-    case_data: CaseCreate,
+@router.put("/evaluators/{user_id}", response_model=UserOut)
+async def update_evaluator(
+    user_id: str,
+    user_update: UserUpdate,
     admin: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Create a new case"""
+    """Update an evaluator's details"""
+    updated = await run_db_write(db, _update_evaluator, user_id, user_update)
+    invalidate_user_cache()
+    return updated
+
+
+def _create_case(db: Session, case_data: CaseCreate) -> dict:
+    begin_write(db)
     new_case = Case(
         image_s3_key=case_data.image_s3_key,
         mask_s3_key=case_data.mask_s3_key,
         case_metadata=case_data.metadata
     )
     db.add(new_case)
+    db.flush()
+    case_queue.add_cases(db, [new_case.id])
+    counters.increment(db, counters.TOTAL_CASES)
     db.commit()
     db.refresh(new_case)
     return {"id": new_case.id, "message": "Case created successfully"}
 
 
-@router.get("/export")
-def export_evaluations(
+@router.post("/cases", status_code=status.HTTP_201_CREATED)
+async def create_case(
+    case_data: CaseCreate,
     admin: User = Depends(get_admin_user),
     db: Session = Depends(get_db)
 ):
-    """Export all evaluations as CSV"""
-    evaluations = db.query(Evaluation).join(User).join(Case).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow([
-        "evaluation_id",
-        "user_id",
-        "user_email",
-        "user_name",
-        "case_id",
-        "q1_acceptability",
-        "q2_confidence",
-        "comments",
-        "duration_ms",
-        "submitted_at"
-    ])
-    
-    # Data
-    for eval in evaluations:
-        # Determine case identifier
-        case_id_display = eval.case_id
-        if eval.case.case_metadata and "filename" in eval.case.case_metadata:
-            # Use filename without extension
-            filename = eval.case.case_metadata["filename"]
-            case_id_display = os.path.splitext(filename)[0]
-
-        writer.writerow([
-            eval.id,
-            eval.user_id,
-            eval.user.email,
-            eval.user.name,
-            case_id_display,
-            eval.q1_acceptability,
-            eval.q2_confidence,
-            eval.comments or "",
-            eval.duration_ms or "",
-            eval.submitted_at.isoformat() if eval.submitted_at else ""
-        ])
-    
-    output.seek(0)
+    """Create a new case"""
+    return await run_db_write(db, _create_case, case_data)
+
+
+@router.get("/composite-cache")
+async def get_composite_cache_stats(admin: User = Depends(get_admin_user)):
+    """Hit/miss counters and size of the composite cache (for the worker that answers)"""
+    return compositing.composite_cache.snapshot()
+
+
+@router.get("/analytics/agreement")
+async def get_agreement(
+    level: Literal["nominal", "ordinal", "interval"] = Query(
+        "ordinal", description="Distance between ratings used by Krippendorff's alpha"
+    ),
+    admin: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Inter-rater agreement per question, with per-case and per-reader statistics"""
+    if not agreement.available():
+        raise HTTPException(status_code=503, detail="Agreement analytics require NumPy on the server")
+    await run_db(db, agreement.agreement_cache().refresh)
+    return await run_in_threadpool(agreement.agreement_cache().report, level)
+
+
+def _scope_reading_times(db: Session, scope: str) -> dict:
+    return durations.load(db, scope).summary()
+
+
+def _reading_times(db: Session, by: Optional[str]) -> dict:
+    result = {"global": durations.load(db, durations.GLOBAL_SCOPE).summary()}
+    if by == "evaluator":
+        sketches = durations.load_prefix(db, "user:")
+        emails = dict(db.query(User.id, User.email).filter(User.id.in_(list(sketches))).all())
+        result["evaluators"] = [
+            {"user_id": user_id, "email": emails.get(user_id), **sketch.summary()}
+            for user_id, sketch in sketches.items()
+        ]
+    elif by == "case":
+        sketches = durations.load_prefix(db, "case:")
+        metadata = dict(db.query(Case.id, Case.case_metadata).filter(Case.id.in_(list(sketches))).all())
+        result["cases"] = [
+            {"case_id": case_id, "case": exports.case_display_id(case_id, metadata.get(case_id)), **sketch.summary()}
+            for case_id, sketch in sketches.items()
+        ]
+    return result
+
+
+@router.get("/reading-times")
+async def get_reading_times(
+    by: Optional[Literal["evaluator", "case"]] = Query(
+        None, description="Also break the percentiles down per evaluator or per case"
+    ),
+    admin: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """p50/p90/p99 of duration_ms from the reading-time sketches, globally and optionally per evaluator or case"""
+    return await run_db(db, _reading_times, by)
+
+
+@router.get("/reading-times/evaluators/{user_id}")
+async def get_evaluator_reading_times(
+    user_id: str,
+    admin: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """p50/p90/p99 of one evaluator's duration_ms"""
+    return await run_db(db, _scope_reading_times, durations.user_scope(user_id))
+
+
+@router.get("/reading-times/cases/{case_id}")
+async def get_case_reading_times(
+    case_id: str,
+    admin: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """p50/p90/p99 of duration_ms for one case"""
+    return await run_db(db, _scope_reading_times, durations.case_scope(case_id))
+
+
+@router.get("/profiles")
+async def get_profiles(admin: User = Depends(get_admin_user)):
+    """Stored request profiles (requests sent with X-Profile: 1), newest first"""
+    return await run_in_threadpool(profiling.list_profiles)
+
+
+@router.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str, admin: User = Depends(get_admin_user)):
+    """Collapsed stacks of a profile, for flamegraph.pl or speedscope"""
+    path = profiling.artifact_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.collapsed")
+
+
+@router.get("/export")
+def export_evaluations(
+    format: Literal["csv", "jsonl", "parquet"] = "csv",
+    gzip: bool = False,
+    admin: User = Depends(get_admin_user)
+):
+    """Export all evaluations, streamed as CSV, JSONL or Parquet (optionally gzip-compressed)"""
+    if format == "parquet" and not exports.parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server")
+
+    media_type, extension = exports.EXPORT_FORMATS[format]
+    filename = f"evaluaciones.{extension}"
+    chunks = exports.ENCODERS[format](exports.iter_record_batches())
+    if gzip:
+        chunks = exports.gzip_stream(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=evaluaciones.csv"}
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
+
+
+@router.get("/export/delta")
+async def export_delta(
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous call; omit for a full initial sync"),
+    limit: int = Query(1000, ge=1, le=exports.DELTA_MAX_LIMIT),
+    admin: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """Get evaluations and deletion tombstones recorded after the cursor, plus the cursor to resume from"""
+    try:
+        positions = exports.decode_delta_cursor(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return await run_db(db, exports.delta_page, positions, limit)
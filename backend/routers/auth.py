@@ -3,10 +3,10 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
 
-from database import get_db, User
+from database import get_db, begin_write, run_db, run_db_write, User
 from schemas import Token, UserOut
 from auth import (
-    verify_password, 
+    verify_password_async,
     create_access_token, 
     get_current_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
@@ -15,38 +15,58 @@ from auth import (
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 
+def _get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def _update_password_hash(db: Session, user_id: str, password_hash: str) -> None:
+    db.commit()  # end the login lookup's read so the write below starts its own transaction
+    begin_write(db)
+    db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
+    db.commit()
+
+
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    # DB work goes through run_db (threadpool or async driver); bcrypt runs on its own bounded pool
+    user = await run_db(db, _get_user_by_email, form_data.username)
+    valid, new_hash = False, None
+    if user:
+        valid, new_hash = await verify_password_async(form_data.password, user.password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
     access_token = create_access_token(
         data={"sub": user.id},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
+    user_out = UserOut(
+        id=user.id,
+        email=user.email,
+        name=user.name,
+        role=user.role.value
+    )
+
+    # Transparent rehash when BCRYPT_ROUNDS changed since the hash was stored
+    if new_hash:
+        await run_db_write(db, _update_password_hash, user.id, new_hash)
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "user": UserOut(
-            id=user.id,
-            email=user.email,
-            name=user.name,
-            role=user.role.value
-        )
+        "user": user_out
     }
 
 
 @router.get("/me", response_model=UserOut)
-def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: User = Depends(get_current_user)):
     return UserOut(
         id=current_user.id,
         email=current_user.email,
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Optional
+import os
+
+from database import get_db, run_db, Case
+import compositing
+import derivatives
+
+# Plain image URL like /static and /tiles, so <img> tags can load it without a token
+router = APIRouter(prefix="/composites", tags=["Composites"])
+
+COMPOSITE_CACHE_CONTROL = "public, max-age=86400"
+
+
+def _get_sources(db: Session, case_id: str) -> tuple:
+    case = db.query(Case).filter(Case.id == case_id).first()
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+    metadata = case.case_metadata or {}
+    # Re-ingested files get new hashes, so stale composites are never served
+    content_key = case.id
+    if metadata.get("sha256") and metadata.get("overlay_sha256"):
+        content_key += f"_{metadata['sha256'][:16]}{metadata['overlay_sha256'][:16]}"
+    return (
+        os.path.join(compositing.STATIC_DIR, case.image_s3_key),
+        os.path.join(compositing.STATIC_DIR, case.mask_s3_key),
+        content_key
+    )
+
+
+@router.get("/{case_id}")
+async def get_composite(
+    case_id: str,
+    request: Request,
+    opacity: float = Query(0.8, ge=0, le=1, description="Mask opacity, quantized to COMPOSITE_OPACITY_STEP"),
+    width: Optional[int] = Query(None, description="One of the derivative widths; full size when omitted"),
+    db: Session = Depends(get_db)
+):
+    """Case image with its mask blended on top, as a single image"""
+    if not compositing.available():
+        raise HTTPException(status_code=503, detail="Compositing requires Pillow on the server")
+    if width is not None and width not in derivatives.DERIVATIVE_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"width must be one of {derivatives.DERIVATIVE_WIDTHS}")
+
+    image_path, mask_path, content_key = await run_db(db, _get_sources, case_id)
+    if not (os.path.exists(image_path) and os.path.exists(mask_path)):
+        raise HTTPException(status_code=404, detail="Image file not found")
+
+    fmt = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+    opacity_percent = compositing.quantize_opacity(opacity)
+    key = compositing.cache_key(content_key, opacity_percent, width, fmt)
+
+    data = await run_in_threadpool(compositing.composite_cache.get, key)
+    cache_status = "HIT"
+    if data is None:
+        cache_status = "MISS"
+        data = await compositing.render_async(image_path, mask_path, opacity_percent, width, fmt)
+        await run_in_threadpool(compositing.composite_cache.put, key, data)
+
+    return Response(
+        data,
+        media_type=compositing.MEDIA_TYPES[fmt],
+        headers={"Cache-Control": COMPOSITE_CACHE_CONTROL, "Vary": "Accept", "X-Cache": cache_status}
+    )
@@ -1,12 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from typing import Optional
+import asyncio
 import os
 
-from database import get_db, User, Case, Evaluation
-from schemas import EvaluationCreate, EvaluationOut, CaseOut, ProgressOut
+from database import (
+    get_db, run_db, run_db_write, begin_write, generate_uuid,
+    User, Case, Evaluation, EvaluationIdempotencyKey
+)
+from schemas import (
+    EvaluationCreate, EvaluationOut, CaseOut, ImageVariant, ProgressOut, SessionOut, SubmitAndNextOut,
+    BatchEvaluationIn, BatchEvaluationItem, BatchEvaluationOut
+)
 from auth import get_current_user
+from group_commit import GROUP_COMMIT, GROUP_COMMIT_TIMEOUT_SECONDS, group_committer
+from static_files import fingerprinted_url
+import case_queue
+import counters
+import durations
 
 router = APIRouter(prefix="/evaluations", tags=["Evaluations"])
 
@@ -14,78 +27,90 @@ router = APIRouter(prefix="/evaluations", tags=["Evaluations"])
 # In production, Nginx serves /static; in dev with backend on :8000, use full URL
 S3_BASE_URL = os.getenv("S3_BASE_URL", "/static")
 
+# Upper bound for the number of upcoming cases returned for prefetching
+MAX_LOOKAHEAD = 10
 
-@router.get("/next-case", response_model=Optional[CaseOut])
-def get_next_case(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get the next unevaluated case for the current user"""
-    # Get IDs of cases already evaluated by this user
-    evaluated_case_ids = db.query(Evaluation.case_id).filter(
-        Evaluation.user_id == current_user.id
-    ).subquery()
-    
-    # Find a case not yet evaluated
-    next_case = db.query(Case).filter(
-        ~Case.id.in_(evaluated_case_ids)
-    ).order_by(func.random()).first()
-    
-    if not next_case:
-        return None
-    
+
+def _variants(metadata: Optional[dict]) -> dict:
+    """Downscaled derivatives recorded at ingest (see derivatives.py), as URLs by ascending width"""
+    stored = (metadata or {}).get("variants") or {}
+    return {
+        kind: {
+            fmt: [
+                ImageVariant(width=int(width), url=f"{S3_BASE_URL}/{key}")
+                for width, key in sorted(by_width.items(), key=lambda item: int(item[0]))
+            ]
+            for fmt, by_width in formats.items()
+        }
+        for kind, formats in stored.items()
+    }
+
+
+def _case_out(case: Case) -> CaseOut:
+    metadata = case.case_metadata or {}
     return CaseOut(
-        id=next_case.id,
-        imageUrl=f"{S3_BASE_URL}/{next_case.image_s3_key}",
-        maskUrl=f"{S3_BASE_URL}/{next_case.mask_s3_key}",
-        metadata=next_case.case_metadata
+        id=case.id,
+        imageUrl=fingerprinted_url(S3_BASE_URL, case.image_s3_key, metadata.get("sha256")),
+        maskUrl=fingerprinted_url(S3_BASE_URL, case.mask_s3_key, metadata.get("overlay_sha256")),
+        metadata=case.case_metadata,
+        variants=_variants(case.case_metadata)
     )
 
 
-@router.get("/progress", response_model=ProgressOut)
-def get_progress(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get evaluation progress for current user"""
-    completed = db.query(func.count(Evaluation.id)).filter(
-        Evaluation.user_id == current_user.id
-    ).scalar()
-    
-    total = db.query(func.count(Case.id)).scalar()
-    
-    return ProgressOut(completed=completed, total=total)
+def _progress(db: Session, user: User) -> ProgressOut:
+    completed_key = counters.completed_key(user.id)
+    values = counters.get_many(db, completed_key, counters.TOTAL_CASES)
+    return ProgressOut(completed=values[completed_key], total=values[counters.TOTAL_CASES])
 
 
-@router.post("", response_model=EvaluationOut, status_code=status.HTTP_201_CREATED)
-def submit_evaluation(
-    evaluation: EvaluationCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Submit an evaluation for a case"""
+def _session(db: Session, user: User, lookahead: int) -> dict:
+    """Current case, progress and the next queued cases in one go"""
+    try:
+        next_case = case_queue.next_case(db, user.id)
+    except case_queue.AllCasesLeased as leased:
+        # Not done yet: the client waits and asks again instead of showing completion
+        return {"case": None, "progress": _progress(db, user), "upcoming": [], "retryAfter": leased.retry_after}
+    upcoming = []
+    if next_case and lookahead:
+        upcoming = case_queue.upcoming_cases(db, user.id, lookahead, exclude_case_id=next_case.id)
+    return {
+        "case": _case_out(next_case) if next_case else None,
+        "progress": _progress(db, user),
+        "upcoming": [_case_out(case) for case in upcoming],
+    }
+
+
+def _score_error(evaluation: EvaluationCreate) -> Optional[str]:
+    if not (1 <= evaluation.q1_acceptability <= 4):
+        return "Q1 must be between 1 and 4"
+    if not (1 <= evaluation.q2_confidence <= 5):
+        return "Q2 must be between 1 and 5"
+    return None
+
+
+def _already_evaluated() -> HTTPException:
+    return HTTPException(status_code=400, detail="Case already evaluated")
+
+
+def _stage_evaluation(db: Session, user_id: str, evaluation: EvaluationCreate) -> Evaluation:
+    """
+    Validate an evaluation and stage it with its queue, coverage and counter
+    updates (caller commits). A second evaluation of the same case is caught
+    by the unique (user_id, case_id) index when flushed, as an IntegrityError.
+    """
     # Validate case exists
     case = db.query(Case).filter(Case.id == evaluation.case_id).first()
     if not case:
         raise HTTPException(status_code=404, detail="Case not found")
     
-    # Check if already evaluated
-    existing = db.query(Evaluation).filter(
-        Evaluation.user_id == current_user.id,
-        Evaluation.case_id == evaluation.case_id
-    ).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Case already evaluated")
-    
     # Validate scores
-    if not (1 <= evaluation.q1_acceptability <= 4):
-        raise HTTPException(status_code=400, detail="Q1 must be between 1 and 4")
-    if not (1 <= evaluation.q2_confidence <= 5):
-        raise HTTPException(status_code=400, detail="Q2 must be between 1 and 5")
+    score_error = _score_error(evaluation)
+    if score_error:
+        raise HTTPException(status_code=400, detail=score_error)
     
     # Create evaluation
     new_eval = Evaluation(
-        user_id=current_user.id,
+        user_id=user_id,
         case_id=evaluation.case_id,
         q1_acceptability=evaluation.q1_acceptability,
         q2_confidence=evaluation.q2_confidence,
@@ -93,7 +118,237 @@ def submit_evaluation(
         duration_ms=evaluation.duration_ms
     )
     db.add(new_eval)
-    db.commit()
+    case_queue.record_rating(db, user_id, evaluation.case_id)
+    counters.increment(db, counters.TOTAL_EVALUATIONS)
+    counters.increment(db, counters.completed_key(user_id))
+    durations.record(db, user_id, evaluation.case_id, evaluation.duration_ms)
+    return new_eval
+
+
+def _group_write(user_id: str, evaluation: EvaluationCreate):
+    def write(session: Session) -> str:
+        new_eval = _stage_evaluation(session, user_id, evaluation)
+        try:
+            session.flush()  # assigns the id
+        except IntegrityError:
+            raise _already_evaluated()  # the writer rolls back
+        return new_eval.id
+    return write
+
+
+def _create_evaluation(db: Session, current_user: User, evaluation: EvaluationCreate) -> Evaluation:
+    """Store an evaluation in its own transaction (with GROUP_COMMIT, _submit hands it to the writer instead)"""
+    begin_write(db)
+    new_eval = _stage_evaluation(db, current_user.id, evaluation)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise _already_evaluated()
     db.refresh(new_eval)
-    
     return new_eval
+
+
+def _evaluation_out(db: Session, evaluation_id: str) -> EvaluationOut:
+    return EvaluationOut.model_validate(db.get(Evaluation, evaluation_id))
+
+
+def _store_evaluation(db: Session, current_user: User, evaluation: EvaluationCreate) -> EvaluationOut:
+    return EvaluationOut.model_validate(_create_evaluation(db, current_user, evaluation))
+
+
+async def _submit(db: Session, current_user: User, evaluation: EvaluationCreate) -> EvaluationOut:
+    """
+    The submit routes' only write path: the group-commit writer when enabled
+    (awaited without holding a thread), _create_evaluation otherwise
+    """
+    if GROUP_COMMIT:
+        future = group_committer.submit(_group_write(current_user.id, evaluation))
+        try:
+            # Shielded: a timed-out or cancelled request must not cancel a write the writer may be committing
+            evaluation_id = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)), GROUP_COMMIT_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503, detail="The evaluation is still being saved; it may already be stored"
+            )
+        return await run_db(db, _evaluation_out, evaluation_id)
+    return await run_db_write(db, _store_evaluation, current_user, evaluation)
+
+
+def _submit_batch(db: Session, current_user: User, items: list[BatchEvaluationItem]) -> BatchEvaluationOut:
+    """
+    Validate a batch against three set-based lookups (known cases, cases the
+    user already evaluated, idempotency keys already seen) and insert every
+    accepted item in one transaction. A replayed key returns its original
+    evaluation instead of failing, so clients can resend a whole batch after
+    a dropped connection.
+    """
+    begin_write(db)
+    case_ids = {item.case_id for item in items}
+    keys = {item.idempotency_key for item in items}
+    known_cases = {row.id for row in db.query(Case.id).filter(Case.id.in_(case_ids))}
+    evaluated = dict(db.query(Evaluation.case_id, Evaluation.id).filter(
+        Evaluation.user_id == current_user.id,
+        Evaluation.case_id.in_(case_ids)
+    ).all())
+    seen_keys = {
+        row.idempotency_key: (row.case_id, row.evaluation_id)
+        for row in db.query(EvaluationIdempotencyKey).filter(
+            EvaluationIdempotencyKey.user_id == current_user.id,
+            EvaluationIdempotencyKey.idempotency_key.in_(keys)
+        )
+    }
+
+    results, new_evaluations, new_keys = [], [], []
+    for item in items:
+        result = {"idempotency_key": item.idempotency_key, "case_id": item.case_id}
+        results.append(result)
+        if item.idempotency_key in seen_keys:
+            case_id, evaluation_id = seen_keys[item.idempotency_key]
+            if case_id == item.case_id:
+                result.update(status="replayed", evaluation_id=evaluation_id)
+            else:
+                result.update(status="conflict", error="Idempotency key already used for another case")
+            continue
+        if item.case_id not in known_cases:
+            result.update(status="invalid", error="Case not found")
+            continue
+        if item.case_id in evaluated:
+            result.update(status="already_evaluated", evaluation_id=evaluated[item.case_id])
+            continue
+        score_error = _score_error(item)
+        if score_error:
+            result.update(status="invalid", error=score_error)
+            continue
+
+        evaluation_id = generate_uuid()
+        new_evaluations.append({
+            "id": evaluation_id,
+            "user_id": current_user.id,
+            "case_id": item.case_id,
+            "q1_acceptability": item.q1_acceptability,
+            "q2_confidence": item.q2_confidence,
+            "comments": item.comments,
+            "duration_ms": item.duration_ms,
+        })
+        new_keys.append({
+            "user_id": current_user.id,
+            "idempotency_key": item.idempotency_key,
+            "case_id": item.case_id,
+            "evaluation_id": evaluation_id,
+        })
+        evaluated[item.case_id] = evaluation_id
+        seen_keys[item.idempotency_key] = (item.case_id, evaluation_id)
+        result.update(status="created", evaluation_id=evaluation_id)
+
+    if new_evaluations:
+        db.execute(insert(Evaluation), new_evaluations)
+        db.execute(insert(EvaluationIdempotencyKey), new_keys)
+        case_queue.record_ratings(db, current_user.id, [row["case_id"] for row in new_evaluations])
+        counters.increment(db, counters.TOTAL_EVALUATIONS, len(new_evaluations))
+        counters.increment(db, counters.completed_key(current_user.id), len(new_evaluations))
+        durations.record_many(db, [
+            (current_user.id, row["case_id"], row["duration_ms"]) for row in new_evaluations
+        ])
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another request stored one of these evaluations or keys first (backends without BEGIN IMMEDIATE)
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Batch submitted concurrently, please retry")
+
+    return BatchEvaluationOut(
+        created=len(new_evaluations),
+        results=results,
+        progress=_progress(db, current_user)
+    )
+
+
+async def _run_scheduler(db: Session, fn, *args):
+    """Run a unit of work that picks the next case; the coverage scheduler writes leases while doing so"""
+    if case_queue.SCHEDULER == "coverage":
+        return await run_db_write(db, fn, *args)
+    return await run_db(db, fn, *args)
+
+
+def _next_case(db: Session, user: User) -> Optional[CaseOut]:
+    # Served from the user's pre-shuffled queue; evaluated cases are removed on submit
+    try:
+        next_case = case_queue.next_case(db, user.id)
+    except case_queue.AllCasesLeased as leased:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="All pending cases are being evaluated by others, retry later",
+            headers={"Retry-After": str(leased.retry_after)},
+        )
+    
+    if not next_case:
+        return None
+    
+    return _case_out(next_case)
+
+
+@router.get("/next-case", response_model=Optional[CaseOut])
+async def get_next_case(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the next unevaluated case for the current user"""
+    return await _run_scheduler(db, _next_case, current_user)
+
+
+@router.get("/progress", response_model=ProgressOut)
+async def get_progress(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get evaluation progress for current user"""
+    return await run_db(db, _progress, current_user)
+
+
+@router.get("/session", response_model=SessionOut)
+async def get_session(
+    lookahead: int = Query(3, ge=0, le=MAX_LOOKAHEAD),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the current case, progress and the next queued cases in a single call"""
+    return await _run_scheduler(db, _session, current_user, lookahead)
+
+
+@router.post("", response_model=EvaluationOut, status_code=status.HTTP_201_CREATED)
+async def submit_evaluation(
+    evaluation: EvaluationCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Submit an evaluation for a case"""
+    return await _submit(db, current_user, evaluation)
+
+
+@router.post("/batch", response_model=BatchEvaluationOut)
+async def submit_batch(
+    batch: BatchEvaluationIn,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Submit evaluations queued by the client (e.g. while offline) in one
+    transaction. Each item carries an idempotency key; the response reports
+    per item whether it was created, replayed or rejected.
+    """
+    return await run_db_write(db, _submit_batch, current_user, batch.evaluations)
+
+
+@router.post("/submit-and-next", response_model=SubmitAndNextOut, status_code=status.HTTP_201_CREATED)
+async def submit_and_next(
+    evaluation: EvaluationCreate,
+    lookahead: int = Query(3, ge=0, le=MAX_LOOKAHEAD),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Submit an evaluation and get the next session state in the same response"""
+    new_eval = await _submit(db, current_user, evaluation)
+    return {"evaluation": new_eval, **await _run_scheduler(db, _session, current_user, lookahead)}
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from typing import Literal
+import os
+
+from database import get_db, run_db, Case
+import tiles
+
+# Served next to /static: viewers load <case>/<kind>.dzi and derive the tile URLs from it
+router = APIRouter(prefix="/tiles", tags=["Tiles"])
+
+# Tiles of a case only change when its files are re-ingested
+TILE_CACHE_CONTROL = "public, max-age=86400"
+
+
+def _get_source(db: Session, case_id: str, kind: str) -> tuple:
+    case = db.query(Case).filter(Case.id == case_id).first()
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+    return tiles.source_for(case, kind)
+
+
+async def _pyramid(db: Session, case_id: str, kind: str) -> tuple:
+    if not tiles.available():
+        raise HTTPException(status_code=503, detail="Deep zoom tiles require Pillow on the server")
+    path, content_key, size = await run_db(db, _get_source, case_id, kind)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image file not found")
+    if size is None:
+        size = await run_in_threadpool(tiles.image_size, path)
+    return path, content_key, tiles.Pyramid(*size)
+
+
+@router.get("/{case_id}/{kind}.dzi")
+async def get_descriptor(
+    case_id: str,
+    kind: Literal["image", "mask"],
+    db: Session = Depends(get_db)
+):
+    """Deep Zoom descriptor of a case image or mask"""
+    _, _, pyramid = await _pyramid(db, case_id, kind)
+    return Response(
+        tiles.descriptor(pyramid, tiles.TILE_FORMATS[kind]),
+        media_type="application/xml",
+        headers={"Cache-Control": TILE_CACHE_CONTROL}
+    )
+
+
+@router.get("/{case_id}/{kind}_files/{level}/{col}_{row}.{fmt}")
+async def get_tile(
+    case_id: str,
+    kind: Literal["image", "mask"],
+    level: int,
+    col: int,
+    row: int,
+    fmt: str,
+    db: Session = Depends(get_db)
+):
+    """One tile of the pyramid; its level is rendered and cached on first access"""
+    path, content_key, pyramid = await _pyramid(db, case_id, kind)
+    if fmt != tiles.TILE_FORMATS[kind] or not pyramid.has_tile(level, col, row):
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    tile = tiles.tile_path(content_key, kind, level, col, row)
+    if not os.path.exists(tile):
+        await run_in_threadpool(tiles.ensure_level, path, content_key, kind, pyramid, level)
+    return FileResponse(tile, media_type=tiles.MEDIA_TYPES[fmt], headers={"Cache-Control": TILE_CACHE_CONTROL})
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field
+from typing import Optional, List, Dict
 from enum import Enum
 from datetime import datetime
 
@@ -46,6 +46,8 @@ class UserOut(UserBase):
 class UserWithProgress(UserOut):
     completed: int
     total: int
+    lastActivity: Optional[datetime] = None
+    medianDurationMs: Optional[float] = None
 
 
 # === Case Schemas ===
@@ -58,11 +60,18 @@ class CaseCreate(CaseBase):
     mask_s3_key: str
 
 
+class ImageVariant(BaseModel):
+    width: int
+    url: str
+
+
 class CaseOut(BaseModel):
     id: str
     imageUrl: str
     maskUrl: str
     metadata: Optional[dict] = None
+    # {"image" | "mask": {"webp" | "avif": [variants by ascending width]}}
+    variants: Dict[str, Dict[str, List[ImageVariant]]] = {}
 
     class Config:
         from_attributes = True
@@ -77,6 +86,22 @@ class EvaluationCreate(BaseModel):
     duration_ms: Optional[int] = None
 
 
+class BatchEvaluationItem(EvaluationCreate):
+    idempotency_key: str = Field(min_length=1, max_length=64)  # chosen by the client, unique per user
+
+
+class BatchEvaluationIn(BaseModel):
+    evaluations: List[BatchEvaluationItem] = Field(min_length=1, max_length=500)
+
+
+class BatchItemResult(BaseModel):
+    idempotency_key: str
+    case_id: str
+    status: str  # created | replayed | already_evaluated | invalid | conflict
+    evaluation_id: Optional[str] = None
+    error: Optional[str] = None
+
+
 class EvaluationOut(BaseModel):
     id: str
     user_id: str
@@ -97,9 +122,41 @@ class ProgressOut(BaseModel):
     total: int
 
 
+# === Session Schemas ===
+class SessionOut(BaseModel):
+    case: Optional[CaseOut] = None
+    progress: ProgressOut
+    upcoming: List[CaseOut] = []  # next cases in the queue, for image prefetching
+    retryAfter: Optional[int] = None  # seconds; set when every pending case is leased to another evaluator
+
+
+class SubmitAndNextOut(SessionOut):
+    evaluation: EvaluationOut
+
+
+class BatchEvaluationOut(BaseModel):
+    created: int
+    results: List[BatchItemResult]  # one per submitted item, in order
+    progress: ProgressOut
+
+
 # === Admin Schemas ===
 class StatsOut(BaseModel):
     totalCases: int
     totalEvaluators: int
     completedEvaluations: int
     pendingEvaluations: int
+
+
+class ImportRowResult(BaseModel):
+    row: int  # line number in the uploaded file
+    email: Optional[str] = None
+    status: str  # created | valid (not created because other rows failed) | invalid | duplicate | exists
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class EvaluatorImportOut(BaseModel):
+    created: int
+    rejected: int
+    rows: List[ImportRowResult]
@@ -4,6 +4,8 @@ Run with: python seed_db.py
 """
 from database import SessionLocal, init_db, User, Case, UserRole
 from auth import get_password_hash
+import case_queue
+import counters
 import os
 
 def seed_database():
@@ -40,6 +42,8 @@ def seed_database():
                 role=UserRole.EVALUATOR
             )
             db.add(evaluator)
+            db.flush()
+            case_queue.build_queue_for_user(db, evaluator.id)
             db.commit()
             print("✓ Sample evaluator created (evaluador@example.com / eval123)")
         
@@ -54,12 +58,14 @@ def seed_database():
                 {"image_s3_key": "cases/case_004.png", "mask_s3_key": "cases/case_004_mask.png", "case_metadata": {"dr_grade": 2}},
                 {"image_s3_key": "cases/case_005.png", "mask_s3_key": "cases/case_005_mask.png", "case_metadata": {"dr_grade": 1}},
             ]
-            for case_data in sample_cases:
-                case = Case(**case_data)
-                db.add(case)
+            cases = [Case(**case_data) for case_data in sample_cases]
+            db.add_all(cases)
+            db.flush()
+            case_queue.add_cases(db, [case.id for case in cases])
             db.commit()
             print(f"✓ Created {len(sample_cases)} sample cases")
         
+        counters.rebuild(db)
         print("\n✓ Database seeding complete!")
         print("\nTest Credentials:")
         print("  Admin: admin@example.com / admin123")
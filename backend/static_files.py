@@ -0,0 +1,93 @@
+"""
+Content-addressed caching for the case images under /static.
+
+Case URLs carry a fingerprint of the file's content hash (recorded at
+ingest as sha256 / overlay_sha256): /static/overlay_imgs/x.png?v=<hash>.
+When an overlay is regenerated and re-ingested its hash, and therefore its
+URL, changes, so fingerprinted URLs can be cached forever as immutable.
+Derivatives are already named after their source's hash and are immutable
+as well. In production nginx applies the same policy (see nginx.conf).
+
+ContentHashStaticFiles serves the same directory in development with a
+strong ETag (the file's sha256, computed once per file version), answers
+If-None-Match with 304 and lets FileResponse handle Range requests against
+that ETag.
+"""
+from functools import lru_cache
+from typing import Optional
+import hashlib
+import os
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+FINGERPRINT_LENGTH = 16
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Unfingerprinted files may change in place: cache, but revalidate (a 304 when unchanged)
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Directories under /static whose file names already contain the content hash
+CONTENT_ADDRESSED_DIRS = ("derivatives/",)
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def fingerprinted_url(base_url: str, key: str, sha256: Optional[str]) -> str:
+    """URL of a static file, versioned by its content hash when one was recorded"""
+    if not sha256:
+        return f"{base_url}/{key}"
+    return f"{base_url}/{key}?v={sha256[:FINGERPRINT_LENGTH]}"
+
+
+@lru_cache(maxsize=8192)
+def _content_hash(path: str, size: int, mtime_ns: int) -> str:
+    """sha256 of a file; size and mtime are part of the cache key so edits are re-hashed"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored"""
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class ContentHashStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        # Conditional requests are answered in get_response, against the content-hash ETag
+        return FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse):
+            return response
+
+        stat_result = response.stat_result
+        sha256 = await run_in_threadpool(
+            _content_hash, str(response.path), stat_result.st_size, stat_result.st_mtime_ns
+        )
+        etag = f'"{sha256}"'
+        response.headers["etag"] = etag
+
+        # Only a fingerprint that matches the bytes served may be cached as immutable
+        version = QueryParams(scope.get("query_string", b"")).get("v")
+        immutable = (version and sha256.startswith(version)) or path.startswith(CONTENT_ADDRESSED_DIRS)
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+
+        request_headers = Headers(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, etag)
+        else:
+            not_modified = self.is_not_modified(response.headers, request_headers)  # If-Modified-Since
+        if not_modified:
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,156 @@
+"""
+Deep Zoom (DZI) tile pyramids for case images and masks.
+
+Level L of the pyramid is the image scaled to 1/2^(max_level - L) of its
+full size, cut into TILE_SIZE tiles with TILE_OVERLAP pixels of overlap, as
+Deep Zoom viewers (e.g. OpenSeadragon) expect. Nothing is generated up
+front: the first request for a tile renders its whole level (one decode and
+one resize) and caches the tiles under database/tiles/<content hash>/, so a
+viewer only ever triggers the levels it actually zooms into.
+
+Requires Pillow.
+"""
+from typing import Optional
+import math
+import os
+import threading
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "254"))
+TILE_OVERLAP = 1
+TILE_JPEG_QUALITY = 85
+TILES_DIR = "tiles"  # relative to the static 'database' directory
+
+# Photos compress well as JPEG; masks are flat colours and may carry alpha
+TILE_FORMATS = {"image": "jpeg", "mask": "png"}
+PIL_FORMATS = {"jpeg": "JPEG", "png": "PNG"}
+MEDIA_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "database"))
+
+_level_locks: dict = {}
+_level_locks_guard = threading.Lock()
+
+
+def available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class Pyramid:
+    """Geometry of a DZI pyramid for an image of the given size"""
+
+    def __init__(self, width: int, height: int, tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_level = math.ceil(math.log2(max(width, height, 1)))
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        scale = 2 ** (self.max_level - level)
+        return max(1, math.ceil(self.width / scale)), max(1, math.ceil(self.height / scale))
+
+    def grid(self, level: int) -> tuple[int, int]:
+        width, height = self.level_size(level)
+        return math.ceil(width / self.tile_size), math.ceil(height / self.tile_size)
+
+    def tile_box(self, level: int, col: int, row: int) -> tuple[int, int, int, int]:
+        """(left, top, right, bottom) of a tile in level coordinates, overlap included"""
+        width, height = self.level_size(level)
+        left = col * self.tile_size - (self.overlap if col > 0 else 0)
+        top = row * self.tile_size - (self.overlap if row > 0 else 0)
+        right = min(width, (col + 1) * self.tile_size + self.overlap)
+        bottom = min(height, (row + 1) * self.tile_size + self.overlap)
+        return left, top, right, bottom
+
+    def has_tile(self, level: int, col: int, row: int) -> bool:
+        if not 0 <= level <= self.max_level:
+            return False
+        cols, rows = self.grid(level)
+        return 0 <= col < cols and 0 <= row < rows
+
+
+def descriptor(pyramid: Pyramid, fmt: str) -> str:
+    """The .dzi XML document for a pyramid"""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{fmt}" '
+        f'Overlap="{pyramid.overlap}" TileSize="{pyramid.tile_size}">'
+        f'<Size Width="{pyramid.width}" Height="{pyramid.height}"/></Image>'
+    )
+
+
+def image_size(path: str) -> tuple[int, int]:
+    """Read the size from the header only"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.size
+
+
+def _level_dir(content_key: str, kind: str, level: int) -> str:
+    return os.path.join(STATIC_DIR, TILES_DIR, content_key[:2], content_key, f"{kind}_files", str(level))
+
+
+def tile_path(content_key: str, kind: str, level: int, col: int, row: int) -> str:
+    return os.path.join(_level_dir(content_key, kind, level), f"{col}_{row}.{TILE_FORMATS[kind]}")
+
+
+def _lock_for(key: tuple) -> threading.Lock:
+    with _level_locks_guard:
+        return _level_locks.setdefault(key, threading.Lock())
+
+
+def ensure_level(source_path: str, content_key: str, kind: str, pyramid: Pyramid, level: int) -> None:
+    """
+    Render and cache every tile of one level unless already on disk.
+    Concurrent requests for the same level in this process wait for a single
+    render; across processes tiles are written atomically, so a duplicate
+    render is wasted work but never a torn file.
+    """
+    level_dir = _level_dir(content_key, kind, level)
+    marker = os.path.join(level_dir, ".complete")
+    if os.path.exists(marker):
+        return
+
+    with _lock_for((content_key, kind, level)):
+        if os.path.exists(marker):
+            return
+        from PIL import Image
+
+        fmt = TILE_FORMATS[kind]
+        with Image.open(source_path) as source:
+            source.load()
+            image = source if fmt == "png" else source.convert("RGB")
+            size = pyramid.level_size(level)
+            if size != image.size:
+                image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+        os.makedirs(level_dir, exist_ok=True)
+        cols, rows = pyramid.grid(level)
+        options = {"quality": TILE_JPEG_QUALITY} if fmt == "jpeg" else {}
+        for col in range(cols):
+            for row in range(rows):
+                path = tile_path(content_key, kind, level, col, row)
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                image.crop(pyramid.tile_box(level, col, row)).save(tmp, PIL_FORMATS[fmt], **options)
+                os.replace(tmp, path)
+        with open(marker, "w"):
+            pass
+
+
+def source_for(case, kind: str) -> tuple[str, str, Optional[tuple[int, int]]]:
+    """(source path, content key, (width, height) if recorded at ingest) of a case's image or mask"""
+    metadata = case.case_metadata or {}
+    if kind == "image":
+        key, sha, width, height = case.image_s3_key, metadata.get("sha256"), metadata.get("width"), metadata.get("height")
+    else:
+        key, sha = case.mask_s3_key, metadata.get("overlay_sha256")
+        width, height = metadata.get("overlay_width"), metadata.get("overlay_height")
+    # Cases ingested before hashes were recorded are keyed by case id instead
+    content_key = sha or f"case-{case.id}-{kind}"
+    size = (width, height) if width and height else None
+    return os.path.join(STATIC_DIR, key), content_key, size
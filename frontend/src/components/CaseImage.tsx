@@ -0,0 +1,58 @@
+import type { CSSProperties } from 'react';
+import { API_BASE_URL } from '../services/api';
+import type { ImageVariant, ImageVariants } from '../types';
+
+// Rendered width of the image panel (2 of 3 columns on large screens)
+export const CASE_IMAGE_SIZES = '(min-width: 1024px) 66vw, 100vw';
+
+// Preferred first: the browser takes the first <source> whose type it supports
+const FORMATS = ['avif', 'webp'];
+
+// srcset from the derivatives, plus the original as the largest candidate when its width is known
+export const buildSrcSet = (variants: ImageVariant[], originalUrl: string, originalWidth?: number) =>
+    [
+        ...variants.map((v) => `${v.url} ${v.width}w`),
+        ...(originalWidth ? [`${originalUrl} ${originalWidth}w`] : []),
+    ].join(', ');
+
+// Mask opacity of the overlay view; the server quantizes it so every case shares the same cached value
+export const OVERLAY_OPACITY = 0.8;
+
+// Image and mask blended on the server: one download instead of two
+export const compositeUrl = (caseId: string, width?: number) =>
+    `${API_BASE_URL}/composites/${caseId}?opacity=${OVERLAY_OPACITY}${width ? `&width=${width}` : ''}`;
+
+// Same widths as the image derivatives; the server answers in WebP when the browser accepts it
+export const buildCompositeSrcSet = (caseId: string, variants: ImageVariant[], originalWidth?: number) =>
+    [
+        ...variants.map((v) => `${compositeUrl(caseId, v.width)} ${v.width}w`),
+        ...(originalWidth ? [`${compositeUrl(caseId)} ${originalWidth}w`] : []),
+    ].join(', ');
+
+interface CaseImageProps {
+    src: string;
+    variants?: ImageVariants;
+    originalWidth?: number;
+    alt: string;
+    className?: string;
+    style?: CSSProperties;
+}
+
+export default function CaseImage({ src, variants, originalWidth, alt, className, style }: CaseImageProps) {
+    return (
+        <picture>
+            {FORMATS.map((format) => {
+                const candidates = variants?.[format];
+                return candidates?.length ? (
+                    <source
+                        key={format}
+                        type={`image/${format}`}
+                        srcSet={buildSrcSet(candidates, src, originalWidth)}
+                        sizes={CASE_IMAGE_SIZES}
+                    />
+                ) : null;
+            })}
+            <img src={src} alt={alt} className={className} style={style} />
+        </picture>
+    );
+}
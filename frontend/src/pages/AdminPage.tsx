@@ -8,6 +8,8 @@ interface Evaluator {
     name: string;
     completed: number;
     total: number;
+    lastActivity?: string | null;
+    medianDurationMs?: number | null;
 }
 
 interface Stats {
@@ -26,19 +28,26 @@ export default function AdminPage() {
     const [newEvaluator, setNewEvaluator] = useState({ email: '', name: '', password: '' });
     const [editingEvaluator, setEditingEvaluator] = useState<string | null>(null);
     const [isSubmitting, setIsSubmitting] = useState(false);
+    const [search, setSearch] = useState('');
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
 
     useEffect(() => {
         fetchData();
     }, []);
 
+    const fetchEvaluators = (cursor?: string) => api.get<Evaluator[]>('/admin/evaluators', {
+        params: { search: search || undefined, cursor },
+    });
+
     const fetchData = async () => {
         setIsLoading(true);
         try {
             const [evalRes, statsRes] = await Promise.all([
-                api.get('/admin/evaluators'),
+                fetchEvaluators(),
                 api.get('/admin/stats'),
             ]);
             setEvaluators(evalRes.data);
+            setNextCursor(evalRes.headers['x-next-cursor'] ?? null);
             setStats(statsRes.data);
         } catch (error) {
             console.error('Error fetching admin data:', error);
@@ -47,6 +56,17 @@ export default function AdminPage() {
         }
     };
 
+    const handleLoadMore = async () => {
+        if (!nextCursor) return;
+        try {
+            const res = await fetchEvaluators(nextCursor);
+            setEvaluators((prev) => [...prev, ...res.data]);
+            setNextCursor(res.headers['x-next-cursor'] ?? null);
+        } catch (error) {
+            console.error('Error fetching evaluators:', error);
+        }
+    };
+
     const handleDeleteEvaluator = async (userId: string, name: string) => {
         if (!window.confirm(`¿Está seguro de que desea eliminar al evaluador "${name}"? Esta acción eliminará permanentemente su cuenta y sus evaluaciones.`)) {
             return;
@@ -161,8 +181,20 @@ export default function AdminPage() {
 
                 {/* Evaluators Table */}
                 <div className="bg-slate-800/50 backdrop-blur-xl rounded-xl border border-slate-700/50 overflow-hidden">
-                    <div className="px-6 py-4 border-b border-slate-700/50">
+                    <div className="px-6 py-4 border-b border-slate-700/50 flex items-center justify-between gap-4">
                         <h2 className="text-lg font-medium text-white">Evaluadores</h2>
+                        <form
+                            onSubmit={(e) => { e.preventDefault(); fetchData(); }}
+                            className="flex items-center gap-2"
+                        >
+                            <input
+                                type="search"
+                                value={search}
+                                onChange={(e) => setSearch(e.target.value)}
+                                placeholder="Buscar por nombre o correo..."
+                                className="px-3 py-1.5 bg-slate-700/50 border border-slate-600 rounded-lg text-sm text-white placeholder-slate-500 focus:outline-none focus:ring-2 focus:ring-teal-500"
+                            />
+                        </form>
                     </div>
 
                     {isLoading ? (
@@ -231,6 +263,16 @@ export default function AdminPage() {
                             </tbody>
                         </table>
                     )}
+                    {!isLoading && nextCursor && (
+                        <div className="px-6 py-4 border-t border-slate-700/50 text-center">
+                            <button
+                                onClick={handleLoadMore}
+                                className="text-sm text-teal-400 hover:text-teal-300 transition-colors"
+                            >
+                                Cargar más
+                            </button>
+                        </div>
+                    )}
                 </div>
             </main>
 
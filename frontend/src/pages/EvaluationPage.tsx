@@ -1,14 +1,62 @@
 import { useState, useEffect, useCallback } from 'react';
 import api from '../services/api';
-import type { Case, EvaluationProgress } from '../types';
+import type { Case, EvaluationProgress, EvaluationSession, ImageVariant } from '../types';
 import Header from '../components/Header';
 import WelcomeModal from '../components/WelcomeModal';
+import CaseImage, {
+    CASE_IMAGE_SIZES,
+    OVERLAY_OPACITY,
+    buildCompositeSrcSet,
+    buildSrcSet,
+    compositeUrl,
+} from '../components/CaseImage';
+
+// Number of upcoming cases whose images are preloaded while the current one is scored
+const LOOKAHEAD = 3;
+
+// Warm the browser cache with the images of the next cases in the queue,
+// picking the same WebP size the image panel will request
+const preload = (url: string, variants: ImageVariant[] | undefined, originalWidth?: number) => {
+    const img = new Image();
+    if (variants?.length) {
+        img.sizes = CASE_IMAGE_SIZES;
+        img.srcset = buildSrcSet(variants, url, originalWidth);
+    }
+    img.src = url;
+};
+
+const preloadComposite = (c: Case) => {
+    const img = new Image();
+    const variants = c.variants?.image?.webp;
+    if (variants?.length) {
+        img.sizes = CASE_IMAGE_SIZES;
+        img.srcset = buildCompositeSrcSet(c.id, variants, c.metadata?.width as number | undefined);
+    }
+    img.src = compositeUrl(c.id);
+};
+
+// Only what the viewer will show: the composite alone, or the image (plus the mask when layered in the browser)
+const preloadImages = (cases: Case[], showOverlay: boolean, compositeFailed: boolean) => {
+    cases.forEach((c) => {
+        if (showOverlay && !compositeFailed) {
+            preloadComposite(c);
+            return;
+        }
+        preload(c.imageUrl, c.variants?.image?.webp, c.metadata?.width as number | undefined);
+        if (showOverlay) {
+            preload(c.maskUrl, c.variants?.mask?.webp, c.metadata?.overlay_width as number | undefined);
+        }
+    });
+};
 
 export default function EvaluationPage() {
 
     const [currentCase, setCurrentCase] = useState<Case | null>(null);
+    const [upcoming, setUpcoming] = useState<Case[]>([]);
     const [progress, setProgress] = useState<EvaluationProgress>({ completed: 0, total: 0 });
     const [showOverlay, setShowOverlay] = useState(true);
+    // Set once the composite endpoint fails (e.g. server without Pillow); the mask is then layered client-side
+    const [compositeFailed, setCompositeFailed] = useState(false);
     const [q1, setQ1] = useState<number | null>(null);
     const [q2, setQ2] = useState<number | null>(null);
     const [comments, setComments] = useState('');
@@ -16,51 +64,74 @@ export default function EvaluationPage() {
     const [isLoading, setIsLoading] = useState(true);
     const [startTime, setStartTime] = useState<number>(Date.now());
     const [isComplete, setIsComplete] = useState(false);
+    // When every pending case is leased to someone else: time (ms) at which to ask again
+    const [retryAt, setRetryAt] = useState<number | null>(null);
+
+    const applySession = useCallback((session: EvaluationSession) => {
+        if (session.case) {
+            setCurrentCase(session.case);
+            setStartTime(Date.now());
+            setRetryAt(null);
+        } else if (session.retryAfter) {
+            setCurrentCase(null);
+            setRetryAt(Date.now() + session.retryAfter * 1000);
+        } else {
+            setIsComplete(true);
+        }
+        setProgress(session.progress);
+        setUpcoming(session.upcoming);
+    }, []);
 
-    const fetchNextCase = useCallback(async () => {
+    const fetchSession = useCallback(async () => {
         setIsLoading(true);
         try {
-            const [caseRes, progressRes] = await Promise.all([
-                api.get('/evaluations/next-case'),
-                api.get('/evaluations/progress'),
-            ]);
-
-            if (caseRes.data) {
-                setCurrentCase(caseRes.data);
-                setStartTime(Date.now());
-            } else {
-                setIsComplete(true);
-            }
-            setProgress(progressRes.data);
+            const res = await api.get<EvaluationSession>('/evaluations/session', {
+                params: { lookahead: LOOKAHEAD },
+            });
+            applySession(res.data);
         } catch (error) {
             console.error('Error fetching case:', error);
         } finally {
             setIsLoading(false);
         }
-    }, []);
+    }, [applySession]);
+
+    useEffect(() => {
+        fetchSession();
+    }, [fetchSession]);
+
+    useEffect(() => {
+        if (retryAt === null) return;
+        const timer = setTimeout(fetchSession, Math.max(retryAt - Date.now(), 0));
+        return () => clearTimeout(timer);
+    }, [retryAt, fetchSession]);
 
+    // Also re-run when the overlay is toggled, so the next cases are warmed in the new mode
     useEffect(() => {
-        fetchNextCase();
-    }, [fetchNextCase]);
+        preloadImages(upcoming, showOverlay, compositeFailed);
+    }, [upcoming, showOverlay, compositeFailed]);
 
     const handleSubmit = async () => {
         if (q1 === null || q2 === null || !currentCase) return;
 
         setIsSubmitting(true);
         try {
-            await api.post('/evaluations', {
+            // Submit and receive the next case in the same round trip
+            const res = await api.post<EvaluationSession>('/evaluations/submit-and-next', {
                 case_id: currentCase.id,
                 q1_acceptability: q1,
                 q2_confidence: q2,
                 comments: comments || null,
                 duration_ms: Date.now() - startTime,
+            }, {
+                params: { lookahead: LOOKAHEAD },
             });
 
-            // Reset form and fetch next case
+            // Reset form and show next case
             setQ1(null);
             setQ2(null);
             setComments('');
-            await fetchNextCase();
+            applySession(res.data);
         } catch (error) {
             console.error('Error submitting evaluation:', error);
         } finally {
@@ -133,24 +204,48 @@ export default function EvaluationPage() {
                                 </div>
                             ) : currentCase ? (
                                 <div className="relative w-full h-full max-h-full">
-                                    {/* Base Image */}
-                                    <img
-                                        src={currentCase.imageUrl}
-                                        alt="Imagen de fondo de ojo"
-                                        className="absolute inset-0 w-full h-full object-contain"
-                                    />
-                                    {/* Overlay Mask */}
-                                    {showOverlay && (
-                                        <div className="absolute inset-0 transition-opacity duration-300 ease-in-out">
-                                            <img
-                                                src={currentCase.maskUrl}
-                                                alt="Máscara de segmentación"
-                                                className="w-full h-full object-contain"
-                                                style={{ opacity: 0.8 }}
+                                    {showOverlay && !compositeFailed ? (
+                                        /* Overlay composited on the server: one opaque image replaces image + mask */
+                                        <img
+                                            src={compositeUrl(currentCase.id)}
+                                            srcSet={currentCase.variants?.image?.webp?.length
+                                                ? buildCompositeSrcSet(currentCase.id, currentCase.variants.image.webp, currentCase.metadata?.width as number | undefined)
+                                                : undefined}
+                                            sizes={CASE_IMAGE_SIZES}
+                                            alt="Imagen con máscara de segmentación"
+                                            className="absolute inset-0 w-full h-full object-contain"
+                                            onError={() => setCompositeFailed(true)}
+                                        />
+                                    ) : (
+                                        <>
+                                            {/* Base Image */}
+                                            <CaseImage
+                                                src={currentCase.imageUrl}
+                                                variants={currentCase.variants?.image}
+                                                originalWidth={currentCase.metadata?.width as number | undefined}
+                                                alt="Imagen de fondo de ojo"
+                                                className="absolute inset-0 w-full h-full object-contain"
                                             />
-                                        </div>
+                                            {/* Overlay Mask: layered in the browser when the composite is unavailable */}
+                                            {showOverlay && (
+                                                <div className="absolute inset-0 transition-opacity duration-300 ease-in-out">
+                                                    <CaseImage
+                                                        src={currentCase.maskUrl}
+                                                        variants={currentCase.variants?.mask}
+                                                        originalWidth={currentCase.metadata?.overlay_width as number | undefined}
+                                                        alt="Máscara de segmentación"
+                                                        className="w-full h-full object-contain"
+                                                        style={{ opacity: OVERLAY_OPACITY }}
+                                                    />
+                                                </div>
+                                            )}
+                                        </>
                                     )}
                                 </div>
+                            ) : retryAt !== null ? (
+                                <div className="text-clinical-muted text-center px-6">
+                                    Los casos pendientes están siendo evaluados por otros expertos. Reintentando en unos segundos...
+                                </div>
                             ) : (
                                 <div className="text-clinical-muted">No hay imagen disponible</div>
                             )}
@@ -2,7 +2,7 @@ import axios from 'axios';
 
 // In production (AWS), use '/api' which is proxied by Nginx to the backend
 // In local development, set VITE_API_URL=http://localhost:8000 in .env.local
-const API_BASE_URL = import.meta.env.VITE_API_URL || '/api';
+export const API_BASE_URL = import.meta.env.VITE_API_URL || '/api';
 
 const api = axios.create({
     baseURL: API_BASE_URL,
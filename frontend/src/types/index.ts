@@ -7,11 +7,23 @@ export interface User {
     name?: string;
 }
 
+export interface ImageVariant {
+    width: number;
+    url: string;
+}
+
+// Downscaled derivatives per format ("webp", "avif"), by ascending width
+export type ImageVariants = Record<string, ImageVariant[]>;
+
 export interface Case {
     id: string;
     imageUrl: string;
     maskUrl: string;
     metadata?: Record<string, unknown>;
+    variants?: {
+        image?: ImageVariants;
+        mask?: ImageVariants;
+    };
 }
 
 export interface Evaluation {
@@ -35,3 +47,10 @@ export interface EvaluationProgress {
     completed: number;
     total: number;
 }
+
+export interface EvaluationSession {
+    case: Case | null;
+    progress: EvaluationProgress;
+    upcoming: Case[];
+    retryAfter?: number | null; // seconds; every pending case is currently leased to another evaluator
+}
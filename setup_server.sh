@@ -107,6 +107,7 @@ User=ubuntu
 Group=www-data
 WorkingDirectory=$PROJECT_ROOT/backend
 Environment=\"PATH=$PROJECT_ROOT/backend/venv/bin\"
+Environment=\"SQLITE_PROFILE=production\"
 ExecStart=$PROJECT_ROOT/backend/venv/bin/gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app --bind 0.0.0.0:8000
 
 [Install]